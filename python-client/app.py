@@ -1,6 +1,7 @@
 # %%
+import os
 from pathlib import Path
-from udp_thread import udp_loop
+from udp_socket import bind_udp
 
 # %%
 if __name__ == "__main__":
@@ -10,7 +11,9 @@ if __name__ == "__main__":
     parser.add_argument(
         'port', type=int, help='Port number of the UDP server', default=8099, nargs='?')
     parser.add_argument(
-        '--window', type=int, default=2, help='Window size for data display in seconds'
+        '--window', type=int, default=2,
+        help='Window size for data display in seconds, up to 600. Each board takes up to 240 kB of shared '
+             'memory per second of window (116 MiB for 600 s), and each plot window as much again (default: 2)'
     )
     parser.add_argument(
         '--host', type=str, default='0.0.0.0', help='Listen address (default: 0.0.0.0)'
@@ -19,21 +22,212 @@ if __name__ == "__main__":
         '--datapath', type=Path, default=Path.cwd() / 'data', help='Path to store NetCDF files'
     )
     parser.add_argument(
-        '--savekind', type=str, choices=['excel', 'netcdf'], default='excel',
-        help='Kind of data storage: excel or netcdf (default: netcdf)'
+        '--savekind', type=str, choices=['excel', 'netcdf', 'parquet'], default='excel',
+        help='Kind of data storage: excel, netcdf or parquet (default: excel)'
+    )
+    parser.add_argument(
+        '--rcvbuf', type=int, default=4*1024*1024,
+        help='Kernel receive buffer size in bytes (default: 4 MiB)'
+    )
+    parser.add_argument(
+        '--complevel', type=int, default=4, choices=range(10), metavar='{0-9}',
+        help='NetCDF zlib compression level, 0 disables compression (default: 4)'
+    )
+    parser.add_argument(
+        '--no-shuffle', action='store_true', help='Disable the NetCDF shuffle filter'
+    )
+    parser.add_argument(
+        '--chunksize', type=int, default=4096, help='NetCDF samples per chunk and per write (default: 4096)'
+    )
+    parser.add_argument(
+        '--sync-interval', type=float, default=10.0, help='Seconds between NetCDF flushes to disk (default: 10)'
+    )
+    parser.add_argument(
+        '--codec', type=str, choices=['zstd', 'lz4'], default='zstd', help='Parquet compression codec (default: zstd)'
+    )
+    parser.add_argument(
+        '--row-group', type=int, default=65536, help='Parquet samples per row group (default: 65536)'
+    )
+    parser.add_argument(
+        '--record-queue', type=int, default=256,
+        help='Frames waiting in memory for the recorder process and for each storage writer (default: 256)'
+    )
+    parser.add_argument(
+        '--record-overflow', type=str, choices=['spill', 'drop'], default='spill',
+        help='Beyond --record-queue, spill frames to a temporary file or drop them; '
+             'the ingest never waits for the recorder (default: spill)'
+    )
+    parser.add_argument(
+        '--server', type=str, choices=['select', 'asyncio'], default='select',
+        help='UDP server implementation (default: select)'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help='Number of ingest processes; boards are spread over them by source address. '
+             'Not with --capture or --server asyncio (default: 1)'
+    )
+    parser.add_argument(
+        '--capture', type=Path, default=None, help='Append every received datagram to this raw capture file'
+    )
+    parser.add_argument(
+        '--replay', type=Path, default=None, help='Replay a raw capture file instead of listening on the network'
+    )
+    parser.add_argument(
+        '--speed', type=float, default=1.0, help='Replay speed, 0 replays as fast as possible (default: 1)'
+    )
+    display = parser.add_mutually_exclusive_group()
+    display.add_argument(
+        '--headless', action='store_true',
+        help='Record every board from the moment it connects, without plot windows'
+    )
+    display.add_argument(
+        '--dashboard', action='store_true',
+        help='Plot all boards in a single window instead of one window per board'
+    )
+    parser.add_argument(
+        '--session-timeout', type=float, default=120.0,
+        help='Seconds without data before a board is disconnected; with --id-code a board that '
+             'reconnects from another port sooner resumes its window and recording, 0 never disconnects (default: 120)'
+    )
+    parser.add_argument(
+        '--id-code', type=lambda code: int(code, 0), default=None,
+        help='Measurement type code of the board ID records, as the firmware serializes them; '
+             'without it boards are not identified and a board that reconnects from another port '
+             'gets a new window and recording, see decoder.ID_CODE (default: $KIWI_ID_CODE)'
+    )
+    parser.add_argument(
+        '--no-blit', action='store_true',
+        help='Redraw the whole figure every frame instead of blitting the plotted lines'
+    )
+    parser.add_argument(
+        '--fps', type=float, default=30,
+        help='Target frames per second of the plot windows; frames without new data are skipped '
+             'and the polar and baro panels slowed down first when a frame overruns (default: 30)'
+    )
+    parser.add_argument(
+        '--decimate', type=str, choices=['minmax', 'lttb', 'none'], default='minmax',
+        help='Reduce plot lines to about one bucket per pixel: min/max, LTTB or none (default: minmax)'
+    )
+    parser.add_argument(
+        '--metrics-port', type=int, default=None,
+        help='Serve stage timings, counts and queue depths in the Prometheus text format on this HTTP port'
+    )
+    parser.add_argument(
+        '--metrics-log', type=Path, default=None, help='Append the metrics to this JSON lines file'
+    )
+    parser.add_argument(
+        '--metrics-interval', type=float, default=10.0, help='Seconds between lines of --metrics-log (default: 10)'
     )
     args = parser.parse_args()
+    if args.workers > 1 and args.replay is None:
+        # The workers always run the select server and capture nothing
+        if args.capture is not None:
+            parser.error('--capture needs a single worker, drop --workers')
+        if args.server == 'asyncio':
+            parser.error('--server asyncio needs a single worker, drop --workers')
+    sock = None
+    if args.replay is None and args.workers == 1:
+        # Bind first, the kernel queues the datagrams while the rest starts up
+        sock = bind_udp(args.host, args.port, args.rcvbuf)
+    if args.id_code is not None:
+        # Read by the decoder at import, here and in every process started from here
+        os.environ['KIWI_ID_CODE'] = hex(args.id_code)
+    # Loaded after binding: numpy and the decoder take most of the startup time
+    try:
+        from udp_thread import buffer_bytes, replay_loop, udp_loop
+    except ValueError as e:  # An ID code taken by a sensor measurement
+        parser.error(str(e))
+    from decoder import ID_CODE
+    if ID_CODE is None:
+        print("Boards are not identified without --id-code, a board that reconnects from another port is a new client")
+    else:
+        print(f"Identifying boards by their ID records, type {ID_CODE:#06x}")
     winsize = args.window*1000
     if winsize < 1000:
         print(f"Window size {winsize} ms is too small, setting to 1000 ms")
         winsize = 1000
-    elif winsize > 10000:
-        print(f"Window size {winsize} ms is too large, setting to 10000 ms")
-        winsize = 10000
-    # Main thread loops here
-    udp_loop(
-        args.host, args.port,
-        datapath=args.datapath,
-        winsize=winsize,
-        savekind=args.savekind
+    elif winsize > 600000:
+        print(f"Window size {winsize} ms is too large, setting to 600000 ms")
+        winsize = 600000
+    if buffer_bytes(winsize) >= 64 * 2**20:
+        print(f"Window size {winsize} ms takes {buffer_bytes(winsize) / 2**20:.0f} MiB of shared memory "
+              "per board, and as much in each plot window")
+    store_options = {}
+    if args.savekind == 'netcdf':
+        store_options = dict(
+            complevel=args.complevel, shuffle=not args.no_shuffle,
+            chunksize=args.chunksize, sync_interval=args.sync_interval
+        )
+    elif args.savekind == 'parquet':
+        store_options = dict(codec=args.codec, row_group_size=args.row_group)
+    store_options.update(queue_size=args.record_queue, overflow=args.record_overflow)
+    plot_options = dict(
+        frametime=int(1e9 / max(args.fps, 0.1)),
+        blit=not args.no_blit,
+        decimate=None if args.decimate == 'none' else args.decimate
+    )
+    metrics_options = dict(
+        metrics_port=args.metrics_port,
+        metrics_log=args.metrics_log,
+        metrics_interval=args.metrics_interval
     )
+    # Main thread loops here
+    if args.replay is not None:
+        replay_loop(
+            args.replay, args.speed,
+            datapath=args.datapath,
+            winsize=winsize,
+            savekind=args.savekind,
+            store_options=store_options,
+            headless=args.headless,
+            dashboard=args.dashboard,
+            plot_options=plot_options
+        )
+    elif args.workers > 1:
+        from workers import supervise
+        supervise(
+            args.workers, args.host, args.port,
+            datapath=args.datapath,
+            winsize=winsize,
+            savekind=args.savekind,
+            rcvbuf=args.rcvbuf,
+            store_options=store_options,
+            headless=args.headless,
+            dashboard=args.dashboard,
+            plot_options=plot_options,
+            session_timeout=args.session_timeout,
+            **metrics_options
+        )
+    elif args.server == 'asyncio':
+        from udp_async import udp_async_loop
+        udp_async_loop(
+            args.host, args.port,
+            datapath=args.datapath,
+            winsize=winsize,
+            savekind=args.savekind,
+            rcvbuf=args.rcvbuf,
+            store_options=store_options,
+            capture=args.capture,
+            headless=args.headless,
+            dashboard=args.dashboard,
+            plot_options=plot_options,
+            sock=sock,
+            session_timeout=args.session_timeout,
+            **metrics_options
+        )
+    else:
+        udp_loop(
+            args.host, args.port,
+            datapath=args.datapath,
+            winsize=winsize,
+            savekind=args.savekind,
+            rcvbuf=args.rcvbuf,
+            store_options=store_options,
+            capture=args.capture,
+            headless=args.headless,
+            dashboard=args.dashboard,
+            plot_options=plot_options,
+            sock=sock,
+            session_timeout=args.session_timeout,
+            **metrics_options
+        )
@@ -0,0 +1,115 @@
+# %%
+from __future__ import annotations
+from pathlib import Path
+import pickle
+from queue import Empty, Full, Queue
+import tempfile
+from typing import IO, Any, Literal, Optional
+
+# %% Overload policies
+#
+# Display consumers only care about the newest state: their queues are
+# bounded and :func:`put_latest` drops the oldest message to make room, so
+# the producer never waits. Recording should not lose frames: a
+# :class:`RecordQueue` keeps at most ``maxsize`` frames in memory and then
+# blocks the producer, spills the overflow to disk or drops it. The ingest
+# process never blocks, neither on a display nor on its recorder: what the
+# recorder's bounded queue has no room for waits in a RecordQueue of the
+# ingest, see :meth:`udp_thread.Ingest.post`.
+
+DISPLAY_DEPTH = 4  # Messages a display queue holds before dropping the oldest
+RECORD_DEPTH = 256  # Frames a recording queue holds in memory
+
+Overflow = Literal['block', 'spill', 'drop']
+
+
+def put_latest(queue: Any, item: Any) -> bool:
+    """Put ``item`` on a bounded queue without waiting, dropping the oldest item when full.
+
+    Works for :class:`queue.Queue` and :class:`multiprocessing.Queue` alike. An
+    item a multiprocessing queue has not flushed to its pipe yet cannot be taken
+    back, the new item is dropped instead.
+
+    Returns:
+        bool: True if an item was dropped.
+    """
+    try:
+        queue.put_nowait(item)
+        return False
+    except Full:
+        pass
+    try:
+        queue.get_nowait()
+    except Empty:
+        pass  # Taken by the consumer meanwhile
+    try:
+        queue.put_nowait(item)
+    except Full:
+        pass  # Refilled meanwhile, the new item is the one dropped
+    return True
+
+
+class RecordQueue(Queue):
+    """Frames for a storage thread, at most ``maxsize`` of them in memory.
+
+    When full, ``overflow`` decides: 'block' makes :meth:`put` wait for the
+    storage thread, 'spill' appends the frame to a temporary file in
+    ``spill_dir`` instead. Spilled frames are read back in order once the
+    frames in memory have been taken. With 'drop' :meth:`offer` drops the
+    frame instead, while :meth:`put` always keeps it, e.g. for messages that
+    must not be lost.
+    """
+
+    def __init__(self, maxsize: int = RECORD_DEPTH, overflow: Overflow = 'spill', spill_dir: Optional[Path] = None):
+        super().__init__(maxsize if overflow == 'block' else 0)
+        self.limit = maxsize
+        self.overflow = overflow
+        self.spill_dir = spill_dir
+        self.spilled = 0  # Frames spilled to disk in total
+        self.dropped = 0  # Frames dropped by :meth:`offer` in total
+        self._file: Optional[IO[bytes]] = None
+        self._offset = 0  # Position of the next spilled frame
+        self._pending = 0  # Spilled frames not read back yet
+
+    def offer(self, item: Any) -> bool:
+        """Put a frame that may be lost: with overflow 'drop' it is dropped when the queue is full.
+
+        Returns:
+            bool: False if the frame was dropped.
+        """
+        with self.mutex:
+            drop = self.overflow == 'drop' and self._qsize() >= self.limit
+            self.dropped += drop
+        if drop:
+            return False
+        self.put(item)
+        return True
+
+    # Called by Queue with its mutex held
+    def _qsize(self) -> int:
+        return len(self.queue) + self._pending
+
+    def _put(self, item: Any):
+        if self.overflow != 'spill' or (not self._pending and len(self.queue) < self.limit):
+            self.queue.append(item)
+            return
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(prefix='spill_', dir=self.spill_dir)
+        self._file.seek(0, 2)
+        pickle.dump(item, self._file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._pending += 1
+        self.spilled += 1
+
+    def _get(self) -> Any:
+        if self.queue:
+            return self.queue.popleft()
+        self._file.seek(self._offset)
+        item = pickle.load(self._file)
+        self._pending -= 1
+        if self._pending:
+            self._offset = self._file.tell()
+        else:  # All read back, start over
+            self._file.seek(0)
+            self._file.truncate()
+            self._offset = 0
+        return item
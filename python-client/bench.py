@@ -0,0 +1,492 @@
+# %%
+from __future__ import annotations
+import argparse
+from contextlib import redirect_stdout
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from importlib import import_module
+import io
+import json
+from multiprocessing import Process, Queue as MpQueue
+import os
+from pathlib import Path
+import platform
+from queue import Queue
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+from time import perf_counter, sleep
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from pandas import DataFrame
+
+import synth
+from decoder import COLUMNS, DataBuffer, decode_batch, decode_packet
+from derived import SENSORS, all_columns, derive
+
+# %% Synthetic data
+
+RECORDS_PER_DATAGRAM = 64  # 16 samples of the four sensors
+
+
+def deltas(seconds: float, rate: float, fps: float, id: int = 0) -> Iterator[Tuple[Tuple[np.ndarray, ...], ...]]:
+    """Yield the samples of every sensor received during each frame.
+
+    Args:
+        seconds (float): Simulated duration in seconds.
+        rate (float): Samples per second of each sensor.
+        fps (float): Plot frames per second.
+        id (int, optional): Board index for the synthetic signals. Defaults to 0.
+    """
+    elapsed = np.arange(int(seconds * rate)) / rate
+    tstamp = (elapsed * 1e6).astype(np.int64)
+    values = synth.samples(elapsed, id)
+    start = 0
+    for now in np.arange(1, int(seconds * fps) + 1) / fps:
+        stop = np.searchsorted(elapsed, now, side='right')
+        yield tuple(
+            (tstamp[start:stop], *vals[start:stop].T)
+            for vals in values.values()
+        )
+        start = stop
+
+
+def recorded(seconds: float, rate: float, handoffs: float, id: int = 0) -> Iterator[Tuple[DataFrame, ...]]:
+    """Yield the frames the recorder hands to storage: every new sample once, with its derived channels.
+
+    Args:
+        seconds (float): Simulated duration in seconds.
+        rate (float): Samples per second of each sensor.
+        handoffs (float): Hand-offs of the ingest to the recorder per second, see :mod:`recorder`.
+        id (int, optional): Board index for the synthetic signals. Defaults to 0.
+    """
+    for frame in deltas(seconds, rate, handoffs, id):
+        yield tuple(
+            DataFrame(dict(zip(names, (tstamp, *derive(sensor, np.stack(values, axis=1)).T))), copy=False)
+            for (tstamp, *values), sensor, names in zip(frame, SENSORS, all_columns())
+        )
+
+def datagrams(num: int, rate: float = 1000.0) -> List[bytes]:
+    """``num`` datagrams of consecutive samples of one board."""
+    per = RECORDS_PER_DATAGRAM // 4
+    elapsed = np.arange(num * per) / rate
+    recs = synth.records(elapsed)
+    return [recs[i:i+RECORDS_PER_DATAGRAM].tobytes() for i in range(0, len(recs), RECORDS_PER_DATAGRAM)]
+
+# %% Benchmarks
+
+
+def bench_netcdf(args):
+    from netCDF4 import Dataset
+    from nc_thread import NcThread
+    with tempfile.TemporaryDirectory() as tmp:
+        fname = Path(tmp) / 'bench.nc'
+        queue = Queue()
+        thread = NcThread(
+            queue, fname,
+            complevel=args.complevel, shuffle=not args.no_shuffle,
+            chunksize=args.chunksize, sync_interval=args.sync_interval
+        )
+        data = list(recorded(args.seconds, args.rate, args.handoffs))
+        start = perf_counter()
+        thread.start()
+        for frame in data:
+            queue.put(frame)
+        queue.shutdown()  # Let the thread drain the queue and close the file
+        thread.join()
+        elapsed = perf_counter() - start
+        size = fname.stat().st_size / 1e6
+        with Dataset(fname) as ds:
+            written = sum(len(group.variables['tstamp']) for group in ds.groups.values())
+    nsamples = int(args.seconds * args.rate) * len(COLUMNS)
+    if written != nsamples:
+        sys.exit(f"Wrote {written} samples, expected {nsamples}")
+    print(f"Simulated {args.seconds:.0f} s at {args.rate:.0f} Hz, "
+          f"{args.handoffs:g} hand-offs per second ({nsamples} samples, {len(data)} frames)")
+    print(f"Wall time: {elapsed:.2f} s ({nsamples / elapsed:.0f} samples/s)")
+    print(f"File size: {size:.2f} MB, written at {size / elapsed:.2f} MB/s")
+    print(f"File size per hour of data: {size * 3600 / args.seconds:.1f} MB")
+
+
+def bench_render(args):
+    os.environ['MPLBACKEND'] = 'Agg'  # Offscreen, same figure size as the plot window
+    import matplotlib.pyplot as plt
+    from decoder import DataBuffer
+    from derived import channels
+    from plot import SensorFigure
+    decimate = None if args.decimate == 'none' else args.decimate
+    data = list(deltas(args.seconds, args.rate, args.fps))
+    maxlen = int(args.window * 1e-3 * args.rate) + 1
+    print(f"Rendering {len(data)} frames of a {args.window} ms window at {args.rate:.0f} Hz, "
+          f"decimation: {args.decimate}")
+    # Secondary panels every frame, and every 4th as a loaded FrameScheduler updates them
+    for blit, stride in ((False, 1), (True, 1), (True, 4)):
+        plots = SensorFigure(('bench', 0), args.window, blit=blit, decimate=decimate)
+        buffers = [DataBuffer(maxlen=maxlen, channels=channels(sensor)) for sensor in SENSORS]
+        plots.render(full=True)
+        full = 0
+        start = perf_counter()
+        for num, frame in enumerate(data):
+            frame_deltas = []
+            for buf, sensor, (tstamp, *values) in zip(buffers, SENSORS, frame):
+                values = derive(sensor, np.array(values).T)  # As the ingest stores them
+                buf.extend(tstamp, values)
+                frame_deltas.append((tstamp, *values.T))
+            redraw = plots.update(buffers, frame_deltas, secondary=num % stride == 0)
+            plots.render(redraw)
+            full += redraw or not blit
+        elapsed = perf_counter() - start
+        plt.close(plots.fig)
+        mode = ('Blit' if blit else 'Full draw') + (f", polar/baro every {stride} frames" if stride > 1 else '')
+        print(f"{mode}: {len(data) / elapsed:.1f} FPS "
+              f"({elapsed / len(data) * 1e3:.2f} ms/frame, {full} full draws)")
+
+
+def recorded_tstamps(datapath: Path, savekind: str) -> np.ndarray:
+    """Accelerometer timestamps of every recording in ``datapath``."""
+    tstamps = []
+    if savekind == 'parquet':
+        import pyarrow.parquet as pq
+        for fname in datapath.glob('*_accel.parquet'):
+            tstamps.append(pq.read_table(fname, columns=['tstamp'])['tstamp'].to_numpy())
+    else:
+        from netCDF4 import Dataset
+        for fname in datapath.glob('*.nc'):
+            with Dataset(fname) as ds:
+                if 'accel' in ds.groups:
+                    tstamps.append(ds.groups['accel'].variables['tstamp'][:].filled())
+    return np.sort(np.concatenate(tstamps)) if tstamps else np.zeros(0)
+
+
+def bench_startup(args):
+    app = Path(__file__).with_name('app.py')
+    dest = ('127.0.0.1', args.port)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    print(f"Launching app.py --headless and sending {args.rate:.0f} samples/s from launch")
+    firsts = []
+    for run in range(args.repeat):
+        with tempfile.TemporaryDirectory() as tmp:
+            cmd = [sys.executable, str(app), str(args.port), '--headless',
+                   '--savekind', args.savekind, '--datapath', tmp, *args.app_args]
+            start = perf_counter()
+            proc = subprocess.Popen(
+                cmd, cwd=app.parent, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            sent = 0
+            while (elapsed := perf_counter() - start) < args.seconds:
+                # Each sample is stamped with the microseconds since launch
+                for rec in synth.records(np.array([elapsed])):  # One record per datagram
+                    try:
+                        sock.sendto(rec.tobytes(), dest)
+                    except ConnectionRefusedError:
+                        pass  # ICMP port unreachable for an earlier datagram
+                sent += 1
+                sleep(1 / args.rate)
+            sleep(0.5)
+            proc.send_signal(signal.SIGINT)
+            proc.wait(timeout=60)
+            kept = recorded_tstamps(Path(tmp), args.savekind)
+        if len(kept) == 0:
+            print(f"Run {run + 1}: no samples recorded")
+            continue
+        first = kept[0] * 1e-3
+        firsts.append(first)
+        print(f"Run {run + 1}: first sample kept was sent {first:.0f} ms after launch, "
+              f"{len(kept)} of {sent} samples kept")
+    if firsts:
+        print(f"Time to first packet accepted: {np.median(firsts):.0f} ms (median of {len(firsts)})")
+
+
+# %% Micro-benchmark suite
+#
+# Every case times one hot-path operation on synthetic records with the
+# payload codes and shapes of udp-dummy-server (see :func:`synth.records`),
+# keeps the best of ``repeat`` runs and reports a throughput. Results are
+# saved as ``<commit>.json`` in the results directory, so a later run can be
+# compared against any earlier commit with ``--compare``.
+
+RESULTS = Path(__file__).with_name('bench_results')
+
+
+@dataclass
+class Result:
+    name: str
+    value: float  # Throughput of the best run
+    unit: str
+    seconds: float  # Wall time of the best run
+
+
+# A case runs its operation over a fixed workload and returns the amount of
+# work done, e.g. records decoded or MB written
+Case = Callable[[], float]
+CASES: Dict[str, Callable[[argparse.Namespace], Tuple[Case, str]]] = {}
+CLEANUP: List[Callable[[], None]] = []  # Run after every case, e.g. to stop helper processes
+
+
+def case(name: str):
+    """Register a benchmark case factory under ``name``."""
+    def register(factory):
+        CASES[name] = factory
+        return factory
+    return register
+
+
+def best_of(func: Case, repeat: int) -> Tuple[float, float]:
+    """Best wall time of ``repeat`` calls and the work count of that call."""
+    best, work = float('inf'), 0.0
+    for _ in range(repeat):
+        start = perf_counter()
+        count = func()
+        elapsed = perf_counter() - start
+        if elapsed < best:
+            best, work = elapsed, count
+    return best, work
+
+
+@case('decode_batch')
+def decode_batch_case(args):
+    data = datagrams(2000)
+    def run():
+        for payload in data:
+            decode_batch(payload)
+        return len(data) * RECORDS_PER_DATAGRAM
+    return run, 'records/s'
+
+
+@case('decode_packet')
+def decode_packet_case(args):
+    data = datagrams(50)
+    buffers = [DataBuffer(maxlen=4096) for _ in range(4)]
+    records = [payload[i:i+24] for payload in data for i in range(0, len(payload), 24)]
+    def run():
+        for rec in records:
+            decode_packet(rec, *buffers)
+        return len(records)
+    return run, 'records/s'
+
+
+@case('buffer_extend')
+def buffer_extend_case(args):
+    # As the ingest buffers: 2 s at 1 kHz with the reorder stage
+    batches = [decode_batch(payload).accel for payload in datagrams(4000)]
+    def run():
+        buf = DataBuffer(maxlen=2000, span=2_000_000, reorder=20_000)
+        for tstamp, values in batches:
+            buf.extend(tstamp, values)
+        return len(batches) * RECORDS_PER_DATAGRAM // 4
+    return run, 'samples/s'
+
+
+@case('derive')
+def derive_case(args):
+    # Derived channels of every accel, gyro and mag batch, as the ingest computes them
+    batches = [decode_batch(payload) for payload in datagrams(4000)]
+    def run():
+        for batch in batches:
+            for sensor in ('accel', 'gyro', 'mag'):
+                derive(sensor, getattr(batch, sensor)[1])
+        return len(batches) * RECORDS_PER_DATAGRAM * 3 // 4
+    return run, 'samples/s'
+
+
+@case('buffer_window')
+def buffer_window_case(args):
+    # Window queries on a full 60 s ring at 1 kHz, wrapped around its end
+    buf = DataBuffer(maxlen=60_000)
+    elapsed = np.arange(100_000) / 1000
+    buf.extend((elapsed * 1e6).astype(np.int64), synth.accel(elapsed))
+    starts = np.random.default_rng(0).uniform(40e6, 98e6, 2000)
+    def run():
+        for t0 in starts:
+            buf.window(t0, t0 + 2e6)
+        return len(starts)
+    return run, 'queries/s'
+
+
+@case('to_dataframe')
+def to_dataframe_case(args):
+    # Serializing a 2 s window at 1 kHz, as handed to storage
+    buf = DataBuffer(maxlen=2000)
+    elapsed = np.arange(5000) / 1000
+    buf.extend((elapsed * 1e6).astype(np.int64), synth.accel(elapsed))
+    def run():
+        for _ in range(200):
+            buf.to_dataframe(COLUMNS[0])
+        return 200
+    return run, 'frames/s'
+
+
+def echo(request: MpQueue, response: MpQueue):
+    """Answer every request until None, like the ingest answers draw_loop."""
+    while (item := request.get()) is not None:
+        response.put(item)
+
+
+@case('ipc_handoff')
+def ipc_handoff_case(args):
+    # Request/response round trip of draw_loop plus the copy out of shared memory
+    from shmring import SharedDataBuffer, SharedDataView
+    shared = SharedDataBuffer(maxlen=2048)
+    view = SharedDataView(*shared.spec())
+    batches = [decode_batch(payload).accel for payload in datagrams(500)]
+    request, response = MpQueue(maxsize=1), MpQueue()
+    proc = Process(target=echo, args=(request, response), daemon=True)
+    proc.start()
+    def run():
+        cursor = 0
+        for tstamp, values in batches:
+            shared.extend(tstamp, values)
+            request.put(1)
+            response.get()
+            cursor, _ = view.since(cursor)
+        return len(batches)
+    def cleanup():
+        request.put(None)
+        proc.join()
+        view.close()
+        shared.close()
+    CLEANUP.append(cleanup)
+    return run, 'frames/s'
+
+
+def writer_case(module: str, cls: str, suffix: str):
+    """Throughput of a storage thread writing ``--writer-seconds`` of data."""
+    def factory(args):
+        Thread = getattr(import_module(module), cls)
+        data = list(recorded(args.writer_seconds, args.rate, 2))
+        def run():
+            with tempfile.TemporaryDirectory() as tmp, redirect_stdout(io.StringIO()):
+                queue = Queue()
+                thread = Thread(queue, Path(tmp) / f'bench{suffix}')
+                thread.start()
+                for frame in data:
+                    queue.put(frame)
+                queue.shutdown()  # Let the thread drain the queue and close the file
+                thread.join()
+                size = sum(f.stat().st_size for f in Path(tmp).iterdir())
+            return size / 1e6
+        return run, 'MB/s'
+    return factory
+
+
+case('write_netcdf')(writer_case('nc_thread', 'NcThread', '.nc'))
+case('write_parquet')(writer_case('parquet_thread', 'ParquetThread', ''))
+case('write_excel')(writer_case('xlsx_thread', 'XlsxThread', '.xlsx'))
+
+# %% Results
+
+
+def commit() -> str:
+    """Short hash of the checked-out commit, with ``-dirty`` for local changes."""
+    try:
+        out = subprocess.run(
+            ['git', 'describe', '--always', '--dirty'], cwd=Path(__file__).parent,
+            capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def load(ref: str, results: Path) -> Dict[str, dict]:
+    """Results saved for commit ``ref``, or in the file ``ref``."""
+    path = Path(ref) if Path(ref).is_file() else results / f'{ref}.json'
+    with open(path) as f:
+        return {res['name']: res for res in json.load(f)['results']}
+
+
+def bench_micro(args):
+    """Run the micro-benchmark cases, compare and save their results."""
+    unknown = set(args.cases) - set(CASES)
+    if unknown:
+        sys.exit(f"unknown cases: {', '.join(sorted(unknown))}")
+
+    baseline = load(args.compare, args.results) if args.compare else {}
+    results: List[Result] = []
+    for name in args.cases or CASES:
+        try:
+            run, unit = CASES[name](args)
+        except ImportError as e:
+            print(f"{name:<16} skipped: {e}")
+            continue
+        seconds, work = best_of(run, args.repeat)
+        result = Result(name, work / seconds, unit, seconds)
+        results.append(result)
+        line = f"{name:<16} {result.value:>14,.1f} {unit:<10} ({seconds * 1e3:.2f} ms)"
+        old: Optional[dict] = baseline.get(name)
+        if old is not None:
+            line += f"  {(result.value / old['value'] - 1) * 100:+.1f}% vs {args.compare}"
+        print(line)
+    for cleanup in CLEANUP:
+        cleanup()
+
+    if not args.no_save and results:
+        args.results.mkdir(parents=True, exist_ok=True)
+        rev = commit()
+        path = args.results / f'{rev}.json'
+        with open(path, 'w') as f:
+            json.dump(dict(
+                commit=rev,
+                date=datetime.now().isoformat(timespec='seconds'),
+                python=platform.python_version(),
+                machine=platform.machine(),
+                results=[asdict(res) for res in results],
+            ), f, indent=2)
+        print(f"Saved to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the Kiwi client")
+    sub = parser.add_subparsers(dest='bench', required=True)
+
+    ncp = sub.add_parser('netcdf', help='NetCDF recorder throughput and file size')
+    ncp.add_argument('--seconds', type=float, default=600, help='Simulated seconds of data (default: 600)')
+    ncp.add_argument('--rate', type=float, default=50, help='Samples per second per sensor (default: 50)')
+    ncp.add_argument('--handoffs', type=float, default=2,
+                     help='Hand-offs to the recorder per second, as the ingest frametime (default: 2)')
+    ncp.add_argument('--complevel', type=int, default=4, help='zlib compression level (default: 4)')
+    ncp.add_argument('--no-shuffle', action='store_true', help='Disable the shuffle filter')
+    ncp.add_argument('--chunksize', type=int, default=4096, help='Samples per chunk (default: 4096)')
+    ncp.add_argument('--sync-interval', type=float, default=10.0, help='Seconds between syncs (default: 10)')
+    ncp.set_defaults(func=bench_netcdf)
+
+    rdp = sub.add_parser('render', help='Plot frame rate with and without blitting')
+    rdp.add_argument('--seconds', type=float, default=30, help='Simulated seconds of data (default: 30)')
+    rdp.add_argument('--rate', type=float, default=50, help='Samples per second per sensor (default: 50)')
+    rdp.add_argument('--fps', type=float, default=10, help='Simulated frames per second (default: 10)')
+    rdp.add_argument('--window', type=int, default=2000, help='Window size in milliseconds (default: 2000)')
+    rdp.add_argument('--decimate', type=str, choices=['minmax', 'lttb', 'none'], default='minmax',
+                     help='Decimation of the plot lines (default: minmax)')
+    rdp.set_defaults(func=bench_render)
+
+    stp = sub.add_parser('startup', help='Time from launching app.py to the first datagram it keeps')
+    stp.add_argument('--port', type=int, default=18099, help='UDP port for app.py (default: 18099)')
+    stp.add_argument('--seconds', type=float, default=3, help='Seconds to send samples after launch (default: 3)')
+    stp.add_argument('--rate', type=float, default=1000, help='Samples per second (default: 1000)')
+    stp.add_argument('--repeat', type=int, default=5, help='Number of launches (default: 5)')
+    stp.add_argument('--savekind', type=str, choices=['netcdf', 'parquet'], default='parquet',
+                     help='Storage to read the kept samples back from (default: parquet)')
+    stp.add_argument('app_args', nargs=argparse.REMAINDER, help='Extra arguments for app.py')
+    stp.set_defaults(func=bench_startup)
+
+    mcp = sub.add_parser('micro', help='Micro-benchmarks of the hot paths, saved per commit')
+    mcp.add_argument('cases', nargs='*', metavar='case',
+                     help=f"Cases to run (default: all): {', '.join(CASES)}")
+    mcp.add_argument('--repeat', type=int, default=5, help='Runs per case, the best counts (default: 5)')
+    mcp.add_argument('--rate', type=float, default=1000, help='Samples per second for the writers (default: 1000)')
+    mcp.add_argument('--writer-seconds', type=float, default=60,
+                     help='Simulated seconds of data per writer run (default: 60)')
+    mcp.add_argument('--results', type=Path, default=RESULTS,
+                     help='Directory of saved results (default: bench_results next to this file)')
+    mcp.add_argument('--compare', type=str, default=None,
+                     help='Commit (or results file) to compare against')
+    mcp.add_argument('--no-save', action='store_true', help='Do not save the results')
+    mcp.set_defaults(func=bench_micro)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# %%
+from __future__ import annotations
+from pathlib import Path
+import socket
+from typing import Any, List, Tuple
+
+import numpy as np
+
+from decoder import SINGLE_MEASUREMENT_SIZE
+
+# %% Raw capture file format
+#
+# A 16-byte header (magic + record size) followed by fixed-size records, so a
+# capture can be memory-mapped as a NumPy array. Each record holds one
+# received datagram: arrival time, IPv4 source and the raw payload. Sources
+# are IPv4 only, as the server socket is, see :func:`udp_socket.bind_udp`;
+# :meth:`CaptureWriter.write` rejects any other address.
+
+CAPTURE_MAGIC = b'KIWICAP1'
+
+CAPTURE_DTYPE = np.dtype([
+    ('arrival', '<i8'),  # Arrival time, ns since the epoch
+    ('ip', 'u1', (4,)),  # Source IPv4 address
+    ('port', '<u2'),  # Source port
+    ('size', '<u2'),  # Datagram size in bytes
+    ('payload', 'u1', (SINGLE_MEASUREMENT_SIZE,)),
+])
+
+CAPTURE_HEADER_SIZE = 16
+
+
+class CaptureWriter:
+    """Appends received datagrams to a raw capture file.
+
+    Writes go through a large file buffer, so recording costs one array
+    conversion per drained batch.
+    """
+
+    def __init__(self, path: Path, buffering: int = 1 << 20):
+        self.path = path
+        new = not path.exists() or path.stat().st_size == 0
+        self._file = open(path, 'ab', buffering=buffering)
+        if new:
+            self._file.write(CAPTURE_MAGIC)
+            self._file.write(np.array(
+                [CAPTURE_DTYPE.itemsize, 0], dtype='<u4').tobytes())
+        self._ips: dict = {}  # Cache of packed source addresses
+        self.count = 0
+
+    def write(self, arrival: int, payload: bytes, addrs: List[Any], sizes: np.ndarray):
+        """Append ``len(addrs)`` datagrams received at ``arrival`` (ns).
+
+        Args:
+            arrival (int): Arrival time in ns since the epoch.
+            payload (bytes-like): The payloads, one SINGLE_MEASUREMENT_SIZE slot each.
+            addrs (List[Any]): Source address of each slot.
+            sizes (np.ndarray): Datagram size of each slot.
+
+        Raises:
+            ValueError: A source address is not IPv4. Nothing is written then.
+        """
+        count = len(addrs)
+        recs = np.zeros(count, dtype=CAPTURE_DTYPE)
+        recs['arrival'] = arrival
+        for i, addr in enumerate(addrs):
+            ip = self._ips.get(addr[0])
+            if ip is None:
+                ip = self._ips[addr[0]] = np.frombuffer(ipv4(addr), dtype=np.uint8)
+            recs['ip'][i] = ip
+            recs['port'][i] = addr[1]
+        recs['size'] = sizes[:count]
+        recs['payload'] = np.frombuffer(payload, dtype=np.uint8, count=count *
+                                        SINGLE_MEASUREMENT_SIZE).reshape(count, -1)
+        self._file.write(recs.tobytes())
+        self.count += count
+
+    def close(self):
+        self._file.close()
+
+
+def ipv4(addr: Any) -> bytes:
+    """Packed IPv4 address of a source ``(ip, port)``, see :data:`CAPTURE_DTYPE`."""
+    try:
+        if len(addr) == 2:  # IPv6 sources are (ip, port, flowinfo, scope_id)
+            return socket.inet_pton(socket.AF_INET, addr[0])
+    except (OSError, TypeError):
+        pass
+    raise ValueError(f"Capture files hold IPv4 sources only, not {addr!r}")
+
+
+def read_capture(path: Path) -> np.ndarray:
+    """Memory-map a capture file as an array of :data:`CAPTURE_DTYPE` records."""
+    with open(path, 'rb') as f:
+        header = f.read(CAPTURE_HEADER_SIZE)
+    if header[:len(CAPTURE_MAGIC)] != CAPTURE_MAGIC:
+        raise ValueError(f"{path} is not a Kiwi capture file")
+    recsize = int(np.frombuffer(header, dtype='<u4', count=1, offset=len(CAPTURE_MAGIC))[0])
+    if recsize != CAPTURE_DTYPE.itemsize:
+        raise ValueError(f"{path} has records of {recsize} bytes, expected {CAPTURE_DTYPE.itemsize}")
+    nrec = (path.stat().st_size - CAPTURE_HEADER_SIZE) // recsize
+    if nrec == 0:
+        return np.zeros(0, dtype=CAPTURE_DTYPE)
+    return np.memmap(path, dtype=CAPTURE_DTYPE, mode='r', offset=CAPTURE_HEADER_SIZE, shape=(nrec,))
+
+
+def source_addresses(recs: np.ndarray) -> Tuple[List[Any], np.ndarray]:
+    """Source addresses of capture records.
+
+    Returns:
+        Tuple[List[Any], np.ndarray]: The distinct ``(ip, port)`` tuples and,
+        for every record, the index of its address in that list.
+    """
+    keys = recs['ip'].astype(np.uint64) @ np.array([1 << 40, 1 << 32, 1 << 24, 1 << 16], dtype=np.uint64)
+    keys |= recs['port'].astype(np.uint64)
+    uniq, inverse = np.unique(keys, return_inverse=True)
+    addrs = [
+        (socket.inet_ntoa(int(key >> 16).to_bytes(4, 'big')), int(key & 0xFFFF))
+        for key in uniq.tolist()
+    ]
+    return addrs, inverse
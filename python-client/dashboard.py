@@ -0,0 +1,360 @@
+# %%
+from __future__ import annotations
+from dataclasses import dataclass
+from datetime import datetime
+from multiprocessing import Queue
+from queue import Empty
+from time import perf_counter_ns
+from typing import Any, Dict, List, Optional, Tuple
+
+import matplotlib.pyplot as plt
+from matplotlib.axes import Axes
+from matplotlib.gridspec import GridSpec, GridSpecFromSubplotSpec
+from matplotlib.lines import Line2D
+from matplotlib.widgets import Button
+
+from decimate import DecimateKind, WindowDecimator
+from decoder import clock_restarted
+from derived import channel
+from metrics import Metrics
+from plot import DPI, FrameScheduler  # Importing plot also sets up the matplotlib backend and fonts
+from shmring import SharedDataView, SharedSpec
+
+# %% Dashboard
+#
+# One plotting process for every board of an ingest process. The ingest
+# process posts ``('connect', loc, specs)``, ``('disconnect', loc)`` and
+# ``('rate', loc, info)`` on the control queue. The dashboard maps the shared
+# buffers of each board and reads them directly, so boards need no
+# request/response round trip. Only the selected board is drawn at full rate,
+# the thumbnails of the others are refreshed every ``thumbtime`` seconds. The
+# Save button posts ``(loc, recording)`` on the command queue, the ingest
+# process records the board, see :meth:`udp_thread.Ingest.control`.
+
+FIG_WID = 1100 / DPI
+FIG_HEI = 700 / DPI
+MIN_THUMBS = 6  # Thumbnail slots, more are added as boards connect
+
+
+@dataclass
+class Board:
+    loc: Any  # Source address (ip, port)
+    views: List[SharedDataView]  # accel, gyro, mag, baro
+    rate: str = "Waiting for data..."
+    recording: bool = False  # Asked the ingest process to record it
+    drawn: int = -1  # Accel samples written when last drawn
+    thumb: Optional[WindowDecimator] = None  # Accel thumbnail points
+    # Accel samples written and newest timestamp when the thumbnail was last updated
+    thumb_seen: int = 0
+    thumb_newest: int = -1
+
+    def close(self):
+        for view in self.views:
+            view.close()
+
+
+class Dashboard:
+    """Figure with the selected board on the right and thumbnails on the left.
+
+    Click a thumbnail, or press its number key, to select a board. The Save
+    button toggles recording of the selected board. Boards keep recording
+    while another one is selected.
+    """
+
+    def __init__(
+        self,
+        winsize: int,
+        decimate: Optional[DecimateKind] = 'minmax',
+        commands: Optional[Queue] = None,
+    ):
+        self.winsize = winsize
+        self.commands = commands  # Save button commands to the ingest process
+        self.decimate = decimate
+        # Plot points of the selected board, fed with the samples after ``seen``
+        self.windows = [
+            *(WindowDecimator(winsize, channel(sensor, 'r') + 1, decimate) for sensor in ('accel', 'gyro', 'mag')),
+            WindowDecimator(winsize, 3, decimate),
+        ]
+        self.seen = [0, 0, 0, 0]
+        self.newest = [-1, -1, -1, -1]  # Newest timestamps read, see :func:`clock_restarted`
+        self.metrics = Metrics()  # Render timings of this process
+        self.boards: Dict[Any, Board] = {}
+        self.selected: Optional[Any] = None
+        self.thumb_axes: Dict[Any, Axes] = {}
+        self.thumb_lines: Dict[Any, List[Line2D]] = {}
+
+        plt.ioff()
+        self.fig = plt.figure(figsize=(FIG_WID, FIG_HEI), dpi=DPI)
+        self.fig.canvas.manager.set_window_title('Kiwi Mainboard Dashboard')  # type: ignore
+        self.fig.suptitle('Kiwi Mainboard Sensor Data', fontsize=16, fontweight='bold')
+        self.status = self.fig.text(
+            0.02, 0.95, "Waiting for boards...", fontsize=8, ha='left', va='center')
+        self.title = self.fig.text(
+            0.6, 0.905, "", fontsize=10, ha='center', va='center')
+        grid = GridSpec(
+            5, 2, width_ratios=[1, 4],
+            left=0.04, right=0.93, top=0.88, bottom=0.07, hspace=0.1, wspace=0.12)
+        self.thumb_spec = grid[:, 0]
+
+        # Selected board: accel, gyro, mag, temperature, pressure and altitude
+        self.axs: List[Axes] = []
+        for i, unit in enumerate(('g', '°/s', 'μT', '°C', 'hPa')):
+            ax = self.fig.add_subplot(grid[i, 1], sharex=self.axs[0] if self.axs else None)
+            ax.set_ylabel(unit, fontsize=12)
+            if i < 4:
+                ax.tick_params(axis='x', which='both', labelbottom=False)
+            self.axs.append(ax)
+        self.alt_ax = self.axs[4].twinx()
+        self.alt_ax.set_ylabel('m', fontsize=12, color='r')
+        self.axs[4].set_xlabel('Time (s)', fontsize=12)
+        self.lines: List[List[Line2D]] = []
+        for ax in self.axs[:3]:
+            self.lines.append([
+                ax.plot([], [], label=label, color=color, alpha=0.5, linewidth=0.75)[0]
+                for label, color in (('X', 'red'), ('Y', 'green'), ('Z', 'blue'))
+            ] + [ax.plot([], [], label='|R|', color='black', linestyle='--', linewidth=0.75, alpha=0.5)[0]])
+        self.axs[0].legend(loc='upper left', ncol=4, fontsize=8, frameon=False)
+        self.temp_line, = self.axs[3].plot([], [], color='k', alpha=0.8, linewidth=0.75)
+        self.pres_line, = self.axs[4].plot([], [], color='b', alpha=0.8, linewidth=0.75)
+        self.alt_line, = self.alt_ax.plot([], [], color='r', alpha=0.8, linewidth=0.75)
+
+        button_ax = self.fig.add_axes((0.83, 0.92, 0.1, 0.045))
+        self.button = Button(button_ax, 'Save')
+        self.button.on_clicked(self.toggle_record)
+        self.fig.canvas.mpl_connect('button_press_event', self.on_click)
+        self.fig.canvas.mpl_connect('key_press_event', self.on_key)
+
+    def add(self, loc: Any, specs: Tuple[SharedSpec, ...]):
+        self.boards[loc] = Board(
+            loc, [SharedDataView(*spec) for spec in specs],
+            thumb=WindowDecimator(self.winsize, 3, self.decimate))
+        print(f"[Dashboard] Board {loc[0]}:{loc[1]} connected")
+        self.layout()
+        if self.selected is None:
+            self.select(loc)
+
+    def remove(self, loc: Any):
+        board = self.boards.pop(loc, None)
+        if board is None:
+            return
+        board.close()
+        print(f"[Dashboard] Board {loc[0]}:{loc[1]} disconnected")
+        self.layout()
+        if self.selected == loc:
+            self.select(next(iter(self.boards), None))
+
+    def layout(self):
+        """Recreate the thumbnail axes, one per board."""
+        for ax in self.thumb_axes.values():
+            ax.remove()
+        self.thumb_axes.clear()
+        self.thumb_lines.clear()
+        grid = GridSpecFromSubplotSpec(
+            max(len(self.boards), MIN_THUMBS), 1, subplot_spec=self.thumb_spec, hspace=0.5)
+        for i, loc in enumerate(self.boards):
+            ax = self.fig.add_subplot(grid[i, 0])
+            ax.set_xticks([])
+            ax.set_yticks([])
+            ax.set_title(f"{i + 1}: {loc[0]}:{loc[1]}", fontsize=8)
+            self.thumb_lines[loc] = [
+                ax.plot([], [], color=color, alpha=0.5, linewidth=0.5)[0]
+                for color in ('red', 'green', 'blue')
+            ]
+            self.thumb_axes[loc] = ax
+        self.highlight()
+
+    def highlight(self):
+        for loc, ax in self.thumb_axes.items():
+            for spine in ax.spines.values():
+                spine.set_color('tab:orange' if loc == self.selected else 'black')
+                spine.set_linewidth(2 if loc == self.selected else 0.8)
+
+    def select(self, loc: Optional[Any]):
+        self.selected = loc
+        board = self.boards.get(loc) if loc is not None else None
+        if board is None:
+            self.title.set_text("")
+            self.button.label.set_text('Save')
+        else:
+            board.drawn = -1
+            self.seen = [0, 0, 0, 0]
+            self.newest = [-1, -1, -1, -1]
+            for win in self.windows:
+                win.clear()
+            self.title.set_text(f"{loc[0]}:{loc[1]}")
+            self.button.label.set_text('Close' if board.recording else 'Save')
+        self.highlight()
+
+    def on_click(self, evt):
+        for loc, ax in self.thumb_axes.items():
+            if evt.inaxes is ax:
+                self.select(loc)
+                return
+
+    def on_key(self, evt):
+        if evt.key is not None and evt.key.isdigit() and evt.key != '0':
+            locs = list(self.boards)
+            idx = int(evt.key) - 1
+            if idx < len(locs):
+                self.select(locs[idx])
+
+    def toggle_record(self, evt):
+        board = self.boards.get(self.selected)
+        if board is None or self.commands is None:
+            return
+        board.recording = not board.recording
+        self.commands.put_nowait((board.loc, board.recording))
+        self.button.label.set_text('Close' if board.recording else 'Save')
+
+    def rate(self, loc: Any, info: Tuple[float, str, float, str], fps: float):
+        board = self.boards.get(loc)
+        if board is None:
+            return
+        brate, bunit, prate, punit = info
+        board.rate = f"UDP Rate: {brate:.2f} {bunit} ({prate:.2f} {punit})"
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        print(f"[{now}] Source: {loc[0]}:{loc[1]}, FPS: {fps:.2f}, {board.rate}")
+
+    def draw_selected(self) -> bool:
+        """Update the plots of the selected board if it has new samples.
+
+        Returns:
+            bool: True if anything changed.
+        """
+        board = self.boards.get(self.selected) if self.selected is not None else None
+        if board is None:
+            return False
+        accel = board.views[0]
+        total = accel.total
+        if total == board.drawn or total == 0:
+            return False
+        board.drawn = total
+        now = int(accel.latest(1)[0][-1])
+        width = int(self.axs[0].bbox.width)
+        lines = [*self.lines, (self.temp_line, self.pres_line, self.alt_line)]
+        for i, (lline, view, win) in enumerate(zip(lines, board.views, self.windows)):
+            self.seen[i], delta = view.since(self.seen[i])
+            if clock_restarted(self.newest[i], delta[0]):  # The board restarted its clock
+                win.clear()
+            if len(delta[0]):
+                self.newest[i] = int(delta[0][-1])
+            tstamp, values = win.update(view, delta, width, now)
+            for c, line in enumerate(lline):
+                line.set_data(tstamp[c] * 1e-6, values[c])
+        for ax in (*self.axs, self.alt_ax):
+            ax.relim()
+            ax.autoscale_view()
+        self.axs[0].set_xlim(now*1e-6 - self.winsize*1e-3, now*1e-6)
+        return True
+
+    def draw_thumbs(self):
+        """Update the accelerometer thumbnail of every board."""
+        for loc, board in self.boards.items():
+            view = board.views[0]
+            board.thumb_seen, delta = view.since(board.thumb_seen)
+            if clock_restarted(board.thumb_newest, delta[0]):  # The board restarted its clock
+                board.thumb.clear()
+            if len(delta[0]):
+                board.thumb_newest = int(delta[0][-1])
+            if len(view) == 0:
+                continue
+            ax = self.thumb_axes[loc]
+            now = int(view.latest(1)[0][-1])
+            tstamp, values = board.thumb.update(view, delta, int(ax.bbox.width), now)
+            for c, line in enumerate(self.thumb_lines[loc]):
+                line.set_data(tstamp[c] * 1e-6, values[c])
+            ax.relim()
+            ax.autoscale_view()
+
+    def close(self):
+        for board in self.boards.values():
+            board.close()
+        self.boards.clear()
+
+
+def dashboard_loop(
+        control: Queue,
+        shutdown: Any,
+        winsize: int = 1000,
+        frametime: int = int(1e9 / 30),
+        thumbtime: float = 1.0,
+        decimate: Optional[DecimateKind] = 'minmax',
+        commands: Optional[Queue] = None,
+        metrics: Optional[Queue] = None,
+        rates: Optional[Queue] = None
+    ):
+    """Plot every board of an ingest process in a single window.
+
+    Args:
+        control (Queue): Board messages from the ingest process, see the module comment.
+        shutdown (Event): Signal to the ingest process that the dashboard has been closed.
+        winsize (int, optional): Window size in milliseconds for displaying data. Defaults to 1000.
+        frametime (int, optional): Minimum frame time in nanoseconds. Defaults to 1/30 s.
+        thumbtime (float, optional): Seconds between thumbnail refreshes. Defaults to 1.0.
+        decimate (Optional[DecimateKind], optional): Decimation of the plot lines, see :mod:`decimate`. Defaults to 'minmax'.
+        commands (Optional[Queue], optional): Save button commands to the ingest process,
+            see the module comment. Defaults to None.
+        metrics (Optional[Queue], optional): Post the 'render' timings here
+            once a second as ``('dashboard', entries)``, see :mod:`metrics`. Defaults to None.
+        rates (Optional[Queue], optional): Separate bounded queue of the ``('rate', loc, info)``
+            messages, see :func:`backpressure.put_latest`. Defaults to None, rates come on ``control``.
+    """
+    dash = Dashboard(winsize, decimate, commands)
+    render_time = dash.metrics.histogram('render')
+    fig = dash.fig
+    fig.show()
+    fig.canvas.draw()
+    fig.canvas.flush_events()
+
+    thumb_last = 0
+    fps_last = perf_counter_ns()
+    frames = 0
+    fps = 0.0
+    sched = FrameScheduler(frametime)  # Only its pacing, the dashboard has no secondary panels
+    try:
+        while True:
+            # Handle window events until the next frame is due
+            sched.wait(fig.canvas)
+            if not plt.fignum_exists(fig.number):
+                break
+            start = perf_counter_ns()
+            changed = False
+            for queue in (control, rates):
+                while queue is not None:
+                    try:
+                        kind, loc, *rest = queue.get_nowait()
+                    except Empty:
+                        break
+                    if kind == 'connect':
+                        dash.add(loc, rest[0])
+                        changed = True
+                    elif kind == 'disconnect':
+                        dash.remove(loc)
+                        changed = True
+                    elif kind == 'rate':
+                        dash.rate(loc, rest[0], fps)
+                        if loc == dash.selected and loc in dash.boards:
+                            dash.status.set_text(f"FPS: {fps:.2f}, {dash.boards[loc].rate}")
+                            changed = True
+            changed |= dash.draw_selected()
+            if start - thumb_last >= thumbtime * 1e9:
+                thumb_last = start
+                dash.draw_thumbs()
+                changed = True
+            if changed:
+                fig.canvas.draw_idle()
+                fig.canvas.flush_events()
+                frames += 1
+                render_time.observe(perf_counter_ns() - start)
+            if start - fps_last >= 1e9:
+                fps = frames * 1e9 / (start - fps_last)
+                fps_last = start
+                frames = 0
+                if metrics is not None:
+                    metrics.put_nowait(('dashboard', dash.metrics.snapshot()))
+    except KeyboardInterrupt:
+        print("[Dashboard] Interrupted by user")
+        plt.close('all')
+    shutdown.set()
+    dash.close()
+    print("[Dashboard] Done receiving data")
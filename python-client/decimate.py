@@ -0,0 +1,274 @@
+# %%
+from __future__ import annotations
+from typing import Literal, Optional, Sequence, Tuple
+
+import numpy as np
+
+from decoder import DataBuffer
+
+# %% Display decimation
+#
+# A plot line never needs more points than its axis has pixels. Samples are
+# grouped into buckets of ``dt`` microseconds aligned to absolute time, about
+# one bucket per pixel, and every complete bucket is reduced to a point or
+# two. As the window slides, complete buckets keep their points until they
+# leave the window, so each frame only reduces the newest samples.
+
+DecimateKind = Literal['minmax', 'lttb']
+
+
+def _groups(bucket: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Start index and size of each run of equal buckets."""
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    counts = np.diff(np.r_[starts, len(bucket)])
+    return starts, counts
+
+
+def minmax(tstamp: np.ndarray, values: np.ndarray, bucket: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Minimum and maximum of every bucket, in time order.
+
+    Args:
+        tstamp (np.ndarray): Timestamps, shape (n,).
+        values (np.ndarray): Channel values, shape (channels, n).
+        bucket (np.ndarray): Non-decreasing bucket of every sample, shape (n,).
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Timestamps and values of the points, both
+        of shape (channels, 2 * buckets). A bucket with a single sample gives it twice.
+    """
+    n = len(tstamp)
+    if n == 0:
+        empty = np.zeros((len(values), 0))
+        return empty.astype(np.int64), empty.astype(values.dtype)
+    starts, counts = _groups(bucket)
+    index = np.arange(n)
+    points = []
+    for reduce in (np.minimum, np.maximum):
+        extreme = reduce.reduceat(values, starts, axis=1)
+        # First sample of each bucket equal to its extreme
+        hit = values == np.repeat(extreme, counts, axis=1)
+        first = np.minimum.reduceat(np.where(hit, index, n), starts, axis=1)
+        points.append(np.minimum(first, starts + counts - 1))  # NaN buckets have no hit
+    lo, hi = np.minimum(*points), np.maximum(*points)
+    idx = np.stack((lo, hi), axis=2).reshape(len(values), -1)
+    return tstamp[idx], np.take_along_axis(values, idx, axis=1)
+
+
+def lttb(
+    tstamp: np.ndarray,
+    values: np.ndarray,
+    bucket: np.ndarray,
+    stop: int,
+    prev: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Largest-Triangle-Three-Buckets point of every bucket before ``stop``.
+
+    The point of a bucket forms the largest triangle with the point chosen
+    in the previous bucket and the average of the next one, so the buckets
+    before ``stop`` must be followed by at least one more bucket.
+
+    Args:
+        tstamp (np.ndarray): Timestamps, shape (n,).
+        values (np.ndarray): Channel values, shape (channels, n).
+        bucket (np.ndarray): Non-decreasing bucket of every sample, shape (n,).
+        stop (int): Index of the first sample of the buckets not to reduce.
+        prev (Optional[Tuple[np.ndarray, np.ndarray]], optional): Timestamps and values,
+            shape (channels,), of the points chosen in the preceding bucket.
+            Defaults to None: the line starts here and, as in the original
+            algorithm, the first bucket gives its first sample.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Timestamps and values of the points, both
+        of shape (channels, buckets).
+    """
+    channels = len(values)
+    starts, counts = _groups(bucket)
+    nb = int(np.searchsorted(starts, stop))
+    out_t = np.zeros((channels, nb), dtype=np.int64)
+    out_y = np.zeros((channels, nb), dtype=values.dtype)
+    if nb == 0:
+        return out_t, out_y
+    ftime = tstamp.astype(np.float64)
+    avg_t = np.add.reduceat(ftime, starts) / counts
+    avg_y = np.add.reduceat(values, starts, axis=1, dtype=np.float64) / counts
+    first = 0
+    if prev is None:
+        out_t[:, 0], out_y[:, 0] = tstamp[0], values[:, 0]
+        prev, first = (out_t[:, 0], out_y[:, 0]), 1
+    at, ay = prev[0].astype(np.float64)[:, None], prev[1].astype(np.float64)[:, None]
+    rows = np.arange(channels)
+    for g in range(first, nb):
+        s, e = starts[g], starts[g] + counts[g]
+        bt, by = ftime[s:e][None, :], values[:, s:e]
+        ct, cy = avg_t[g + 1], avg_y[:, g + 1, None]
+        area = np.abs((at - ct) * (by - ay) - (at - bt) * (cy - ay))
+        pick = np.argmax(area, axis=1)
+        out_t[:, g] = tstamp[s + pick]
+        out_y[:, g] = by[rows, pick]
+        at, ay = out_t[:, g, None].astype(np.float64), out_y[:, g, None].astype(np.float64)
+    return out_t, out_y
+
+
+class Decimator:
+    """Decimated sliding window of a sampled signal, fed with new samples.
+
+    Samples older than the newest reduced bucket are dropped: at one bucket
+    per pixel, a late sample would not move the line anyway.
+    """
+
+    def __init__(self, channels: int = 3, kind: DecimateKind = 'minmax'):
+        """
+        Args:
+            channels (int, optional): Number of value channels. Defaults to 3.
+            kind (DecimateKind, optional): 'minmax' keeps the extremes of every bucket,
+                'lttb' one point per bucket chosen by Largest-Triangle-Three-Buckets,
+                the line ending at the newest sample. Defaults to 'minmax'.
+        """
+        self.channels = channels
+        self.kind = kind
+        self.reset(1)
+
+    def reset(self, dt: int):
+        """Drop every sample and use buckets of ``dt`` microseconds from now on."""
+        channels = self.channels
+        self.dt = max(int(dt), 1)
+        # Points of the reduced buckets
+        self._bucket = np.zeros(0, dtype=np.int64)
+        self._t = np.zeros((channels, 0), dtype=np.int64)
+        self._y = np.zeros((channels, 0), dtype=np.float32)
+        # Samples of the buckets not reduced yet
+        self._pend_t = np.zeros(0, dtype=np.int64)
+        self._pend_y = np.zeros((channels, 0), dtype=np.float32)
+
+    def extend(self, tstamp: np.ndarray, values: np.ndarray):
+        """Add new samples.
+
+        Args:
+            tstamp (np.ndarray): Timestamps in microseconds, shape (n,).
+            values (np.ndarray): Channel values, shape (channels, n).
+        """
+        if len(tstamp) == 0:
+            return
+        tstamp = np.concatenate((self._pend_t, tstamp))
+        values = np.concatenate((self._pend_y, values), axis=1)
+        bucket = tstamp // self.dt
+        if len(self._bucket):
+            keep = bucket > self._bucket[-1]
+            if not keep.all():
+                tstamp, values, bucket = tstamp[keep], values[:, keep], bucket[keep]
+        if len(bucket) > 1 and np.any(bucket[1:] < bucket[:-1]):
+            order = np.argsort(tstamp, kind='stable')
+            tstamp, values, bucket = tstamp[order], values[:, order], bucket[order]
+        if len(bucket) == 0:
+            return
+        # The newest bucket may still grow, LTTB also needs the one after
+        lag = 1 if self.kind == 'minmax' else 2
+        stop = int(np.searchsorted(bucket, bucket[-1] - lag, side='right'))
+        if stop > 0:
+            if self.kind == 'minmax':
+                t, y = minmax(tstamp[:stop], values[:, :stop], bucket[:stop])
+                done = np.repeat(np.unique(bucket[:stop]), 2)
+            else:
+                prev = (self._t[:, -1], self._y[:, -1]) if len(self._bucket) else None
+                t, y = lttb(tstamp, values, bucket, stop, prev)
+                done = np.unique(bucket[:stop])
+            self._bucket = np.concatenate((self._bucket, done))
+            self._t = np.concatenate((self._t, t), axis=1)
+            self._y = np.concatenate((self._y, y), axis=1)
+        self._pend_t = tstamp[stop:]
+        self._pend_y = values[:, stop:]
+
+    def evict(self, start: float):
+        """Forget the buckets that end before ``start`` (microseconds)."""
+        first = int(np.searchsorted(self._bucket, start // self.dt))
+        if first:
+            self._bucket = self._bucket[first:]
+            self._t = self._t[:, first:]
+            self._y = self._y[:, first:]
+
+    def points(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Timestamps and values of the decimated window, both shape (channels, m)."""
+        pend = self._pend_t
+        bucket = pend // self.dt
+        if self.kind == 'lttb' and len(pend):
+            # The buckets still growing are reduced for this frame only, the newest one to its last sample
+            last = int(np.searchsorted(bucket, bucket[-1]))
+            prev = (self._t[:, -1], self._y[:, -1]) if len(self._bucket) else None
+            t, y = lttb(pend, self._pend_y, bucket, last, prev)
+            t = np.concatenate((t, np.broadcast_to(pend[-1], (self.channels, 1))), axis=1)
+            y = np.concatenate((y, self._pend_y[:, -1:]), axis=1)
+        else:
+            t, y = minmax(pend, self._pend_y, bucket)
+        return (np.concatenate((self._t, t), axis=1),
+                np.concatenate((self._y, y), axis=1))
+
+
+class WindowDecimator:
+    """Plot points of the last ``winsize`` milliseconds of a sensor buffer.
+
+    With a ``kind`` the window is decimated to about one bucket per pixel
+    of the given width, see :class:`Decimator`. Without one every sample of
+    the window is returned. Only the first ``channels`` channels of the buffer
+    are plotted, e.g. x, y, z and the derived |R|.
+    """
+
+    def __init__(
+        self,
+        winsize: int,
+        channels: int = 3,
+        kind: Optional[DecimateKind] = 'minmax',
+    ):
+        """
+        Args:
+            winsize (int): Window size in milliseconds.
+            channels (int, optional): Number of leading buffer channels to plot. Defaults to 3.
+            kind (Optional[DecimateKind], optional): Decimation, None plots every sample. Defaults to 'minmax'.
+        """
+        self.winsize = winsize
+        self.kind = kind
+        self.channels = channels
+        self.decimator = Decimator(channels, kind) if kind is not None else None
+
+    def clear(self):
+        """Forget the decimated window, e.g. to plot another buffer."""
+        if self.decimator is not None:
+            self.decimator.reset(self.decimator.dt)
+
+    def _values(self, values: Sequence[np.ndarray]) -> np.ndarray:
+        values = values[:self.channels]
+        return np.asarray(values, dtype=np.float32).reshape(len(values), -1)
+
+    def update(
+        self,
+        buffer: DataBuffer,
+        delta: Optional[Tuple[np.ndarray, ...]],
+        width: int,
+        now: int,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Points of the window ending at ``now``.
+
+        Args:
+            buffer (DataBuffer): The sensor buffer.
+            delta (Optional[Tuple[np.ndarray, ...]]): Samples added to ``buffer`` since the
+                last update, as returned by :meth:`DataBuffer.since`. None reads the whole buffer.
+            width (int): Width of the axis in pixels.
+            now (int): Newest timestamp in microseconds.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Timestamps and values, both shape (channels, m).
+        """
+        start = now - self.winsize * 1e3
+        dec = self.decimator
+        if dec is None:
+            tstamp, *values = buffer.window(start, now + 1)
+            values = self._values(values)
+            return np.broadcast_to(tstamp, values.shape), values
+        dt = max(self.winsize * 1000 // max(width, 1), 1)
+        if dt != dec.dt or delta is None:
+            # Bucket size changed, e.g. the window was resized: start over
+            dec.reset(dt)
+            delta = buffer.window(start, now + 1)
+        tstamp, *values = delta
+        dec.extend(tstamp, self._values(values))
+        dec.evict(start)
+        return dec.points()
@@ -1,12 +1,13 @@
 # %% Imports
 from __future__ import annotations
-from collections import deque
+from dataclasses import dataclass
 import struct
 from crc import Calculator, Crc16
 import logging
+import os
+from typing import Optional, Tuple
 
 import numpy as np
-import pandas as pd
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -21,31 +22,310 @@ GYRO_CODE = 0x6E50
 MAG_CODE = 0x9A61
 TEMP_CODE = 0x7E70
 BARO_CODE = 0xB480
+# Board ID, sent every 2 s. Neither its type code nor its payload layout are
+# taken from the ``CommonMeasurement`` serialization of the firmware crate
+# yet, so there is no default: ID records count as unknown and sessions stay
+# keyed on the source address, see :class:`udp_thread.Ingest`. Set
+# KIWI_ID_CODE (or ``app.py --id-code``) to the firmware's code to identify
+# the boards; the payload is then read as up to 12 bytes of NUL-padded UTF-8.
+ID_CODE: Optional[int] = int(os.environ['KIWI_ID_CODE'], 0) if os.environ.get('KIWI_ID_CODE') else None
+if ID_CODE in (ACCEL_CODE, GYRO_CODE, MAG_CODE, TEMP_CODE, BARO_CODE):
+    raise ValueError(f"KIWI_ID_CODE {ID_CODE:#06x} is the code of a sensor measurement")
+
+# DataFrame columns of the accel, gyro, mag and baro buffers
+COLUMNS = (
+    ('tstamp', 'x', 'y', 'z'),
+    ('tstamp', 'x', 'y', 'z'),
+    ('tstamp', 'x', 'y', 'z'),
+    ('tstamp', 'temperature', 'pressure', 'altitude'),
+)
 # %% Storage data structures
 
 
+# A run of this many samples at least CLOCK_RESET microseconds older than the
+# newest one is taken as a board restart rather than stale datagrams
+CLOCK_RESET = 1_000_000
+RESET_SAMPLES = 64
+
+
+def clock_restarted(last: int, tstamp: np.ndarray) -> bool:
+    """Whether new samples read from a buffer jumped back from ``last``, the newest one before.
+
+    A reordering buffer only takes samples newer than the ones it holds, until
+    it is cleared for a board restart, so readers following it with
+    :meth:`DataBuffer.since` see the restart as such a jump.
+    """
+    return len(tstamp) > 0 and int(tstamp[0]) < last - CLOCK_RESET
+
+
 class DataBuffer:
-    def __init__(self, maxlen=2000):
+    """Preallocated columnar ring buffer of sensor samples.
+
+    Timestamps are stored as int64 and each channel as a contiguous float32
+    column. The capacity is rounded up to a power of 2 so that write
+    positions wrap with a bit mask.
+
+    With a ``reorder`` stage, incoming samples are held back until a sample
+    ``reorder`` microseconds newer arrives, so datagrams that UDP delivered
+    out of order are sorted into place. Duplicates and samples older than
+    the ones already written are dropped. The ring then stays sorted by
+    time and :meth:`window` finds a time range by binary search.
+    """
+
+    def __init__(
+        self, maxlen=2000, channels=3, buffer=None,
+        span: Optional[int] = None, reorder: Optional[int] = None
+    ):
+        """
+        Args:
+            maxlen (int, optional): Minimum capacity in samples. Defaults to 2000.
+            channels (int, optional): Number of value channels. Defaults to 3.
+            buffer (optional): Memory to lay the columns over, at least
+                :meth:`nbytes` long. Defaults to freshly allocated arrays.
+            span (Optional[int], optional): Time span in microseconds returned by
+                :meth:`latest`, older samples count as evicted. Defaults to None,
+                limited by the capacity only.
+            reorder (Optional[int], optional): Microseconds to hold samples back for
+                sorting. Defaults to None, writing samples as given.
+        """
         # Ensure maxlen is a power of 2
         maxlen = 1 << int(np.ceil(np.log2(maxlen)))
-        self._data = deque(maxlen=maxlen)
+        self._mask = maxlen - 1
+        if buffer is None:
+            self._tstamp = np.zeros(maxlen, dtype=np.int64)
+            self._values = np.zeros((channels, maxlen), dtype=np.float32)
+        else:
+            self._tstamp = np.ndarray(maxlen, dtype=np.int64, buffer=buffer)
+            self._values = np.ndarray(
+                (channels, maxlen), dtype=np.float32, buffer=buffer, offset=self._tstamp.nbytes)
+        self._total = 0  # Number of samples ever written
+        self.span = span
+        self.reorder = reorder
+        self.dropped = 0  # Late or duplicate samples
+        self._last = -1  # Newest timestamp written
+        self._stale = 0  # Samples in a row far older than the newest one
+        self._pend_t = np.zeros(0, dtype=np.int64)
+        self._pend_v = np.zeros((0, channels), dtype=np.float32)
+
+    @staticmethod
+    def nbytes(maxlen: int, channels: int = 3) -> int:
+        """Bytes needed by the columns of a buffer of the given size."""
+        maxlen = 1 << int(np.ceil(np.log2(maxlen)))
+        return maxlen * (np.dtype(np.int64).itemsize + channels * np.dtype(np.float32).itemsize)
+
+    @property
+    def maxlen(self) -> int:
+        return self._mask + 1
+
+    @property
+    def channels(self) -> int:
+        return self._values.shape[0]
+
+    @property
+    def total(self) -> int:
+        """Number of samples written since creation or the last clear."""
+        return self._total
 
     def append(self, item):
-        self._data.append(item)
+        if self.reorder is not None:
+            self.extend(np.array([item[0]]), np.array([item[1:]]))
+            return
+        idx = self._total & self._mask
+        self._tstamp[idx] = item[0]
+        self._values[:, idx] = item[1:]
+        self._total += 1
+
+    def extend(self, tstamp: np.ndarray, values: np.ndarray):
+        """Append decoded column arrays, see :func:`decode_batch`.
+
+        Args:
+            tstamp (np.ndarray): Timestamps, shape (n,).
+            values (np.ndarray): Channel values, shape (n, channels).
+        """
+        if self.reorder is not None:
+            tstamp, values = self._sort(tstamp, values)
+            stop = int(np.searchsorted(tstamp, tstamp[-1] - self.reorder, side='right')) if len(tstamp) else 0
+            self._pend_t, self._pend_v = tstamp[stop:], values[stop:]
+            tstamp, values = tstamp[:stop], values[:stop]
+        self._write(tstamp, values)
+
+    def flush(self):
+        """Write the samples held back by the reorder stage."""
+        tstamp, values = self._pend_t, self._pend_v
+        self._pend_t, self._pend_v = tstamp[:0], values[:0]
+        self._write(tstamp, values)
+
+    def _sort(self, tstamp: np.ndarray, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Merge new samples into the reorder stage, sorted and without duplicates."""
+        tstamp = np.asarray(tstamp, dtype=np.int64)
+        # Judged on the new samples alone, the held back ones predate a restart
+        if len(tstamp) and tstamp.max() < self._last - CLOCK_RESET:
+            self._stale += len(tstamp)
+            if self._stale >= RESET_SAMPLES:
+                logger.warning("[Buffer] Timestamps jumped back, clearing the buffer")
+                DataBuffer.clear(self)
+        elif len(tstamp):
+            self._stale = 0
+        tstamp = np.concatenate((self._pend_t, tstamp))
+        values = np.concatenate((self._pend_v, values))
+        if len(tstamp) == 0:
+            return tstamp, values
+        if np.any(tstamp[1:] <= tstamp[:-1]):
+            # Stable, so the first arrival of a duplicate comes first
+            order = np.argsort(tstamp, kind='stable')
+            tstamp, values = tstamp[order], values[order]
+        keep = tstamp > self._last
+        keep[1:] &= tstamp[1:] != tstamp[:-1]
+        if not keep.all():
+            self.dropped += len(keep) - int(keep.sum())
+            tstamp, values = tstamp[keep], values[keep]
+        return tstamp, values
+
+    def _write(self, tstamp: np.ndarray, values: np.ndarray):
+        num = len(tstamp)
+        if num == 0:
+            return
+        # Only the newest maxlen samples can survive
+        skip = max(num - self.maxlen, 0)
+        tstamp = tstamp[skip:]
+        values = values[skip:]
+        start = (self._total + skip) & self._mask
+        first = min(len(tstamp), self.maxlen - start)
+        self._tstamp[start:start+first] = tstamp[:first]
+        self._values[:, start:start+first] = values[:first].T
+        rest = len(tstamp) - first
+        if rest > 0:
+            self._tstamp[:rest] = tstamp[first:]
+            self._values[:, :rest] = values[first:].T
+        self._total += num
+        self._last = int(tstamp[-1])
 
     def clear(self):
-        self._data.clear()
+        self._total = 0
+        self._last = -1
+        self._stale = 0
+        self._pend_t, self._pend_v = self._pend_t[:0], self._pend_v[:0]
+
+    def close(self):
+        """Release the buffer memory, nothing to do for private arrays."""
 
     def __getitem__(self, index):
-        return self._data[index]
+        size = len(self)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError('DataBuffer index out of range')
+        idx = (self._total - size + index) & self._mask
+        return (int(self._tstamp[idx]), *self._values[:, idx].tolist())
 
     def __len__(self):
-        return len(self._data)
+        return min(self._total, self.maxlen)
+
+    def since(self, cursor: int) -> Tuple[int, Tuple[np.ndarray, ...]]:
+        """Samples written after ``cursor``, see :attr:`total`.
+
+        Samples already overwritten in the ring are skipped. A cursor ahead of
+        the buffer (e.g. after :meth:`clear`) returns everything.
+
+        Args:
+            cursor (int): Value of :attr:`total` when the caller last read.
+
+        Returns:
+            Tuple[int, Tuple[np.ndarray, ...]]: The new cursor and the arrays
+            of new samples as in :meth:`latest`.
+        """
+        total = self._total
+        num = total - cursor if cursor <= total else total
+        return total, self._latest(num)
+
+    def follow(self, source: DataBuffer, cursor: int) -> Tuple[int, Tuple[np.ndarray, ...], bool]:
+        """Append the samples written to ``source`` after ``cursor``, see :meth:`since`.
+
+        Starts over when the board restarted its clock and ``source`` was
+        cleared, see :func:`clock_restarted`.
+
+        Args:
+            source (DataBuffer): The buffer to follow, e.g. a shared ring of the ingest.
+            cursor (int): Value of ``source.total`` when last followed.
+
+        Returns:
+            Tuple[int, Tuple[np.ndarray, ...], bool]: The new cursor, the arrays of
+            new samples as in :meth:`since`, and whether this buffer was cleared first.
+        """
+        cursor, delta = source.since(cursor)
+        tstamp, *values = delta
+        restarted = clock_restarted(self._last, tstamp)
+        if restarted:
+            self.clear()
+        self.extend(tstamp, np.array(values).T)
+        return cursor, delta, restarted
+
+    def latest(self, num: Optional[int] = None) -> Tuple[np.ndarray, ...]:
+        """Arrays of the last ``num`` samples within :attr:`span`, oldest first.
 
-    def to_dataframe(self, columns=None):
+        The arrays are views into the ring when the samples do not wrap
+        around its end, and copies otherwise.
+
+        Args:
+            num (Optional[int]): Number of samples. Defaults to all samples.
+
+        Returns:
+            Tuple[np.ndarray, ...]: The timestamps followed by one array per channel.
+        """
+        return self._recent(num)
+
+    def window(self, t0: float, t1: float) -> Tuple[np.ndarray, ...]:
+        """Arrays of the samples with ``t0 <= tstamp < t1``, as in :meth:`latest`.
+
+        Needs a time-sorted ring, see ``reorder``; runs in O(log n).
+        """
+        return self._range(self._search(t0), self._search(t1))
+
+    def _search(self, t: float, side: str = 'left') -> int:
+        """Number of samples older than ``t`` (or as old with ``side='right'``)."""
+        size = min(self._total, self.maxlen)
+        start = (self._total - size) & self._mask
+        if start + size <= self.maxlen:
+            return int(np.searchsorted(self._tstamp[start:start+size], t, side=side))
+        # Wrapped: the older part is at the end of the ring
+        older = self._tstamp[start:]
+        num = int(np.searchsorted(older, t, side=side))
+        if num < len(older):
+            return num
+        return num + int(np.searchsorted(self._tstamp[:(start + size) & self._mask], t, side=side))
+
+    def _recent(self, num: Optional[int] = None) -> Tuple[np.ndarray, ...]:
+        size = min(self._total, self.maxlen)
+        if self.span is not None and size:
+            newest = self._tstamp[(self._total - 1) & self._mask]
+            inspan = size - self._search(newest - self.span, side='right')
+            num = inspan if num is None else min(num, inspan)
+        return self._latest(num)
+
+    def _latest(self, num: Optional[int] = None) -> Tuple[np.ndarray, ...]:
+        size = min(self._total, self.maxlen)
+        num = size if num is None else min(num, size)
+        return self._range(size - num, size)
+
+    def _range(self, first: int, last: int) -> Tuple[np.ndarray, ...]:
+        """Samples ``first`` to ``last`` (exclusive), counted from the oldest one."""
+        size = min(self._total, self.maxlen)
+        num = max(last - first, 0)
+        start = (self._total - size + first) & self._mask
+        stop = start + num
+        if stop <= self.maxlen:
+            return (self._tstamp[start:stop], *self._values[:, start:stop])
+        stop &= self._mask
+        tstamp = np.concatenate((self._tstamp[start:], self._tstamp[:stop]))
+        values = np.concatenate(
+            (self._values[:, start:], self._values[:, :stop]), axis=1)
+        return (tstamp, *values)
+
+    def to_dataframe(self, columns=None, num: Optional[int] = None):
         if columns is None:
             columns = ['tstamp', 'x', 'y', 'z']
-        return pd.DataFrame(list(self._data), columns=columns)
+        from pandas import DataFrame  # Only storage needs pandas
+        return DataFrame(dict(zip(columns, self.latest(num))))
 
 
 # %% Data packet structure
@@ -87,12 +367,116 @@ def decode_packet(measurement: bytes, accel: DataBuffer, gyro: DataBuffer, mag:
         elif mtype == BARO_CODE:
             temperature, pres, alt = struct.unpack('<fff', data[:12])
             baro.append((tstamp, temperature, pres, alt))
+        elif ID_CODE is not None and mtype == ID_CODE:
+            pass  # Identifies the board, see :func:`decode_id`
         else:
             logger.warning(
                 f"[UDP] Skipping measurement with unknown type {mtype:#04x}")
             return None
     return tstamp
 
+# %% Batch decoding
+
+# One measurement record as laid out on the wire
+MEASUREMENT_DTYPE = np.dtype([
+    ('mtype', '<u2'),
+    ('payload', '<f4', (3,)),
+    ('tstamp', '<u8'),
+    ('crc', '<u2'),
+])
+assert MEASUREMENT_DTYPE.itemsize == SINGLE_MEASUREMENT_SIZE
+
+
+def _crc16_table(poly: int = 0x1021) -> np.ndarray:
+    table = np.zeros(256, dtype=np.uint16)
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ poly) if crc & 0x8000 else (crc << 1)
+        table[byte] = crc & 0xFFFF
+    return table
+
+
+CRC16_XMODEM_TABLE = _crc16_table()
+
+
+def crc16_xmodem(records: np.ndarray) -> np.ndarray:
+    """Compute CRC16-XMODEM over every row of a (N, M) uint8 array.
+
+    The table-driven update runs once per byte column, vectorized across
+    all N records.
+    """
+    crc = np.zeros(records.shape[0], dtype=np.uint16)
+    for col in records.T:
+        idx = (crc >> 8) ^ col
+        crc = (crc << 8) ^ CRC16_XMODEM_TABLE[idx]
+    return crc
+
+
+@dataclass
+class DecodedBatch:
+    """Per-sensor column arrays decoded from a buffer of records.
+
+    Each sensor entry is a tuple ``(tstamp, values)`` with ``tstamp`` of
+    shape (n,) and ``values`` of shape (n, 3). Baro values are
+    (temperature, pressure, altitude).
+    """
+    accel: Tuple[np.ndarray, np.ndarray]
+    gyro: Tuple[np.ndarray, np.ndarray]
+    mag: Tuple[np.ndarray, np.ndarray]
+    baro: Tuple[np.ndarray, np.ndarray]
+    count: int = 0  # Records in the buffer
+    bad_crc: int = 0  # Records dropped for CRC mismatch
+    unknown: int = 0  # Records dropped for unknown measurement type
+    device: Optional[str] = None  # Board ID of the last ID record, if any
+
+    def sensors(self) -> Tuple[Tuple[np.ndarray, np.ndarray], ...]:
+        """The accel, gyro, mag and baro columns, in buffer order."""
+        return (self.accel, self.gyro, self.mag, self.baro)
+
+
+def decode_id(payload) -> str:
+    """Board ID carried in the payload of an ``ID_CODE`` record."""
+    return bytes(payload).rstrip(b'\x00').decode('utf-8', errors='replace')
+
+
+def decode_batch(buf) -> DecodedBatch:
+    """Decode a contiguous buffer of ``SINGLE_MEASUREMENT_SIZE`` records.
+
+    Equivalent to calling :func:`decode_packet` on every record, except that
+    invalid records are counted instead of logged.
+
+    Args:
+        buf (bytes-like): N * SINGLE_MEASUREMENT_SIZE bytes. Trailing bytes of
+            an incomplete record are ignored.
+
+    Returns:
+        DecodedBatch: Per-sensor columns and drop counters.
+    """
+    count = len(buf) // SINGLE_MEASUREMENT_SIZE
+    recs = np.frombuffer(buf, dtype=MEASUREMENT_DTYPE, count=count)
+    raw = np.frombuffer(buf, dtype=np.uint8, count=count *
+                        SINGLE_MEASUREMENT_SIZE).reshape(count, SINGLE_MEASUREMENT_SIZE)
+    valid = crc16_xmodem(raw[:, :-2]) == recs['crc']
+    mtype = recs['mtype']
+    sensors = []
+    known = np.zeros(count, dtype=bool)
+    for code in (ACCEL_CODE, GYRO_CODE, MAG_CODE, BARO_CODE):
+        sel = valid & (mtype == code)
+        known |= sel
+        sensors.append((recs['tstamp'][sel], recs['payload'][sel]))
+    ids = np.flatnonzero(valid & (mtype == ID_CODE)) if ID_CODE is not None else np.zeros(0, dtype=np.intp)
+    known[ids] = True
+    nvalid = int(np.count_nonzero(valid))
+    return DecodedBatch(
+        *sensors,
+        count=count,
+        bad_crc=count - nvalid,
+        unknown=nvalid - int(np.count_nonzero(known)),
+        device=decode_id(raw[ids[-1], 2:14]) if len(ids) else None,
+    )
+
+
 def xyz_to_rtp(x, y, z):
     r = np.sqrt(x**2 + y**2 + z**2)
     theta = np.arccos(z / r) - np.pi / 2  # polar angle
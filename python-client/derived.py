@@ -0,0 +1,118 @@
+# %%
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from decoder import COLUMNS, xyz_to_rtp
+
+# %% Derived channels
+#
+# Channels computed from the raw values of a sensor once per sample, as the
+# ingest decodes a batch, and stored in its ring buffer as extra columns after
+# the raw ones. Plots and recordings read them like any other column instead
+# of recomputing them every frame.
+#
+# A derivation is a vectorized function of the raw values, shape (n, 3),
+# returning shape (n, k) or k arrays of shape (n,). More are registered with
+# :func:`register` at import time, before the ingest creates its buffers and
+# starts its plot processes:
+#
+#     @register('tilt', ('tilt',), sensors=('accel',))
+#     def tilt(values):
+#         return np.degrees(np.arctan2(np.hypot(values[:, 0], values[:, 1]), values[:, 2]))
+
+SENSORS = ('accel', 'gyro', 'mag', 'baro')  # Order of the sensor buffers, as COLUMNS
+
+Derive = Callable[[np.ndarray], np.ndarray]
+
+
+@dataclass(frozen=True)
+class Derivation:
+    name: str
+    columns: Tuple[str, ...]  # Names of the channels it returns
+    sensors: Tuple[str, ...]  # Sensors it applies to
+    func: Derive
+
+
+DERIVATIONS: Dict[str, Derivation] = {}
+_by_sensor: Dict[str, List[Derivation]] = {}  # Cache of :func:`derivations`
+
+
+def register(name: str, columns: Sequence[str], sensors: Sequence[str] = ('accel', 'gyro', 'mag')):
+    """Register a derivation of ``columns`` for ``sensors``, replacing one of the same name.
+
+    Args:
+        name (str): Name of the derivation.
+        columns (Sequence[str]): Names of the channels it returns, in order.
+        sensors (Sequence[str], optional): Sensors it applies to, see :data:`SENSORS`.
+            Defaults to accel, gyro and mag.
+    """
+    unknown = set(sensors) - set(SENSORS)
+    if unknown:
+        raise ValueError(f"Unknown sensors: {', '.join(sorted(unknown))}")
+
+    def decorator(func: Derive) -> Derive:
+        DERIVATIONS[name] = Derivation(name, tuple(columns), tuple(sensors), func)
+        _by_sensor.clear()
+        return func
+    return decorator
+
+
+def derivations(sensor: str) -> List[Derivation]:
+    found = _by_sensor.get(sensor)
+    if found is None:
+        found = _by_sensor[sensor] = [der for der in DERIVATIONS.values() if sensor in der.sensors]
+    return found
+
+
+def columns(sensor: str) -> Tuple[str, ...]:
+    """DataFrame columns of a sensor buffer: timestamp, raw and derived channels."""
+    return COLUMNS[SENSORS.index(sensor)] + tuple(
+        col for der in derivations(sensor) for col in der.columns)
+
+
+def all_columns() -> Tuple[Tuple[str, ...], ...]:
+    """:func:`columns` of every sensor, in buffer order."""
+    return tuple(columns(sensor) for sensor in SENSORS)
+
+
+def channels(sensor: str) -> int:
+    """Number of value channels of a sensor buffer."""
+    return len(columns(sensor)) - 1
+
+
+def channel(sensor: str, column: str) -> int:
+    """Index of ``column`` among the value channels of a sensor buffer."""
+    return columns(sensor).index(column) - 1
+
+
+def derive(sensor: str, values: np.ndarray) -> np.ndarray:
+    """The raw ``values`` of a sensor, shape (n, 3), with its derived channels appended."""
+    found = derivations(sensor)
+    if not found:
+        return values
+    raw = values.shape[1]
+    out = np.empty((len(values), raw + sum(len(der.columns) for der in found)), dtype=np.float32)
+    out[:, :raw] = values
+    col = raw
+    for der in found:
+        result = der.func(values)
+        num = len(der.columns)
+        if isinstance(result, (tuple, list)):  # One array per channel
+            for c, arr in enumerate(result):
+                out[:, col + c] = arr
+        else:
+            out[:, col:col + num] = np.reshape(result, (len(values), num))
+        col += num
+    return out
+
+# %% Built-in derivations
+
+
+@register('spherical', ('r', 'theta', 'phi'))
+def spherical(values: np.ndarray) -> Tuple[np.ndarray, ...]:
+    """|R|, polar angle θ and azimuthal angle φ, see :func:`decoder.xyz_to_rtp`."""
+    with np.errstate(invalid='ignore', divide='ignore'):  # NaN angles for a zero vector
+        return xyz_to_rtp(values[:, 0], values[:, 1], values[:, 2])
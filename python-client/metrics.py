@@ -0,0 +1,298 @@
+# %%
+from __future__ import annotations
+from bisect import bisect_left
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from pathlib import Path
+from threading import Event, Thread
+from typing import Any, Dict, List, Optional, Tuple
+
+# %% Hot-path metrics
+#
+# Every process of the client keeps a :class:`Metrics` registry. Stages are
+# timed with ``perf_counter_ns`` around each batch and counted in fixed
+# histograms, so recording costs a bisect and three additions. Plot,
+# dashboard and recorder processes post snapshots of their registry to the
+# ingest process, ingest workers to the supervisor, which merges them into its
+# own and exports the lot as Prometheus text or JSON lines.
+#
+# Stages: 'receive' (socket drain), 'decode', 'insert' (derived channels and ring
+# buffers), 'ipc' (frame request to shared memory copied), 'render' and
+# 'storage' (one write of a storage thread of the recorder).
+
+# Upper bounds of the histogram buckets in nanoseconds: 1 us to 16.8 s
+BOUNDS = tuple(1000 * 2**k for k in range(25))
+
+Labels = Tuple[Tuple[str, str], ...]
+# (kind, name, labels, value): kind is 'histogram', 'counter' or 'gauge', the value
+# of a histogram is (bucket counts, sum in ns, count)
+Entry = Tuple[str, str, Labels, Any]
+
+
+class Histogram:
+    """Counts of durations in nanoseconds in the buckets of :data:`BOUNDS`."""
+
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BOUNDS) + 1)  # The last bucket is +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, ns: int):
+        self.counts[bisect_left(BOUNDS, ns)] += 1
+        self.sum += ns
+        self.count += 1
+
+
+def quantile(counts: List[int], q: float) -> float:
+    """Upper bound in nanoseconds of the bucket holding quantile ``q``."""
+    rank = q * sum(counts)
+    seen = 0
+    for bound, count in zip(BOUNDS, counts):
+        seen += count
+        if seen >= rank:
+            return float(bound)
+    return float('inf')
+
+
+class Metrics:
+    """Stage histograms, counters and gauges of one process.
+
+    Histograms are keyed by stage and source, counters and gauges by name and
+    labels. Counters hold totals, set by the owner of the count.
+    """
+
+    def __init__(self):
+        self.histograms: Dict[Tuple[str, str], Histogram] = {}
+        self.values: Dict[Tuple[str, str, Labels], float] = {}  # (kind, name, labels)
+        self.remote: Dict[Any, List[Entry]] = {}  # Last snapshot of each other process
+
+    def histogram(self, stage: str, source: str = '') -> Histogram:
+        """The histogram of ``stage`` for ``source``, created on first use."""
+        hist = self.histograms.get((stage, source))
+        if hist is None:
+            hist = self.histograms[(stage, source)] = Histogram()
+        return hist
+
+    def counter(self, name: str, value: float, **labels: str):
+        self.values[('counter', name, tuple(labels.items()))] = value
+
+    def gauge(self, name: str, value: float, **labels: str):
+        self.values[('gauge', name, tuple(labels.items()))] = value
+
+    def forget(self, source: str):
+        """Drop everything recorded for ``source``, e.g. once it disconnected."""
+        for key in [key for key in self.histograms if key[1] == source]:
+            del self.histograms[key]
+        for key in [key for key in self.values if ('source', source) in key[2]]:
+            del self.values[key]
+        self.remote.pop(source, None)
+
+    def merge(self, origin: Any, entries: List[Entry], **labels: str):
+        """Replace the snapshot last received from ``origin``, adding ``labels`` to it."""
+        extra = tuple(labels.items())
+        self.remote[origin] = [(kind, name, extra + lab, value) for kind, name, lab, value in entries]
+
+    def snapshot(self) -> List[Entry]:
+        """Every metric of this process and of the merged snapshots."""
+        entries: List[Entry] = [
+            ('histogram', 'stage_seconds', (('stage', stage), ('source', source)),
+             (list(hist.counts), hist.sum, hist.count))
+            for (stage, source), hist in list(self.histograms.items())
+        ]
+        entries += [(kind, name, labels, value) for (kind, name, labels), value in list(self.values.items())]
+        for remote in list(self.remote.values()):
+            entries += remote
+        return entries
+
+    def prometheus(self, prefix: str = 'kiwi_') -> str:
+        """Snapshot in the Prometheus text exposition format."""
+        lines: List[str] = []
+        typed = set()
+        for kind, name, labels, value in sorted(self.snapshot(), key=lambda e: (e[1], e[2])):
+            name = prefix + name
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+            if kind != 'histogram':
+                lines.append(f"{name}{_labels(labels)} {value}")
+                continue
+            counts, total, count = value
+            cumulative = 0
+            for bound, n in zip(BOUNDS + (None,), counts):
+                cumulative += n
+                le = '+Inf' if bound is None else f"{bound / 1e9:g}"
+                lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {total / 1e9}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+    def json_line(self) -> str:
+        """Snapshot as one JSON object, stage histograms summarized in milliseconds."""
+        out: Dict[str, Any] = dict(time=datetime.now().isoformat(timespec='seconds'),
+                                   stages=[], counters=[], gauges=[])
+        for kind, name, labels, value in self.snapshot():
+            if kind == 'histogram':
+                counts, total, count = value
+                if count == 0:
+                    continue
+                out['stages'].append(dict(
+                    labels, count=count, mean_ms=total / count / 1e6,
+                    p50_ms=quantile(counts, 0.5) / 1e6, p99_ms=quantile(counts, 0.99) / 1e6))
+            else:
+                out[f'{kind}s'].append(dict(labels, name=name, value=value))
+        return json.dumps(out)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def source_label(loc: Any) -> str:
+    """Metrics label of a source address (ip, port)."""
+    return f"{loc[0]}:{loc[1]}"
+
+# %% Export
+
+
+PROMETHEUS_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class MetricsExport:
+    """Serves a :class:`Metrics` registry over HTTP and appends it to a JSON lines file.
+
+    The HTTP server answers ``GET /metrics`` in the Prometheus text format.
+    Both run in daemon threads until :meth:`close`. The asyncio server runs
+    :func:`serve_prometheus` and :func:`log_json` on its event loop instead.
+    """
+
+    def __init__(
+        self,
+        metrics: Metrics,
+        port: Optional[int] = None,
+        log: Optional[Path] = None,
+        interval: float = 10.0,
+        host: str = '0.0.0.0',
+    ):
+        """
+        Args:
+            metrics (Metrics): The registry to export.
+            port (Optional[int], optional): HTTP port of the Prometheus endpoint. Defaults to None, no endpoint.
+            log (Optional[Path], optional): JSON lines file to append a snapshot to. Defaults to None.
+            interval (float, optional): Seconds between JSON lines. Defaults to 10.0.
+            host (str, optional): Address of the HTTP endpoint. Defaults to '0.0.0.0'.
+        """
+        self.metrics = metrics
+        self.log = log
+        self.server: Optional[ThreadingHTTPServer] = None
+        self.stop = Event()
+        self.threads: List[Thread] = []
+        if port is not None:
+            self.server = ThreadingHTTPServer((host, port), _handler(metrics))
+            self.server.daemon_threads = True
+            self._start(self.server.serve_forever, 'metrics-http')
+            print(f"[Metrics] Serving http://{host}:{port}/metrics")
+        if log is not None:
+            self._start(lambda: self._log(log, interval), 'metrics-log')
+            print(f"[Metrics] Appending to {log} every {interval:g} s")
+
+    def _start(self, target, name: str):
+        thread = Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def _log(self, path: Path, interval: float):
+        while not self.stop.wait(interval):
+            self.write(path)
+
+    def write(self, path: Path):
+        append_json(self.metrics, path)
+
+    def close(self):
+        """Stop serving and append a last line to the log."""
+        self.stop.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        for thread in self.threads:
+            thread.join()
+        if self.log is not None:
+            self.write(self.log)
+
+
+def _handler(metrics: Metrics) -> type:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', PROMETHEUS_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # No console line per scrape
+    return Handler
+
+
+
+def append_json(metrics: Metrics, path: Path):
+    """Append a snapshot of ``metrics`` to the JSON lines file ``path``."""
+    with open(path, 'a') as f:
+        f.write(metrics.json_line() + '\n')
+
+# %% asyncio export
+
+
+async def serve_prometheus(metrics: Metrics, port: int, host: str = '0.0.0.0'):
+    """Answer ``GET /metrics`` in the Prometheus text format on the running event loop until cancelled."""
+    import asyncio
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = (await reader.readline()).decode('latin-1').split()
+            while (await reader.readline()).strip():
+                pass  # Headers
+            if len(request) >= 2 and request[0] == 'GET' and request[1].split('?')[0] == '/metrics':
+                status, ctype, body = '200 OK', PROMETHEUS_TYPE, metrics.prometheus().encode()
+            else:
+                status, ctype, body = '404 Not Found', 'text/plain', b'Not Found\n'
+            writer.write(f"HTTP/1.0 {status}\r\nContent-Type: {ctype}\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (ConnectionError, UnicodeDecodeError):
+            pass  # Scraper gone
+        finally:
+            writer.close()
+
+    try:
+        server = await asyncio.start_server(handle, host, port)
+    except OSError as e:
+        print(f"[Metrics] Cannot serve on {host}:{port}: {e}")
+        return
+    print(f"[Metrics] Serving http://{host}:{port}/metrics")
+    async with server:
+        await server.serve_forever()
+
+
+async def log_json(metrics: Metrics, path: Path, interval: float = 10.0):
+    """Append ``metrics`` to the JSON lines file ``path`` every ``interval`` seconds, and once more when cancelled."""
+    import asyncio
+    print(f"[Metrics] Appending to {path} every {interval:g} s")
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            append_json(metrics, path)
+    finally:
+        append_json(metrics, path)
@@ -2,55 +2,62 @@ from __future__ import annotations
 
 from datetime import datetime
 from pathlib import Path
-from queue import Queue, ShutDown
+from queue import Empty, Queue, ShutDown
 from threading import Thread
-from typing import Iterable, List, Optional, Tuple
-from matplotlib.axes import Axes
-from matplotlib.widgets import Button
+from time import monotonic, perf_counter_ns
+from typing import TYPE_CHECKING, List, Optional, Tuple
 from netCDF4 import Dataset
-from pandas import DataFrame
+from pandas import DataFrame, concat
 
+from backpressure import RECORD_DEPTH, Overflow, RecordQueue
 from storesystem import StoreSystem
 
+if TYPE_CHECKING:
+    from metrics import Histogram
+
 
 class NcDataset(StoreSystem):
-    def __init__(self, dir: Path, axis: Axes):
-        self.button = Button(axis, 'Save')
-        self.button.on_clicked(self.callback)
+    def __init__(
+        self, dir: Path,
+        complevel: int = 4, shuffle: bool = True,
+        chunksize: int = 4096, sync_interval: float = 10.0,
+        prefix: str = 'data', write_time: Optional[Histogram] = None,
+        queue_size: int = RECORD_DEPTH, overflow: Overflow = 'spill'
+    ):
+        """NetCDF4 storage of one recording, from now until :meth:`close`.
+
+        Args:
+            dir (Path): Directory for the data files.
+            complevel (int, optional): zlib compression level, 0 disables compression. Defaults to 4.
+            shuffle (bool, optional): Apply the HDF5 shuffle filter. Defaults to True.
+            chunksize (int, optional): Samples per chunk and per write. Defaults to 4096.
+            sync_interval (float, optional): Seconds between flushes to disk. Defaults to 10.0.
+            prefix (str, optional): File name prefix, followed by the start time. Defaults to 'data'.
+            write_time (Optional[Histogram], optional): Times every write of the storage thread. Defaults to None.
+            queue_size (int, optional): Frames waiting for the storage thread in memory. Defaults to RECORD_DEPTH.
+            overflow (Overflow, optional): When more are waiting, 'block' the caller, 'spill'
+                them to a temporary file or 'drop' them, see :class:`backpressure.RecordQueue`.
+                Defaults to 'spill'.
+        """
         self._dir = dir
         if not self._dir.exists():
             self._dir.mkdir(parents=True, exist_ok=True)
-        self.queue: Optional[Queue] = None
-        self.ncthread: Optional[NcThread] = None
-
-    def get_artist(self):
-        return self.button
-
-    def callback(self, evt):
-        # print(f"Button clicked, {self.queue is None}, {self.ncthread is None}")
-        if self.queue is None:
-            self.button.label.set_text('Close')
-            self.queue = Queue()
-            self.ncthread = NcThread(
-                self.queue, self._dir / f"data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.nc")
-            self.ncthread.start()
-        else:
-            self.button.label.set_text('Save')
-            self.queue.shutdown(immediate=True)
-            self.queue = None
-            if self.ncthread is not None:
-                self.ncthread.join()
-                self.ncthread = None
+        self.queue: Optional[Queue] = RecordQueue(queue_size, overflow, self._dir)
+        self.ncthread: Optional[NcThread] = NcThread(
+            self.queue, self._dir / f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.nc",
+            complevel=complevel, shuffle=shuffle,
+            chunksize=chunksize, sync_interval=sync_interval, write_time=write_time)
+        self.ncthread.start()
 
     def update(self, data: List[Tuple[int, DataFrame]]):
         if self.queue is not None:
-            self.queue.put(data)
+            self.queue.offer(data)
         else:
             pass
 
     def close(self):
         if self.queue is not None:
-            self.queue.shutdown(immediate=True)
+            self.queue.shutdown()  # Write what is still queued
             self.queue = None
         if self.ncthread is not None:
             self.ncthread.join()
@@ -61,11 +68,21 @@ class NcDataset(StoreSystem):
 
 
 class NcThread(Thread):
-    def __init__(self, queue: Queue, name: Path):
+    def __init__(
+        self, queue: Queue, name: Path,
+        complevel: int = 4, shuffle: bool = True,
+        chunksize: int = 4096, sync_interval: float = 10.0,
+        write_time: Optional[Histogram] = None
+    ):
         super().__init__()
         self.queue = queue
         self.fname = name
         self.dataset: Optional[Dataset] = None
+        self.complevel = complevel
+        self.shuffle = shuffle
+        self.chunksize = chunksize
+        self.sync_interval = sync_interval
+        self.write_time = write_time
 
     def run(self):
         # Implement the thread's activity here
@@ -73,39 +90,94 @@ class NcThread(Thread):
         if self.dataset is None:
             self.dataset = Dataset(self.fname, 'w', format='NETCDF4')
         print(f"NetCDF file {self.fname} opened")
+        groups = [
+            NcGroupWriter(self.dataset, kind, self.complevel, self.shuffle, self.chunksize)
+            for kind in kinds
+        ]
+        last_sync = monotonic()
         while True:
             try:
-                data = self.queue.get()
+                data = self.queue.get(timeout=self.sync_interval)
+            except Empty:
+                data = None
             except ShutDown:
                 break
-            for (kind, df) in zip(kinds, data):
-                df: DataFrame = df
-                update_dataset(self.dataset, df, kind)
+            if data is not None:
+                start = perf_counter_ns()
+                for (group, df) in zip(groups, data):
+                    group.update(df)
+                if self.write_time is not None:
+                    self.write_time.observe(perf_counter_ns() - start)
+            if monotonic() - last_sync >= self.sync_interval:
+                self.dataset.sync()
+                last_sync = monotonic()
+        for group in groups:
+            group.flush(final=True)
         self.dataset.close()
         print(f"NetCDF file {self.fname} closed")
 
 
-def update_dataset(ds: Dataset, df: DataFrame, id: str):
-    """Update the netCDF4 Dataset with new data from the DataFrame."""
+class NcGroupWriter:
+    """Appends the new samples of one sensor to its NetCDF group.
+
+    The recorder hands over every sample once, see :mod:`recorder`. They are
+    written in whole chunks of ``chunksize`` samples; the remainder is written
+    on the final flush.
+    """
+
+    def __init__(self, ds: Dataset, id: str, complevel: int = 4, shuffle: bool = True, chunksize: int = 4096):
+        self.ds = ds
+        self.id = id
+        self.complevel = complevel
+        self.shuffle = shuffle
+        self.chunksize = chunksize
+        self.pending: List[DataFrame] = []
+        self.npending = 0
+
+    def update(self, df: DataFrame):
+        if len(df) == 0:
+            return
+        self.pending.append(df)
+        self.npending += len(df)
+        if self.npending >= self.chunksize:
+            self.flush()
+
+    def flush(self, final: bool = False):
+        """Write all whole chunks pending, or everything if ``final``."""
+        if self.npending == 0:
+            return
+        df = concat(self.pending, ignore_index=True)
+        nwrite = len(df) if final else len(df) - len(df) % self.chunksize
+        update_dataset(
+            self.ds, df.iloc[:nwrite], self.id,
+            self.complevel, self.shuffle, self.chunksize
+        )
+        rest = df.iloc[nwrite:]
+        self.pending = [rest] if len(rest) else []
+        self.npending = len(rest)
+
+
+def update_dataset(
+    ds: Dataset, df: DataFrame, id: str,
+    complevel: int = 4, shuffle: bool = True, chunksize: int = 4096
+):
+    """Append the data from the DataFrame to group ``id`` of the netCDF4 Dataset."""
     columns = [col for col in df.columns if col != 'tstamp']
     if id not in ds.groups.keys():
         print(f'\tCreating NetCDF group for ID {id}')
         group = ds.createGroup(id)
         group.createDimension('tstamp', None)
-        nctime = group.createVariable(
-            'tstamp', 'f8', ('tstamp',), compression='zlib')
-        for col in columns:
-            group.createVariable(
-                col, 'f4', ('tstamp',), compression='zlib')
-        nctime[:] = df['tstamp'].values  # type: ignore
-        for col in columns:
-            var = group.variables[col]
-            var[:] = df[col].values  # type: ignore
-    else:
-        group = ds.groups[id]
-        nctime = group.variables['tstamp']
-        dlen = len(nctime)
-        nctime[dlen:] = df['tstamp'].values  # type: ignore
+        options = dict(
+            compression='zlib' if complevel > 0 else None,
+            complevel=complevel, shuffle=shuffle, chunksizes=(chunksize,)
+        )
+        group.createVariable('tstamp', 'f8', ('tstamp',), **options)
         for col in columns:
-            var = group.variables[col]
-            var[dlen:] = df[col].values  # type: ignore
+            group.createVariable(col, 'f4', ('tstamp',), **options)
+    group = ds.groups[id]
+    nctime = group.variables['tstamp']
+    dlen = len(nctime)
+    nctime[dlen:] = df['tstamp'].values  # type: ignore
+    for col in columns:
+        var = group.variables[col]
+        var[dlen:] = df[col].values  # type: ignore
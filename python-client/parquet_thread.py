@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+from datetime import datetime
+from pathlib import Path
+from queue import Queue, ShutDown
+from threading import Thread
+from time import perf_counter_ns
+from typing import TYPE_CHECKING, List, Literal, Optional, Tuple
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pandas import DataFrame, concat
+
+from backpressure import RECORD_DEPTH, Overflow, RecordQueue
+from storesystem import StoreSystem
+
+if TYPE_CHECKING:
+    from metrics import Histogram
+
+ParquetCodec = Literal['zstd', 'lz4']
+
+
+class ParquetDataset(StoreSystem):
+    def __init__(
+        self, dir: Path,
+        codec: ParquetCodec = 'zstd', row_group_size: int = 65536,
+        prefix: str = 'data', write_time: Optional[Histogram] = None,
+        queue_size: int = RECORD_DEPTH, overflow: Overflow = 'spill'
+    ):
+        """Parquet storage of one recording, one file per sensor, from now until :meth:`close`.
+
+        Args:
+            dir (Path): Directory for the data files.
+            codec (ParquetCodec, optional): Compression codec. Defaults to 'zstd'.
+            row_group_size (int, optional): Samples per row group. Defaults to 65536.
+            prefix (str, optional): File name prefix, followed by the start time. Defaults to 'data'.
+            write_time (Optional[Histogram], optional): Times every write of the storage thread. Defaults to None.
+            queue_size (int, optional): Frames waiting for the storage thread in memory. Defaults to RECORD_DEPTH.
+            overflow (Overflow, optional): When more are waiting, 'block' the caller, 'spill'
+                them to a temporary file or 'drop' them, see :class:`backpressure.RecordQueue`.
+                Defaults to 'spill'.
+        """
+        self._dir = dir
+        if not self._dir.exists():
+            self._dir.mkdir(parents=True, exist_ok=True)
+        self.queue: Optional[Queue] = RecordQueue(queue_size, overflow, self._dir)
+        self.pqthread: Optional[ParquetThread] = ParquetThread(
+            self.queue, self._dir / f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
+            codec=codec, row_group_size=row_group_size, write_time=write_time)
+        self.pqthread.start()
+
+    def update(self, data: List[Tuple[int, DataFrame]]):
+        if self.queue is not None:
+            self.queue.offer(data)
+        else:
+            pass
+
+    def close(self):
+        if self.queue is not None:
+            self.queue.shutdown()  # Write what is still queued
+            self.queue = None
+        if self.pqthread is not None:
+            self.pqthread.join()
+            self.pqthread = None
+            print("Parquet files closed")
+        else:
+            print("No Parquet files to close")
+
+
+class ParquetThread(Thread):
+    def __init__(
+        self, queue: Queue, name: Path,
+        codec: ParquetCodec = 'zstd', row_group_size: int = 65536,
+        write_time: Optional[Histogram] = None
+    ):
+        """Writes ``<name>_<sensor>.parquet`` for every sensor."""
+        super().__init__()
+        self.queue = queue
+        self.fname = name
+        self.codec = codec
+        self.row_group_size = row_group_size
+        self.write_time = write_time
+
+    def run(self):
+        kinds = ['accel', 'gyro', 'mag', 'baro']
+        writers = [
+            ParquetSensorWriter(
+                self.fname.with_name(f"{self.fname.name}_{kind}.parquet"),
+                self.codec, self.row_group_size)
+            for kind in kinds
+        ]
+        print(f"Parquet files {self.fname}_*.parquet opened")
+        while True:
+            try:
+                data = self.queue.get()
+            except ShutDown:
+                break
+            start = perf_counter_ns()
+            for (writer, df) in zip(writers, data):
+                writer.update(df)
+            if self.write_time is not None:
+                self.write_time.observe(perf_counter_ns() - start)
+        for writer in writers:
+            writer.close()
+        print(f"Parquet files {self.fname}_*.parquet closed")
+
+
+class ParquetSensorWriter:
+    """Buffers the new samples of one sensor into whole row groups.
+
+    The recorder hands over every sample once, see :mod:`recorder`.
+    """
+
+    def __init__(self, path: Path, codec: ParquetCodec = 'zstd', row_group_size: int = 65536):
+        self.path = path
+        self.codec = codec
+        self.row_group_size = row_group_size
+        self.writer: Optional[pq.ParquetWriter] = None
+        self.schema: Optional[pa.Schema] = None
+        self.pending: List[DataFrame] = []
+        self.npending = 0
+
+    def update(self, df: DataFrame):
+        if len(df) == 0:
+            return
+        self.pending.append(df)
+        self.npending += len(df)
+        if self.npending >= self.row_group_size:
+            self.flush()
+
+    def flush(self, final: bool = False):
+        """Write all whole row groups pending, or everything if ``final``."""
+        if self.npending == 0:
+            return
+        df = concat(self.pending, ignore_index=True)
+        if self.writer is None:
+            self.schema = pa.schema(
+                [('tstamp', pa.uint64())] +
+                [(col, pa.float32()) for col in df.columns if col != 'tstamp']
+            )
+            self.writer = pq.ParquetWriter(self.path, self.schema, compression=self.codec)
+        nwrite = len(df) if final else len(df) - len(df) % self.row_group_size
+        table = pa.Table.from_pandas(df.iloc[:nwrite], schema=self.schema, preserve_index=False)
+        self.writer.write_table(table, row_group_size=self.row_group_size)
+        rest = df.iloc[nwrite:]
+        self.pending = [rest] if len(rest) else []
+        self.npending = len(rest)
+
+    def close(self):
+        self.flush(final=True)
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
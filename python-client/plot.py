@@ -1,23 +1,23 @@
 # %%
 from datetime import datetime
-from pathlib import Path
+import os
 from queue import Empty
-from typing import Any, Literal
-import matplotlib
-from time import perf_counter_ns, sleep as nanosleep
+from typing import Any, List, Optional, Sequence, Tuple
+from time import perf_counter_ns
 from matplotlib.axes import Axes
 from matplotlib.gridspec import GridSpec
 import numpy as np
-import pandas as pd
 import matplotlib
 import matplotlib.pyplot as plt
-from multiprocessing import Queue, Event
-from decoder import xyz_to_rtp
+from matplotlib.widgets import Button
+from multiprocessing import Queue
+from decoder import DataBuffer
+from decimate import DecimateKind, WindowDecimator
+from derived import channel
+from metrics import Metrics, source_label
 import warnings
 
-from storesystem import StoreSystem
-from nc_thread import NcDataset
-from xlsx_thread import XlsxDataset
+from shmring import SharedDataView, SharedSpec
 
 # Ignore matplotlib warnings
 warnings.filterwarnings("ignore", category=RuntimeWarning)
@@ -28,341 +28,581 @@ matplotlib.rc(
     serif=['Times New Roman'],
 )
 
-matplotlib.use('QtAgg')  # Use TkAgg backend for interactive plotting
+if 'MPLBACKEND' not in os.environ:  # e.g. MPLBACKEND=Agg for offscreen benchmarks
+    matplotlib.use('QtAgg')  # Use TkAgg backend for interactive plotting
 
 # %%
-SaveKind = Literal['excel', 'netcdf']
+DPI = 96
+FIG_WID = 800 / DPI
+FIG_HEI = 600 / DPI
+Y_MARGIN = 0.25  # Headroom around the data when the y limits are refitted
+Y_SHRINK = 0.4  # Refit once the data spans less than this part of the y limits
+BUDGET_HIGH = 0.9  # Update the secondary panels less often above this part of the frame budget
+BUDGET_LOW = 0.5  # and more often again below it
+MAX_STRIDE = 8  # Secondary panels are updated at least every this many frames
+ADAPT_FRAMES = 10  # Frames between two changes of the secondary stride
 
-# %%
 
+def fit_ylim(ax: Axes, lo: float, hi: float, eager: bool = False) -> bool:
+    """Fit the y limits of ``ax`` to the data range ``lo``..``hi`` with hysteresis.
 
-def get_sel(df: pd.DataFrame, now, winsize: int):
-    sel = df['tstamp'] > (now - winsize * 1e3)
-    return sel
+    The limits are refitted with some headroom when the data leaves them, and
+    only shrunk once the data uses a small part of them, so most frames keep
+    the limits (and the cached background) unchanged.
 
+    Args:
+        ax (Axes): The axis.
+        lo (float): Smallest value plotted.
+        hi (float): Largest value plotted.
+        eager (bool, optional): A full draw is due anyway, also refit if the data
+            is about to leave the limits. Defaults to False.
 
-# %%
-DPI = 96
-FIG_WID = 800 / DPI
-FIG_HEI = 600 / DPI
+    Returns:
+        bool: True if the limits changed.
+    """
+    if not (np.isfinite(lo) and np.isfinite(hi)):
+        return False
+    cur_lo, cur_hi = ax.get_ylim()
+    if eager:
+        inset = (cur_hi - cur_lo) * Y_MARGIN / 2
+        cur_lo, cur_hi = cur_lo + inset, cur_hi - inset
+    if cur_lo <= lo and hi <= cur_hi and (hi - lo) >= (cur_hi - cur_lo) * Y_SHRINK:
+        return False
+    pad = (hi - lo) * Y_MARGIN or max(abs(hi) * Y_MARGIN, 1e-3)
+    # Twice the headroom on the side the data left through, it is likely trending
+    ax.set_ylim(lo - pad * (1 + (lo < cur_lo)), hi + pad * (1 + (hi > cur_hi)))
+    return True
+
+
+class SensorFigure:
+    """The sensor plots of one board.
+
+    The time axis is relative to the newest sample, so its limits never change,
+    and the y limits follow the data with hysteresis, see :func:`fit_ylim`.
+
+    With ``blit`` the data artists are animated: a frame restores the cached
+    background of the figure and draws only those artists over it. The whole
+    figure is drawn, and the background cached again, only when a y limit
+    changes or the canvas redraws itself, e.g. on resize or a button click.
+    """
+
+    def __init__(
+        self, source: Any, winsize: int,
+        blit: bool = True, decimate: Optional[DecimateKind] = 'minmax'
+    ):
+        """
+        Args:
+            source (Any): UDP source address (ip, port)
+            winsize (int): Window size in milliseconds for displaying data.
+            blit (bool, optional): Redraw only the data artists between full draws. Defaults to True.
+            decimate (Optional[DecimateKind], optional): Reduce every line to about two points per
+                pixel, see :mod:`decimate`. None plots every sample. Defaults to 'minmax'.
+        """
+        self.winsize = winsize
+        self.blit = blit
+        # Plot points of the accel, gyro and mag (x, y, z and the derived |R|) and baro buffers
+        self.windows = [
+            *(WindowDecimator(winsize, channel(sensor, 'r') + 1, decimate) for sensor in ('accel', 'gyro', 'mag')),
+            WindowDecimator(winsize, 3, decimate),
+        ]
+        # Buffer channels of the derived θ and φ of accel and mag, see :mod:`derived`
+        self.angles = {aid: (channel(sensor, 'theta'), channel(sensor, 'phi'))
+                       for aid, sensor in ((0, 'accel'), (2, 'mag'))}
+        # Baro samples of the frames that left out the secondary panels
+        self.held: List[Tuple[np.ndarray, ...]] = []
+        self.background = None  # Figure without the animated artists
+        # The grid layout for the subplots
+        # ___________________________
+        # | Accel |         |       |
+        # |       |         |       |
+        # |_______| Accel θ | Mag θ |
+        # | Gyro  |         |       |
+        # |       |         |       |
+        # |_______|_________|_______|
+        # | Mag   |                 |
+        # |       |                 |
+        # |_______|     Mag φ       |
+        # | Temp  |    Compass      |
+        # |_______|                 |
+        # | Pres  |                 |
+        # | Alt   |                 |
+        # |_______|_________________|
+        grid = GridSpec(
+            7, 9,
+            height_ratios=[0.2, 0.1, 1, 1, 1, 1, 1], # Legend, 5 line plots
+            width_ratios=[1]*4 + [0.2] + [1]*4, # Line plots, gap, polar plots
+            hspace=0.05, wspace=0.3
+        )
+        START = 2 # Start row for plots
+        fig = plt.figure(figsize=(FIG_WID, FIG_HEI), dpi=DPI)
+        self.fig = fig
+        # Set window title
+        fig.canvas.manager.set_window_title(  # type: ignore
+            # type: ignore
+            f'Kiwi Mainboard Sensor Data ({source[0]}:{source[1]})')
+        fig.suptitle('Kiwi Mainboard Sensor Data', fontsize=16, fontweight='bold')
+        self.fignum = fig.number
+        # Display FPS and data rate here
+        self.curtime = fig.text(
+            0.95, 0.95, "Waiting for data...",
+            fontsize=8, ha='right', va='center'
+        )
+
+        # First row for button, use the full width
+        self.button_ax = fig.add_subplot(grid[0, 3:6])
+
+        # First row for legend, use the left section only
+        legend_ax = fig.add_subplot(grid[START-1, 1:3])
+
+        axs = []
+        # Create accel, gyro, mag axes
+        for i in range(3):
+            if i == 0:
+                ax = fig.add_subplot(grid[i+START, :4])
+            else:
+                ax = fig.add_subplot(grid[i+START, :4], sharex=axs[0])
+            axs.append(ax)
+        self.axs = np.asarray(axs)
+        # Seconds before the newest sample
+        self.axs[0].set_xlim(-winsize*1e-3, 0)
+
+        # Create polar plots for accel and mag orientation
+        accel_theta = fig.add_subplot(grid[START:START+2, 5:7], projection='polar')
+        mag_theta = fig.add_subplot(grid[START:START+2, 7:9], projection='polar')
+        mag_phi = fig.add_subplot(grid[START+2:, 5:], projection='polar')
+        accel_theta.set_xlim(-np.pi/2, np.pi/2)
+        accel_theta.set_ylim(0, 1.1)
+        accel_theta.set_yticklabels([])
+        accel_theta.text(
+            1.05, 0.5, 'Acceleration θ',
+            fontsize=10, ha='center', va='center', transform=accel_theta.transAxes, rotation=270
+        )
+        mag_theta.set_xlim(-np.pi/2, np.pi/2)
+        mag_theta.set_ylim(0, 1.1)
+        mag_theta.set_yticklabels([])
+        mag_theta.text(
+            1.05, 0.5, 'Magnetic Field θ',
+            fontsize=10, ha='center', va='center', transform=mag_theta.transAxes, rotation=270
+        )
+        mag_phi.set_xlim(0, 2*np.pi)
+        mag_phi.set_ylim(0, 1.1)
+        mag_phi.set_yticklabels([])
+        self.magphi_tx = mag_phi.text(
+            1.1, 0.5, 'Magnetic Field φ',
+            fontsize=10, ha='center', va='center', transform=mag_phi.transAxes, rotation=270
+        )
+
+        # Create temperature axis
+        self.temp_ax = temp_ax = fig.add_subplot(grid[START+3, :4], sharex=axs[0])
+        temp_ax.set_ylabel('°C', fontsize=12)
+
+        # Create pressure and altitude axes
+        self.pres_ax = pres_ax = fig.add_subplot(grid[START+4, :4], sharex=axs[0])
+        self.alt_ax = alt_ax = pres_ax.twinx()
+        pres_ax.set_ylabel('hPa', fontsize=12)
+        alt_ax.set_ylabel('m', fontsize=12, color='r')
+        pres_ax.set_xlabel('Time (s)', fontsize=12)
+
+        fig.subplots_adjust()
+
+        # Turn off x tick labels for all but the bottom plot
+        for (ax, title, unit) in zip(self.axs, ('Acceleration', 'ω', 'Magnetic Field'), ('g', '°/s', 'μT')):
+            ax: Axes = ax
+            # ax.set_title(title, fontsize=10, fontweight='bold')
+            ax.set_ylabel(unit, fontsize=12)
+            ax.tick_params(axis='x', which='both', labelbottom=False)
+
+        temp_ax.tick_params(axis='x', which='both', labelbottom=False)
+        alt_ax.tick_params(axis='x', which='both', labelbottom=False)
+
+        # Create empty lines for updating data
+        lines = []
+        for mid, axm in enumerate(self.axs):
+            lines.append([])
+            lines[mid].append(
+                axm.plot([], [], label='X', color='red', alpha=0.5, linewidth=0.75)[0])
+            lines[mid].append(
+                axm.plot([], [], label='Y', color='green', alpha=0.5, linewidth=0.75)[0])
+            lines[mid].append(
+                axm.plot([], [], label='Z', color='blue', alpha=0.5, linewidth=0.75)[0])
+            lines[mid].append(
+                axm.plot([], [], color='black', linestyle='--',
+                         linewidth=0.75, alpha=0.5)[0]
+            )
+        self.lines = lines
+
+        self.accel_line, = accel_theta.plot([], [], color='blue', linewidth=2)
+        self.mag_theta_line, = mag_theta.plot([], [], color='blue', linewidth=2)
+        self.mag_phi_line, = mag_phi.plot([], [], color='blue', linewidth=2)
+
+        self.temp_line, = temp_ax.plot(
+            [], [], label='Temperature', color='k', alpha=0.8, linewidth=0.75)
+        self.pres_line, = pres_ax.plot([], [], label='Pressure',
+                                       color='b', alpha=0.8, linewidth=0.75)
+        self.alt_line, = alt_ax.plot([], [], label='Altitude',
+                                     color='r', alpha=0.8, linewidth=0.75)
+
+        # Create legend
+        legend_ax.legend(
+            handles=lines[0],
+            labels=['X', 'Y', 'Z', '|R|'],
+            loc='center',
+            ncol=4,
+            fontsize=12,
+            frameon=False
+        )
+        legend_ax.set_axis_off()
+
+        # Everything that changes from frame to frame
+        self.artists = [
+            *(line for lline in lines for line in lline),
+            self.accel_line, self.mag_theta_line, self.mag_phi_line,
+            self.temp_line, self.pres_line, self.alt_line,
+            self.magphi_tx, self.curtime,
+        ]
+        if blit:
+            for art in self.artists:
+                art.set_animated(True)
+            fig.canvas.mpl_connect('draw_event', self._on_draw)
+
+    def _on_draw(self, evt):
+        # A full draw leaves out the animated artists: cache it, then add them
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self._draw_artists()
+
+    def _draw_artists(self):
+        for art in self.artists:
+            self.fig.draw_artist(art)
+
+    def is_open(self) -> bool:
+        return self.fignum in plt.get_fignums()
+
+    def show(self):
+        self.fig.show()
+        # Update the figure once to render the window
+        self.fig.canvas.draw()
+        self.fig.canvas.flush_events()
+
+    def set_status(self, text: str):
+        self.curtime.set_text(text)
+
+    def clear(self, sensor: int):
+        """Forget the plot points of a sensor buffer that was cleared, see :meth:`DataBuffer.follow`."""
+        self.windows[sensor].clear()
+        if sensor == 3:
+            self.held.clear()
+
+    def update(
+        self,
+        buffers: Sequence[DataBuffer],
+        deltas: Optional[Sequence[Tuple[np.ndarray, ...]]] = None,
+        secondary: bool = True,
+    ) -> bool:
+        """Plot the last ``winsize`` milliseconds of the sensor buffers.
+
+        Args:
+            buffers (Sequence[DataBuffer]): The accel, gyro, mag and baro buffers.
+            deltas (Optional[Sequence[Tuple[np.ndarray, ...]]], optional): Samples added to
+                each buffer since the last update, see :meth:`DataBuffer.since`.
+                Defaults to None, reading the whole buffers.
+            secondary (bool, optional): Also update the secondary panels: the polar plots,
+                temperature and pressure. Defaults to True, see :class:`FrameScheduler`.
+
+        Returns:
+            bool: True if a y limit changed, so the next frame needs a full draw.
+        """
+        ranges = []  # (axis, lo, hi) of every line plot with data
+        # Use the last timestamp to synchronize different sensors
+        now = int(buffers[0].latest(1)[0][-1])
+        width = int(self.axs[0].bbox.width)  # Pixels along the time axis
+        plots = [
+            *zip(self.lines, self.axs),
+            ((self.temp_line, self.pres_line, self.alt_line), (self.temp_ax, self.pres_ax, self.alt_ax)),
+        ]
+        for i, ((lline, axes), buf, win) in enumerate(zip(plots, buffers, self.windows)):
+            delta = deltas[i] if deltas is not None else None
+            if i == 3:  # Baro, a secondary panel: keep its samples for the next update
+                if not secondary:
+                    if delta is not None:
+                        self.held.append(delta)
+                    continue
+                if self.held and delta is not None:
+                    delta = tuple(np.concatenate(parts) for parts in zip(*self.held, delta))
+                self.held.clear()
+            # The lines: X, Y, Z, |R| or temperature, pressure, altitude
+            tstamp, values = win.update(buf, delta, width, now)
+            tstamp = (tstamp - now) * 1e-6  # Seconds before the newest sample
+            for c, line in enumerate(lline):
+                line.set_data(tstamp[c], values[c])
+            if values.shape[1] == 0:
+                continue
+            if i < 3:  # One axis for all lines
+                ranges.append((axes, np.nanmin(values), np.nanmax(values)))
+            else:  # One axis per line
+                ranges.extend(zip(axes, np.nanmin(values, axis=1), np.nanmax(values, axis=1)))
+        # Update polar plots, use only the last data point
+        for aid, (theta, phi) in (self.angles.items() if secondary else ()):
+            _, *values = buffers[aid].latest(1)
+            if len(values[0]) == 0:
+                continue
+            t = values[theta][-1] # theta
+            p = values[phi][-1] # phi
+            if aid == 0:  # accel
+                self.accel_line.set_data([t, t], [0, 1])
+            else:  # mag
+                self.mag_theta_line.set_data([t, t], [0, 1])
+                self.mag_phi_line.set_data([p, p], [0, 1])
+                self.magphi_tx.set_text(
+                    f'Azimuthal Angle (φ): {np.degrees(p):.1f}°')
+        changed = any([fit_ylim(*rng) for rng in ranges])
+        if changed:
+            # Refit the axes about to change too, while the figure is redrawn anyway
+            for rng in ranges:
+                fit_ylim(*rng, eager=True)
+        return changed
+
+    def render(self, full: bool = False):
+        """Show the current frame, with a full draw if ``full`` or not blitting."""
+        canvas = self.fig.canvas
+        if not self.blit:
+            canvas.draw_idle()
+        elif full or self.background is None:
+            canvas.draw()  # Caches the new background, see _on_draw
+        else:
+            canvas.restore_region(self.background)
+            self._draw_artists()
+            canvas.blit(self.fig.bbox)
+        canvas.flush_events()
+
+
+class FrameScheduler:
+    """Paces the frames of :func:`draw_loop` and sheds load from the secondary panels.
+
+    Frames are due every ``frametime`` nanoseconds, window events are processed
+    while waiting for the next one. A frame without new samples is skipped. The
+    work of each frame drawn is averaged as a part of the frame budget: above
+    :data:`BUDGET_HIGH` the secondary panels (polar plots, temperature and
+    pressure) are updated every other frame, then every fourth, up to
+    :data:`MAX_STRIDE`, and below :data:`BUDGET_LOW` more often again. Only
+    then does the frame rate itself drop.
+    """
+
+    def __init__(self, frametime: int, smoothing: float = 0.2):
+        """
+        Args:
+            frametime (int): Target frame time in nanoseconds.
+            smoothing (float, optional): Weight of the newest frame in :attr:`usage`. Defaults to 0.2.
+        """
+        self.frametime = frametime
+        self.smoothing = smoothing
+        self.usage = 0.0  # Average part of the frame budget used by a frame
+        self.stride = 1  # Secondary panels are updated every stride frames
+        self.frames = 0  # Frames drawn
+        self.skipped = 0  # Frames skipped without new samples
+        self.adapted = 0  # Frames drawn at the last change of the stride
+        self.due = perf_counter_ns()
+
+    def wait(self, canvas):
+        """Process window events until the next frame is due."""
+        now = perf_counter_ns()
+        self.due += self.frametime
+        if self.due <= now:
+            self.due = now  # Late: start at once, without catching up
+            canvas.flush_events()
+        else:
+            canvas.start_event_loop((self.due - now) / 1e9)
+
+    def secondary(self) -> bool:
+        """Whether the next frame updates the secondary panels."""
+        return self.frames % self.stride == 0
+
+    def skip(self):
+        """Account a frame skipped without new samples."""
+        self.skipped += 1
+
+    def done(self, work: int):
+        """Account a frame drawn in ``work`` nanoseconds and adapt the secondary stride."""
+        self.frames += 1
+        self.usage += self.smoothing * (work / self.frametime - self.usage)
+        if self.frames - self.adapted < ADAPT_FRAMES:
+            return
+        if self.usage > BUDGET_HIGH and self.stride < MAX_STRIDE:
+            self.stride *= 2
+            self.adapted = self.frames
+        elif self.usage < BUDGET_LOW and self.stride > 1:
+            self.stride //= 2
+            self.adapted = self.frames
+
+    def status(self) -> str:
+        """Frame budget usage for the stats line."""
+        text = f"Frame Budget: {self.usage:.0%} of {self.frametime / 1e6:.1f} ms"
+        if self.stride > 1:
+            text += f" (polar/baro every {self.stride} frames)"
+        return text
+
+
+class SaveButton:
+    """Save/Close button asking the ingest process to start or stop recording a board.
+
+    The ingest records every sample it decodes, see :meth:`udp_thread.Ingest.control`,
+    this process only posts ``(source, recording)`` on ``commands``.
+    """
+
+    def __init__(self, axis: Axes, source: Any, commands: Queue):
+        self.source = source
+        self.commands = commands
+        self.recording = False
+        self.button = Button(axis, 'Save')
+        self.button.on_clicked(self.callback)
+
+    def callback(self, evt):
+        self.recording = not self.recording
+        self.commands.put_nowait((self.source, self.recording))
+        self.button.label.set_text('Close' if self.recording else 'Save')
 
 
 def draw_loop(
         source: Any,
+        specs: Tuple[SharedSpec, SharedSpec, SharedSpec, SharedSpec],
         request: Queue,
         response: Queue,
         info: Queue,
         shutdown: Any,
-        datapath: Path = Path.cwd() / 'data',
-        savekind: SaveKind = 'netcdf',
         winsize: int = 1000,
-        frametime: int = int(1e9 / 1)
+        frametime: int = int(1e9 / 30),
+        blit: bool = True,
+        decimate: Optional[DecimateKind] = 'minmax',
+        commands: Optional[Queue] = None,
+        metrics: Optional[Queue] = None
     ):
     """A drawing loop that requests data from the UDP server :func:`udp_loop`
-    and plots the data in real-time.
+    and plots the data in real-time, paced by a :class:`FrameScheduler`.
 
     Args:
         source (Any): UDP source address (ip, port)
-        request (Queue): Request data from UDP server by putting any value in this queue
-        response (Queue): Response from UDP server: tuple of DataFrames (accel, gyro, mag, baro)
+        specs (Tuple[SharedSpec, ...]): Shared memory buffers of the UDP server (accel, gyro, mag, baro)
+        request (Queue): Request a frame from UDP server by putting any value in this queue
+        response (Queue): Response from UDP server: number of samples written per buffer
         info (Queue): Info queue from UDP server: (source: (ip, port), datetime, bitrate, byteunit, packrate, packunit)
-        shutdown (Event): Signal to UDP server that the drawing loop is shutting down
-        datapath (Path, optional): Path to store NetCDF files. Defaults to current working directory / 'data'.
-        savekind (SaveKind, optional): Kind of file to save data. Defaults to 'netcdf'.
+        shutdown (Event): Signal to UDP server that the drawing loop is shutting down, set by the
+            UDP server to close the window once the session expired
         winsize (int, optional): Window size in milliseconds for displaying data. Defaults to 1000.
-        frametime (int, optional): Frame time in nanoseconds for limiting FPS. Defaults to 100_000_000 (10 FPS).
+        frametime (int, optional): Target frame time in nanoseconds, see :class:`FrameScheduler`. Defaults to 1/30 s.
+        blit (bool, optional): Blit the data artists instead of redrawing the figure, see :class:`SensorFigure`. Defaults to True.
+        decimate (Optional[DecimateKind], optional): Decimation of the plot lines, see :class:`SensorFigure`. Defaults to 'minmax'.
+        commands (Optional[Queue], optional): Save button commands to the UDP server, see :class:`SaveButton`.
+            Defaults to None, no Save button.
+        metrics (Optional[Queue], optional): Post the 'ipc' and 'render' timings here
+            with every info, see :mod:`metrics`. Defaults to None.
     """
     # The UDP source address
     ip, port = source
+    label = source_label(source)
+    stats = Metrics()
+    ipc_time = stats.histogram('ipc', label)
+    render_time = stats.histogram('render', label)
+    # Map the sensor buffers of the UDP server
+    buffers = [SharedDataView(*spec) for spec in specs]
+    # Local rolling windows, fed with the samples newer than our cursors
+    windows = [DataBuffer(maxlen=buf.maxlen, channels=buf.channels) for buf in buffers]
+    cursors = [0] * len(buffers)
     # Turn off interactie mode for dynamic plotting
     plt.ioff()
-    # The grid layout for the subplots
-    # ___________________________
-    # | Accel |         |       |
-    # |       |         |       |
-    # |_______| Accel θ | Mag θ |
-    # | Gyro  |         |       |
-    # |       |         |       |
-    # |_______|_________|_______|
-    # | Mag   |                 |
-    # |       |                 |
-    # |_______|     Mag φ       |
-    # | Temp  |    Compass      |
-    # |_______|                 |
-    # | Pres  |                 |
-    # | Alt   |                 |
-    # |_______|_________________|
-    grid = GridSpec(
-        7, 9,
-        height_ratios=[0.2, 0.1, 1, 1, 1, 1, 1], # Legend, 5 line plots
-        width_ratios=[1]*4 + [0.2] + [1]*4, # Line plots, gap, polar plots
-        hspace=0.05, wspace=0.3
-    )
-    START = 2 # Start row for plots
-    fig = plt.figure(figsize=(FIG_WID, FIG_HEI), dpi=DPI, animated=True)
-    # Set window title
-    fig.canvas.manager.set_window_title(  # type: ignore
-        # type: ignore
-        f'Kiwi Mainboard Sensor Data ({source[0]}:{source[1]})')
-    fig.suptitle('Kiwi Mainboard Sensor Data', fontsize=16, fontweight='bold')
-    fignum = fig.number
-    # Display FPS and data rate here
-    curtime = fig.text(
-        0.95, 0.95, "Waiting for data...",
-        fontsize=8, ha='right', va='center'
-    )
-
-    # First row for button, use the full width
-    button_ax = fig.add_subplot(grid[0, 3:6])
-    if savekind == 'excel':
-        datastor = XlsxDataset(datapath, button_ax)
-    elif savekind == 'netcdf':
-        datastor = NcDataset(datapath, button_ax)
+    plots = SensorFigure(source, winsize, blit=blit, decimate=decimate)
+    if commands is not None:
+        _save = SaveButton(plots.button_ax, source, commands)  # Kept, the canvas holds widgets weakly
     else:
-        raise ValueError(f"Invalid savekind: {savekind}")
+        plots.button_ax.set_axis_off()
 
-    # First row for legend, use the left section only
-    legend_ax = fig.add_subplot(grid[START-1, 1:3])
-    
-    axs = []
-    # Create accel, gyro, mag axes
-    for i in range(3):
-        if i == 0:
-            ax = fig.add_subplot(grid[i+START, :4])
-        else:
-            ax = fig.add_subplot(grid[i+START, :4], sharex=axs[0])
-        ax.autoscale(enable=True, axis='y')
-        axs.append(ax)
-    axs = np.asarray(axs)
-
-    # Create polar plots for accel and mag orientation
-    accel_theta = fig.add_subplot(grid[START:START+2, 5:7], projection='polar')
-    mag_theta = fig.add_subplot(grid[START:START+2, 7:9], projection='polar')
-    mag_phi = fig.add_subplot(grid[START+2:, 5:], projection='polar')
-    accel_theta.set_xlim(-np.pi/2, np.pi/2)
-    accel_theta.set_ylim(0, 1.1)
-    accel_theta.set_yticklabels([])
-    accel_theta.text(
-        1.05, 0.5, 'Acceleration θ',
-        fontsize=10, ha='center', va='center', transform=accel_theta.transAxes, rotation=270
-    )
-    mag_theta.set_xlim(-np.pi/2, np.pi/2)
-    mag_theta.set_ylim(0, 1.1)
-    mag_theta.set_yticklabels([])
-    mag_theta.text(
-        1.05, 0.5, 'Magnetic Field θ',
-        fontsize=10, ha='center', va='center', transform=mag_theta.transAxes, rotation=270
-    )
-    mag_phi.set_xlim(0, 2*np.pi)
-    mag_phi.set_ylim(0, 1.1)
-    mag_phi.set_yticklabels([])
-    magphi_tx = mag_phi.text(
-        1.1, 0.5, 'Magnetic Field φ',
-        fontsize=10, ha='center', va='center', transform=mag_phi.transAxes, rotation=270
-    )
-
-    # Create temperature axis
-    temp_ax = fig.add_subplot(grid[START+3, :4], sharex=axs[0])
-    temp_ax.autoscale(enable=True, axis='y')
-    temp_ax.set_ylabel('°C', fontsize=12)
-
-    # Create pressure and altitude axes
-    pres_ax = fig.add_subplot(grid[START+4, :4], sharex=axs[0])
-    pres_ax.autoscale(enable=True, axis='y')
-    alt_ax = pres_ax.twinx()
-    alt_ax.autoscale(enable=True, axis='y')
-    pres_ax.set_ylabel('hPa', fontsize=12)
-    alt_ax.set_ylabel('m', fontsize=12, color='r')
-    pres_ax.set_xlabel('Time (s)', fontsize=12)
-
-    fig.subplots_adjust()
-
-    # Turn off x tick labels for all but the bottom plot
-    for (ax, title, unit) in zip(axs, ('Acceleration', 'ω', 'Magnetic Field'), ('g', '°/s', 'μT')):
-        ax: Axes = ax
-        # ax.set_title(title, fontsize=10, fontweight='bold')
-        ax.set_ylabel(unit, fontsize=12)
-        ax.tick_params(axis='x', which='both', labelbottom=False)
-
-    temp_ax.tick_params(axis='x', which='both', labelbottom=False)
-    alt_ax.tick_params(axis='x', which='both', labelbottom=False)
-
-    # Create empty lines for updating data
-    lines = []
-    for mid, axm in enumerate(axs):
-        lines.append([])
-        lines[mid].append(
-            axm.plot([], [], label='X', color='red', alpha=0.5, linewidth=0.75)[0])
-        lines[mid].append(
-            axm.plot([], [], label='Y', color='green', alpha=0.5, linewidth=0.75)[0])
-        lines[mid].append(
-            axm.plot([], [], label='Z', color='blue', alpha=0.5, linewidth=0.75)[0])
-        lines[mid].append(
-            axm.plot([], [], color='black', linestyle='--',
-                     linewidth=0.75, alpha=0.5)[0]
-        )
-
-    accel_line, = accel_theta.plot([], [], color='blue', linewidth=2)
-    mag_theta_line, = mag_theta.plot([], [], color='blue', linewidth=2)
-    mag_phi_line, = mag_phi.plot([], [], color='blue', linewidth=2)
-
-    temp_line, = temp_ax.plot(
-        [], [], label='Temperature', color='k', alpha=0.8, linewidth=0.75)
-    pres_line, = pres_ax.plot([], [], label='Pressure',
-                              color='b', alpha=0.8, linewidth=0.75)
-    alt_line, = alt_ax.plot([], [], label='Altitude',
-                            color='r', alpha=0.8, linewidth=0.75)
-    
-    # Create legend
-    legend_ax.legend(
-        handles=lines[0],
-        labels=['X', 'Y', 'Z', '|R|'],
-        loc='center',
-        ncol=4,
-        fontsize=12,
-        frameon=False
-    )
-    legend_ax.set_axis_off()
-
-    fig.show()
-
-    # Update the figure once to render the window
-    fig.canvas.draw()
-    fig.canvas.flush_events()
+    plots.show()
 
     last = perf_counter_ns() # last time we printed info
-    loop_count = 0 # Number of loops since last info print
+    loop_count = 0 # Number of frames drawn since last info print
     rq_time = 0 # Total request-response time since last info print
-    rq_start = perf_counter_ns() # Initialize to avoid uninitialized variable
+    full = True # Next frame needs a full draw
+    drawn = None # Buffer totals of the last frame drawn
+    sched = FrameScheduler(frametime)
 
-    loop_prev = perf_counter_ns()  # Top of the loop
     while True: # Main loop
-        loop_now = perf_counter_ns()
-        loop_dt = loop_now - loop_prev
-        loop_prev = loop_now
-        # Sleep to limit to ~10 FPS
-        # if loop_dt < frametime:  # 10 FPS
-        #     sleep_time = (frametime - loop_dt) / 1e9
-        #     try:
-        #         plt.pause(sleep_time)
-        #     except KeyboardInterrupt:
-        #         print(f"[{ip}:{port}] Interrupted by user")
-        #         plt.close('all')
-        #         exit(0)
-        # Redraw the figure
         try:
-            fig.canvas.draw_idle()
-            fig.canvas.flush_events()
+            # Handle window events until the next frame is due
+            sched.wait(plots.fig.canvas)
         except KeyboardInterrupt:
             print(f"[{ip}:{port}] Interrupted by user")
             plt.close('all')
             exit(0)
-        # Check if the figure has been closed
-        if fignum not in plt.get_fignums():
+        # Check if the figure has been closed, or the UDP server closed the session
+        if not plots.is_open() or shutdown.is_set():
             break
         # Try to get new data
         try:
-            df = None
             # Request new data if the request queue is empty
             # The request queue is size 1, so if UDP is not ready with new data,
             # we skip this iteration.
             # Note: This condition does not happen since a window is spawned
             # when a client connects, and the window is closed when the client disconnects.
             if not request.full():
-                # rq_start = perf_counter_ns() # Start time of request
                 request.put_nowait(1)
             rq_start = perf_counter_ns() # Start time of request
-            df = response.get(timeout=1.0)
+            totals = response.get(timeout=1.0)
             rq_end = perf_counter_ns() # End time of response
-            if df is None:
+            if totals is None or totals == drawn:
+                sched.skip() # Nothing new to draw
                 continue
-            # Probably received the correct data, which is four dataframes
-            datastor.update(df)
-            try:
-                acceldf, gyrodf, magdf, barodf = df
-            except ValueError:
-                print(f"Invalid data received: {df}")
+            drawn = totals
+            # Copy only the samples we have not seen yet from shared memory
+            deltas = []
+            for i, (buf, win) in enumerate(zip(buffers, windows)):
+                cursors[i], delta, restarted = win.follow(buf, cursors[i])
+                if restarted:  # The board restarted its clock
+                    plots.clear(i)
+                deltas.append(delta)
+            ipc_time.observe(perf_counter_ns() - rq_start)
+            if len(windows[0]) == 0:
                 continue
-            # Use the last timestamp to synchronize different sensors
-            now = acceldf['tstamp'].iloc[-1]
-            # Process the 3-axis sensor data
-            for aid, (lline, ax, df) in enumerate(zip(lines, axs, (acceldf, gyrodf, magdf))):
-                # The lines: X, Y, Z, R
-                lline: list = lline
-                # The axis
-                ax: Axes = ax
-                # Select data between now and now - window size
-                sel = get_sel(df, now, winsize)
-                # Raw selection
-                tstamp = df['tstamp'][sel]
-                tstamp *= 1e-6  # Convert to s
-                lline[0].set_data(tstamp, df['x'][sel]) # Plot X
-                lline[1].set_data(tstamp, df['y'][sel]) # Plot Y
-                lline[2].set_data(tstamp, df['z'][sel]) # Plot Z
-                # Compute |R|, θ, φ
-                r, t, p = xyz_to_rtp(
-                    df['x'][sel].to_numpy(),
-                    df['y'][sel].to_numpy(),
-                    df['z'][sel].to_numpy()
-                )
-                # Plot |R|
-                lline[3].set_data(tstamp, r)
-                # Update polar plots
-                if len(r) > 0:
-                    # Use only the last data point
-                    t = t[-1] # theta
-                    p = p[-1] # phi
-                    if aid == 0:  # accel
-                        accel_line.set_data([t, t], [0, 1])
-                    elif aid == 2:  # mag
-                        mag_theta_line.set_data([t, t], [0, 1])
-                        mag_phi_line.set_data([p, p], [0, 1])
-                        magphi_tx.set_text(
-                            f'Azimuthal Angle (φ): {np.degrees(p):.1f}°')
-                ax.relim() # Recompute limits
-                ax.autoscale_view() # Autoscale
-            # Process barometer data
-            sel = get_sel(barodf, now, winsize)
-            tstamp = barodf['tstamp'][sel]
-            tstamp *= 1e-6  # Convert to s
-            temp_line.set_data(tstamp, barodf['temperature'][sel]) # Temperature
-            pres_line.set_data(tstamp, barodf['pressure'][sel]) # Pressure
-            alt_line.set_data(tstamp, barodf['altitude'][sel]) # Altitude
-            temp_ax.relim() # Recompute limits
-            temp_ax.autoscale_view() # Autoscale
-            pres_ax.relim() # Recompute limits
-            pres_ax.autoscale_view() # Autoscale
-            alt_ax.relim() # Recompute limits
-            alt_ax.autoscale_view() # Autoscale
-            # Update x limits
-            alt_ax.set_xlim(now*1e-6-winsize*1e-3, now*1e-6)
+            # Update the plots and draw the frame
+            start = perf_counter_ns()
+            full = plots.update(windows, deltas, secondary=sched.secondary()) or full
+            plots.render(full)
+            full = False
+            end = perf_counter_ns()
+            render_time.observe(end - start)
+            sched.done(end - rq_end)
             loop_count += 1 # Increment loop count
             rq_time += rq_end - rq_start # Accumulate request-response time
-            now = perf_counter_ns() # Current time after drawing stuff, getting data, processing data and updating plots
-            dinfo = info.get_nowait() # Get info from UDP thread
-            if dinfo is not None: # If info is available, print it (and other stats)
-                loop_time = (now - last) / loop_count # Average loop time in ns
-                rq_time = rq_time / loop_count / 1e6 # Average request-response time in ms
-                loop_count = 0 # Reset loop count
-                last = now # Reset last time
-                # Info from UDP thread
-                brate, bunit, prate, punit = dinfo
-                # Render the text
-                outtxt = f"FPS: {1e9/loop_time:.2f}, UDP Rate: {brate:.2f} {bunit} ({prate:.2f} {punit}), Req-Res Time: {rq_time:.2f} ms"
-                # Print to console
-                now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                print(f"[{now}] Source: {ip}:{port}, {outtxt}")
-                # Update the text in the figure
-                curtime.set_text(outtxt.replace(', ', '\n'))
-                rq_time = 0 # Reset request-response time
-            
         except Empty: # No response from UDP thread
             continue
         except KeyboardInterrupt: # Interrupted by user
             print(f"[{ip}:{port}] Interrupted by user")
             plt.close('all')
             exit(0)
+        try:
+            dinfo = info.get_nowait() # Get info from UDP thread
+        except Empty:
+            continue
+        # Print the info with our stats
+        loop_time = (end - last) / loop_count # Average frame time in ns
+        rq_time = rq_time / loop_count / 1e6 # Average request-response time in ms
+        loop_count = 0 # Reset loop count
+        last = end # Reset last time
+        # Info from UDP thread
+        brate, bunit, prate, punit = dinfo
+        # Render the text
+        outtxt = (f"FPS: {1e9/loop_time:.2f}, UDP Rate: {brate:.2f} {bunit} ({prate:.2f} {punit}), "
+                  f"Req-Res Time: {rq_time:.2f} ms, {sched.status()}")
+        # Print to console
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        print(f"[{now}] Source: {ip}:{port}, {outtxt}")
+        # Update the text in the figure, drawn with the next frame
+        plots.set_status(outtxt.replace(', ', '\n'))
+        rq_time = 0 # Reset request-response time
+        if metrics is not None:
+            stats.gauge('frame_budget_used', sched.usage, source=label)
+            stats.counter('skipped_frames_total', sched.skipped, source=label)
+            metrics.put_nowait((label, stats.snapshot()))
     
+    plt.close('all')
     shutdown.set()
-    datastor.close()
+    for buf in buffers:
+        buf.close()
     print(f"[{ip}:{port}] Done receiving data")
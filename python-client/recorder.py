@@ -0,0 +1,95 @@
+# %%
+from __future__ import annotations
+from multiprocessing import Queue, parent_process
+from pathlib import Path
+from queue import Empty
+import signal
+from time import perf_counter_ns
+from typing import Any, Dict, Optional, Tuple
+
+from metrics import Metrics, source_label
+from storesystem import SaveKind, StoreSystem, open_store, store_class
+
+# %% Recorder process
+#
+# Recordings are written by a process of their own, fed by the ingest with
+# every sample it decodes exactly once: the ingest keeps a cursor per sensor
+# buffer of each recording client and hands over the samples after it, see
+# :meth:`udp_thread.Ingest.record`. What is recorded does not depend on the
+# frame rate of a plot window, and the storage threads do not compete with
+# rendering for the GIL.
+#
+# Messages on the frame queue, keyed by client:
+#
+#     ('open', key, prefix, columns)
+#                              start a recording, files named prefix + start time,
+#                              with per sensor the column names of the frames
+#     ('frame', key, frame)    per sensor the arrays (tstamp, *channels) of new samples
+#     ('close', key)           write what is queued and close the files
+#     None                     close every recording and exit
+
+
+def recorder_loop(
+        frames: Queue,
+        datapath: Path = Path.cwd() / 'data',
+        savekind: SaveKind = 'excel',
+        store_options: Optional[dict] = None,
+        metrics: Optional[Queue] = None,
+    ):
+    """Write the frames the ingest process posts on ``frames``, see the module comment.
+
+    Args:
+        frames (Queue): Messages from the ingest process.
+        datapath (Path, optional): Path to store data files. Defaults to Path.cwd() / 'data'.
+        savekind (SaveKind, optional): Kind of data storage: 'excel', 'netcdf' or 'parquet'. Defaults to 'excel'.
+        store_options (Optional[dict], optional): Keyword arguments for the data storage. Defaults to None.
+        metrics (Optional[Queue], optional): Post the 'storage' timings, queue depths, spilled
+            and dropped frames here once a second as ``('recorder', entries)``, see :mod:`metrics`. Defaults to None.
+    """
+    # Ctrl+C stops the ingest process, which then closes the recordings here
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from pandas import DataFrame
+    store_class(savekind)  # Import the backend before the first recording starts
+    stats = Metrics()
+    stores: Dict[Any, StoreSystem] = {}
+    columns: Dict[Any, Tuple[Tuple[str, ...], ...]] = {}  # Of every recording, see :mod:`derived`
+    parent = parent_process()
+    posted = perf_counter_ns()
+    while True:
+        try:
+            msg = frames.get(timeout=1.0)
+        except Empty:
+            if parent is not None and not parent.is_alive():
+                print("[Recorder] Ingest process gone, closing")
+                break
+            msg = ('idle', None)
+        if msg is None:
+            break
+        kind, key, *rest = msg
+        if kind == 'frame' and key in stores:
+            stores[key].update(tuple(
+                DataFrame(dict(zip(names, arrays, strict=True)), copy=False)
+                for arrays, names in zip(rest[0], columns[key], strict=True)))
+        elif kind == 'open' and key not in stores:
+            columns[key] = rest[1]
+            stores[key] = open_store(
+                savekind, datapath, prefix=rest[0],
+                write_time=stats.histogram('storage', source_label(key)), **(store_options or {}))
+        elif kind == 'close' and key in stores:
+            stores.pop(key).close()
+            del columns[key]
+            stats.forget(source_label(key))
+        now = perf_counter_ns()
+        if metrics is not None and now - posted >= 1e9:
+            posted = now
+            for key, store in stores.items():
+                queue = getattr(store, 'queue', None)  # A RecordQueue, see :mod:`backpressure`
+                if queue is not None:
+                    source = source_label(key)
+                    stats.gauge('queue_depth', queue.qsize(), source=source, queue='storage')
+                    stats.counter('spilled_frames_total', queue.spilled, source=source)
+                    stats.counter('dropped_frames_total', queue.dropped, source=source)
+            metrics.put_nowait(('recorder', stats.snapshot()))
+    for store in stores.values():
+        store.close()
+    print("[Recorder] Done recording")
@@ -0,0 +1,126 @@
+# %%
+from __future__ import annotations
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, Optional, Tuple, TypeVar
+
+import numpy as np
+
+from decoder import DataBuffer
+
+# %% Shared memory ring buffers
+#
+# Segment layout:
+# | seq (int64) | total (int64) | tstamp (int64 x maxlen) | channels (float32 x channels x maxlen) |
+#
+# The writer makes ``seq`` odd while it modifies the ring and even again once
+# ``total`` is published (seqlock). Readers retry until they copied a window
+# with the same even ``seq`` before and after.
+
+HEADER_SIZE = 2 * np.dtype(np.int64).itemsize
+
+T = TypeVar('T')
+
+# Picklable description of a shared buffer: (segment name, maxlen, channels, span)
+SharedSpec = Tuple[str, int, int, Optional[int]]
+
+
+class SharedDataBuffer(DataBuffer):
+    """A :class:`DataBuffer` whose columns live in a shared memory segment.
+
+    Only the owning (writing) process should create this; other processes
+    attach with :class:`SharedDataView` using :meth:`spec`.
+    """
+
+    def __init__(self, maxlen=2000, channels=3, span: Optional[int] = None, reorder: Optional[int] = None):
+        self.shm = SharedMemory(
+            create=True, size=HEADER_SIZE + DataBuffer.nbytes(maxlen, channels))
+        self._header = np.ndarray(2, dtype=np.int64, buffer=self.shm.buf)
+        self._header[:] = 0
+        self._channels = channels
+        super().__init__(
+            maxlen, channels, buffer=self.shm.buf[HEADER_SIZE:], span=span, reorder=reorder)
+
+    def spec(self) -> SharedSpec:
+        return (self.shm.name, self.maxlen, self._channels, self.span)
+
+    def append(self, item):
+        self._header[0] += 1
+        super().append(item)
+        self._header[1] = self._total
+        self._header[0] += 1
+
+    def extend(self, tstamp: np.ndarray, values: np.ndarray):
+        self._header[0] += 1
+        super().extend(tstamp, values)
+        self._header[1] = self._total
+        self._header[0] += 1
+
+    def flush(self):
+        self._header[0] += 1
+        super().flush()
+        self._header[1] = self._total
+        self._header[0] += 1
+
+    def clear(self):
+        self._header[0] += 1
+        super().clear()
+        self._header[1] = self._total
+        self._header[0] += 1
+
+    def close(self):
+        """Release and destroy the shared segment."""
+        # Drop the views before closing, the segment refuses to close otherwise
+        del self._header, self._tstamp, self._values
+        self.shm.close()
+        self.shm.unlink()
+
+
+class SharedDataView(DataBuffer):
+    """Read-only view of a :class:`SharedDataBuffer` from another process."""
+
+    def __init__(self, name: str, maxlen: int, channels: int = 3, span: Optional[int] = None):
+        self.shm = SharedMemory(name=name, track=False)
+        self._header = np.ndarray(2, dtype=np.int64, buffer=self.shm.buf)
+        super().__init__(maxlen, channels, buffer=self.shm.buf[HEADER_SIZE:], span=span)
+        self._header.flags.writeable = False
+        self._tstamp.flags.writeable = False
+        self._values.flags.writeable = False
+
+    @property
+    def total(self) -> int:
+        return int(self._header[1])
+
+    def __len__(self):
+        return min(self.total, self.maxlen)
+
+    def _read(self, func: Callable[[], T]) -> T:
+        """Run ``func`` until it completes without a concurrent write."""
+        while True:
+            seq = int(self._header[0])
+            if seq & 1:  # Writer busy
+                continue
+            self._total = int(self._header[1])
+            result = func()
+            if int(self._header[0]) == seq:
+                return result
+
+    def latest(self, num: Optional[int] = None) -> Tuple[np.ndarray, ...]:
+        """Consistent copy of the last ``num`` samples, see :meth:`DataBuffer.latest`."""
+        return self._read(
+            lambda: tuple(np.array(arr) for arr in self._recent(num)))
+
+    def window(self, t0: float, t1: float) -> Tuple[np.ndarray, ...]:
+        """Consistent copy of the samples from ``t0`` to ``t1``, see :meth:`DataBuffer.window`."""
+        return self._read(
+            lambda: tuple(np.array(arr) for arr in DataBuffer.window(self, t0, t1)))
+
+    def since(self, cursor: int) -> Tuple[int, Tuple[np.ndarray, ...]]:
+        """Consistent copy of the samples after ``cursor``, see :meth:`DataBuffer.since`."""
+        def read():
+            total, arrays = DataBuffer.since(self, cursor)
+            return total, tuple(np.array(arr) for arr in arrays)
+        return self._read(read)
+
+    def close(self):
+        del self._header, self._tstamp, self._values
+        self.shm.close()
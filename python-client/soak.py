@@ -0,0 +1,434 @@
+# %%
+from __future__ import annotations
+import argparse
+from dataclasses import asdict, dataclass, field
+import json
+from multiprocessing import Event, Process, Queue
+import os
+from pathlib import Path
+from queue import Empty
+import socket
+from time import perf_counter, perf_counter_ns, sleep, time_ns
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import synth
+from decoder import MEASUREMENT_DTYPE, crc16_xmodem
+from shmring import SharedDataView
+from udp_thread import REORDER, Ingest, udp_loop
+
+# %% Soak test
+#
+# Virtual boards send the records of udp-dummy-server, one per datagram, to
+# the ingest path, either over loopback to udp_loop in a child process or
+# fed straight into an Ingest in this process. Every sample is stamped with
+# the wall clock in microseconds it is due at, so the consumer that replaces
+# the plot window measures the latency from its due time to delivery,
+# including any lag of the generator.
+# The report accounts for every record sent: decoded, rejected, dropped as
+# late or duplicate, delivered or lost.
+
+LATENCY_BIN = 100  # Microseconds per bin of the latency histograms
+LATENCY_BINS = 100_000  # Up to 10 s, later samples count in the last bin
+UNKNOWN_CODE = 0xFFFF  # Measurement type no board sends
+
+
+@dataclass
+class BoardStats:
+    sent: int = 0  # Datagrams, one record each
+    failed: int = 0  # Datagrams the kernel refused to send
+    duplicated: int = 0
+    reordered: int = 0
+    corrupted: int = 0
+    unknown: int = 0
+
+
+class Board:
+    """A virtual board sending every sensor at ``rate`` samples per second.
+
+    Faults are drawn per datagram: a reordered datagram is sent up to
+    ``depth`` datagrams late, a duplicated one is sent again within
+    ``depth`` datagrams, a corrupted one has a bad CRC and an unknown one
+    a measurement type with a valid CRC.
+    """
+
+    def __init__(
+        self,
+        id: int,
+        rate: float,
+        rng: np.random.Generator,
+        reorder: float = 0.0,
+        duplicate: float = 0.0,
+        corrupt: float = 0.0,
+        unknown: float = 0.0,
+        depth: int = 8,
+    ):
+        self.id = id
+        self.rate = rate
+        self.rng = rng
+        self.reorder = reorder
+        self.duplicate = duplicate
+        self.corrupt = corrupt
+        self.unknown = unknown
+        self.depth = depth
+        self.samples = 0  # Samples generated per sensor
+        self.epoch = time_ns() // 1000  # Wall clock of the first sample in microseconds
+        self.stats = BoardStats()
+        self.sock: Optional[socket.socket] = None
+        self.loc: Any = ('virtual', id)
+
+    def open(self):
+        """Send from a socket of its own, so every board has its own source port."""
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.loc = self.sock.getsockname()
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+
+    def due(self, elapsed: float) -> np.ndarray:
+        """Records of the samples due ``elapsed`` seconds after the start, in send order."""
+        count = int(elapsed * self.rate) - self.samples
+        if count <= 0:
+            return np.zeros(0, dtype=MEASUREMENT_DTYPE)
+        times = (self.samples + np.arange(count)) / self.rate
+        self.samples += count
+        tstamp = (self.epoch + times * 1e6).astype(np.uint64)
+        return self.faults(synth.records(times, self.id, tstamp))
+
+    def faults(self, recs: np.ndarray) -> np.ndarray:
+        rng, n, stats = self.rng, len(recs), self.stats
+        raw = recs.view(np.uint8).reshape(n, MEASUREMENT_DTYPE.itemsize)
+        unknown = rng.random(n) < self.unknown
+        if unknown.any():
+            recs['mtype'][unknown] = UNKNOWN_CODE
+            recs['crc'][unknown] = crc16_xmodem(raw[unknown, :-2])
+            stats.unknown += int(unknown.sum())
+        mask = (rng.random(n) < self.corrupt) & ~unknown
+        if mask.any():
+            raw[mask, 2] ^= 0xFF  # First payload byte, the CRC no longer matches
+            stats.corrupted += int(mask.sum())
+        # Send order: every datagram by its position, the reordered ones later
+        key = np.arange(n, dtype=np.float64)
+        mask = rng.random(n) < self.reorder
+        key[mask] += rng.integers(1, self.depth + 1, int(mask.sum())) + 0.5
+        stats.reordered += int(mask.sum())
+        mask = rng.random(n) < self.duplicate
+        dups = np.flatnonzero(mask)
+        key = np.concatenate((key, dups + rng.integers(1, self.depth + 1, len(dups)) + 0.5))
+        stats.duplicated += len(dups)
+        return np.concatenate((recs, recs[dups]))[np.argsort(key, kind='stable')]
+
+    def send(self, recs: np.ndarray, dest: Tuple[str, int]):
+        """Send every record in its own datagram."""
+        data = recs.tobytes()
+        size = MEASUREMENT_DTYPE.itemsize
+        for i in range(0, len(data), size):
+            try:
+                self.sock.sendto(data[i:i+size], dest)
+            except (BlockingIOError, ConnectionRefusedError, OSError):
+                self.stats.failed += 1  # Socket buffer full or ICMP unreachable
+            self.stats.sent += 1
+
+# %% Consumer
+
+
+def rss(pid: int) -> Optional[float]:
+    """Resident set size of a process in MB, None where /proc is missing."""
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+    except (OSError, ValueError):
+        return None
+
+
+def consume(
+        source: Any,
+        specs: Tuple[Any, ...],
+        request: Queue,
+        response: Queue,
+        info: Queue,
+        shutdown: Any,
+        winsize: int,
+        stats: Optional[Queue] = None,
+        stop: Any = None,
+        frametime: int = int(1e9 / 30),
+        commands: Optional[Queue] = None,
+        metrics: Optional[Queue] = None,
+    ):
+    """Stand-in for :func:`plot.draw_loop` that measures delivery instead of plotting.
+
+    Requests frames like the plot window, at most one per ``frametime``, and
+    histograms the latency of every new sample from its due time to now.
+    Once ``stop`` is set, posts ``(source, totals, histogram, fps, rss_start,
+    rss_end)`` to ``stats`` and closes like a plot window.
+    """
+    buffers = [SharedDataView(*spec) for spec in specs]
+    cursors = [0] * len(buffers)
+    hist = np.zeros(LATENCY_BINS, dtype=np.int64)
+    frames = 0
+    rss_start = rss(os.getpid())
+    begin = perf_counter()
+    while (stop is None or not stop.is_set()) and not shutdown.is_set():
+        start = perf_counter_ns()
+        if not request.full():
+            request.put_nowait(1)
+        try:
+            if response.get(timeout=0.5) is None:
+                continue
+        except Empty:
+            continue
+        now = time_ns() // 1000
+        for i, buf in enumerate(buffers):
+            cursors[i], (tstamp, *_) = buf.since(cursors[i])
+            bins = (now - tstamp.astype(np.int64)) // LATENCY_BIN
+            hist += np.bincount(np.clip(bins, 0, LATENCY_BINS - 1), minlength=LATENCY_BINS)
+        frames += 1
+        while True:
+            try:
+                info.get_nowait()
+            except Empty:
+                break
+        rest = frametime - (perf_counter_ns() - start)
+        if rest > 0:
+            sleep(rest / 1e9)
+    if stats is not None:
+        last = int(np.flatnonzero(hist)[-1]) + 1 if hist.any() else 0
+        fps = frames / (perf_counter() - begin)
+        stats.put((source, cursors, hist[:last], fps, rss_start, rss(os.getpid())))
+    shutdown.set()
+    for buf in buffers:
+        buf.close()
+
+# %% Report
+
+
+@dataclass
+class BoardReport:
+    board: int
+    sent: int
+    failed: int
+    duplicated: int
+    reordered: int
+    corrupted: int
+    unknown_sent: int
+    received: int = 0
+    bad_crc: int = 0
+    unknown: int = 0
+    dropped: int = 0  # Late or duplicate samples dropped by the buffers
+    delivered: int = 0
+    lost: int = 0
+    fps: float = 0.0
+    latency_ms: Dict[str, float] = field(default_factory=dict)
+
+
+def percentiles(hist: np.ndarray, qs=(50, 90, 99, 99.9)) -> Dict[str, float]:
+    """Percentiles and maximum in milliseconds of a latency histogram."""
+    total = hist.sum()
+    if total == 0:
+        return {}
+    cum = np.cumsum(hist)
+    out = {f'p{q:g}': float(np.searchsorted(cum, total * q / 100) + 1) * LATENCY_BIN / 1e3 for q in qs}
+    out['max'] = len(hist) * LATENCY_BIN / 1e3
+    return out
+
+
+@dataclass
+class Memory:
+    samples: List[Tuple[float, float]] = field(default_factory=list)  # (seconds, MB)
+
+    def add(self, elapsed: float, pid: int):
+        value = rss(pid)
+        if value is not None:
+            self.samples.append((elapsed, value))
+
+    def summary(self, warmup: float) -> Dict[str, float]:
+        """Start, end and peak RSS, and the growth rate after ``warmup`` seconds."""
+        if not self.samples:
+            return {}
+        t, mb = np.array(self.samples).T
+        keep = t >= min(warmup, t[-1])
+        out = dict(start=float(mb[keep][0]), end=float(mb[-1]), max=float(mb.max()))
+        if keep.sum() > 2 and t[keep][-1] > t[keep][0]:
+            out['growth_mb_per_min'] = float(np.polyfit(t[keep], mb[keep], 1)[0] * 60)
+        return out
+
+
+def report(boards: List[Board], counts: Dict[Any, tuple], consumed: Dict[Any, tuple]) -> List[BoardReport]:
+    reports = []
+    for board in boards:
+        s = board.stats
+        rep = BoardReport(board.id, s.sent, s.failed, s.duplicated, s.reordered, s.corrupted, s.unknown)
+        if board.loc in counts:
+            rep.received, rep.bad_crc, rep.unknown, rep.dropped = counts[board.loc]
+        if board.loc in consumed:
+            totals, hist, rep.fps = consumed[board.loc][:3]
+            rep.delivered = int(sum(totals))
+            rep.latency_ms = percentiles(hist)
+        # Every valid sample but the duplicates should reach the consumer
+        rep.lost = s.sent - s.duplicated - s.corrupted - s.unknown - rep.delivered
+        reports.append(rep)
+    return reports
+
+
+def print_report(reports: List[BoardReport], memory: Dict[str, float], consumers: List[float]):
+    print(f"{'board':>5} {'sent':>9} {'received':>9} {'bad crc':>8} {'unknown':>8} {'dropped':>8} "
+          f"{'delivered':>10} {'lost':>7} {'p50 ms':>7} {'p99 ms':>7} {'max ms':>7} {'fps':>5}")
+    for rep in reports:
+        lat = rep.latency_ms
+        print(f"{rep.board:>5} {rep.sent:>9} {rep.received:>9} {rep.bad_crc:>8} {rep.unknown:>8} "
+              f"{rep.dropped:>8} {rep.delivered:>10} {rep.lost:>7} {lat.get('p50', 0):>7.1f} "
+              f"{lat.get('p99', 0):>7.1f} {lat.get('max', 0):>7.1f} {rep.fps:>5.1f}")
+    faults = [(rep.duplicated, rep.reordered, rep.corrupted, rep.unknown_sent, rep.failed) for rep in reports]
+    dup, reo, bad, unk, failed = np.sum(faults, axis=0) if faults else (0,) * 5
+    print(f"Injected: {dup} duplicated, {reo} reordered, {bad} corrupted, {unk} unknown type; "
+          f"{failed} sends failed")
+    print("Lost counts samples still held in the reorder stage at the end "
+          f"(up to {REORDER / 1e3:.0f} ms per sensor) and datagrams dropped by the kernel")
+    if memory:
+        line = f"Ingest RSS: {memory['start']:.1f} MB after warm-up, {memory['end']:.1f} MB at the end, " \
+               f"{memory['max']:.1f} MB peak"
+        if 'growth_mb_per_min' in memory:
+            line += f", {memory['growth_mb_per_min']:+.2f} MB/min"
+        print(line)
+    if consumers:
+        print(f"Consumer RSS growth: {np.mean(consumers):+.1f} MB on average")
+
+# %% Main
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak test of the Kiwi ingest path with virtual boards")
+    parser.add_argument('--boards', type=int, default=4, help='Number of virtual boards (default: 4)')
+    parser.add_argument('--rate', type=float, default=200, help='Samples per second of every sensor (default: 200)')
+    parser.add_argument('--seconds', type=float, default=30, help='Duration of the test (default: 30)')
+    parser.add_argument('--mode', choices=['loopback', 'inprocess'], default='loopback',
+                        help='Send over loopback to udp_loop in a child process, '
+                             'or feed an Ingest in this process (default: loopback)')
+    parser.add_argument('--port', type=int, default=18099, help='UDP port in loopback mode (default: 18099)')
+    parser.add_argument('--reorder', type=float, default=0.0, help='Probability a datagram is sent late (default: 0)')
+    parser.add_argument('--duplicate', type=float, default=0.0, help='Probability a datagram is sent twice (default: 0)')
+    parser.add_argument('--corrupt', type=float, default=0.0, help='Probability of a bad CRC (default: 0)')
+    parser.add_argument('--unknown', type=float, default=0.0, help='Probability of an unknown type (default: 0)')
+    parser.add_argument('--depth', type=int, default=8,
+                        help='Datagrams a reordered or duplicated datagram trails by at most (default: 8)')
+    parser.add_argument('--fps', type=float, default=30, help='Frames per second of the consumers (default: 30)')
+    parser.add_argument('--winsize', type=int, default=2000, help='Window size in milliseconds (default: 2000)')
+    parser.add_argument('--sample-every', type=float, default=1.0, help='Seconds between RSS samples (default: 1)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the fault injection (default: 0)')
+    parser.add_argument('--json', type=Path, default=None, help='Also write the report to this file')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    boards = [
+        Board(i, args.rate, rng, args.reorder, args.duplicate, args.corrupt, args.unknown, args.depth)
+        for i in range(args.boards)
+    ]
+    events, stats, done = Queue(), Queue(), Event()
+    plot_options = dict(stats=stats, stop=done, frametime=int(1e9 / args.fps))
+    dest = ('127.0.0.1', args.port)
+    if args.mode == 'loopback':
+        stop = Event()
+        proc = Process(target=udp_loop, args=dest, kwargs=dict(
+            winsize=args.winsize, stop=stop, events=events,
+            plot_options=plot_options, plot_target=consume))
+        proc.start()
+        pid = proc.pid
+        for board in boards:
+            board.open()
+        sleep(1.0)  # Let udp_loop bind
+    else:
+        ingest = Ingest(winsize=args.winsize, events=events, exit_when_empty=False,
+                        plot_options=plot_options, plot_target=consume)
+        pid = os.getpid()
+
+    counts: Dict[Any, tuple] = {}
+
+    def drain_events():
+        while True:
+            try:
+                event = events.get_nowait()
+            except Empty:
+                return
+            if event[0] == 'rate':
+                counts[event[2]] = event[-1]
+
+    def idle(seconds: float):
+        end = perf_counter() + seconds
+        while perf_counter() < end:
+            if args.mode == 'inprocess':
+                ingest.service_all()
+            drain_events()
+            sleep(0.01)
+
+    print(f"Soak test: {args.boards} boards at {args.rate:.0f} samples/s per sensor for {args.seconds:.0f} s ({args.mode})")
+    memory = Memory()
+    start = perf_counter()
+    for board in boards:
+        board.epoch = time_ns() // 1000
+    next_sample = 0.0
+    while (elapsed := perf_counter() - start) < args.seconds:
+        for board in boards:
+            recs = board.due(elapsed)
+            if len(recs) == 0:
+                continue
+            if args.mode == 'loopback':
+                board.send(recs, dest)
+            else:
+                board.stats.sent += len(recs)
+                ingest.feed(board.loc, recs.tobytes())
+        if args.mode == 'inprocess':
+            ingest.service_all()
+        drain_events()
+        if elapsed >= next_sample:
+            memory.add(elapsed, pid)
+            next_sample += args.sample_every
+        sleep(0.001)
+    sent = sum(board.stats.sent for board in boards)
+    print(f"Sent {sent / (perf_counter() - start):.0f} datagrams/s "
+          f"of {len(boards) * 4 * args.rate:.0f} planned")
+
+    # Wait for the reorder stage to release and for a rate report with the final counts
+    idle(1.5)
+    memory.add(perf_counter() - start, pid)
+    done.set()
+    consumed: Dict[Any, tuple] = {}
+    consumers = []
+    deadline = perf_counter() + 10
+    while len(consumed) < len(counts) and perf_counter() < deadline:
+        idle(0.1)
+        try:
+            source, *result = stats.get_nowait()
+        except Empty:
+            continue
+        consumed[source] = result
+        if result[3] is not None and result[4] is not None:
+            consumers.append(result[4] - result[3])
+    if args.mode == 'loopback':
+        stop.set()
+        proc.join()
+        for board in boards:
+            board.close()
+    else:
+        idle(0.5)  # Let the Ingest join the consumers
+        ingest.close()
+    drain_events()
+
+    reports = report(boards, counts, consumed)
+    mem = memory.summary(warmup=min(2.0, args.seconds / 2))
+    print_report(reports, mem, consumers)
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(dict(
+                config=vars(args) | dict(json=str(args.json)),
+                boards=[asdict(rep) for rep in reports],
+                memory=mem,
+                consumer_rss_growth_mb=consumers,
+            ), f, indent=2)
+        print(f"Saved to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
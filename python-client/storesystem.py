@@ -1,18 +1,19 @@
 # %%
 from __future__ import annotations
 from abc import ABC, abstractmethod
-from typing import List, Tuple
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Literal, Tuple
 
-from pandas import DataFrame
+if TYPE_CHECKING:
+    from pandas import DataFrame
 
 # %%
+SaveKind = Literal['excel', 'netcdf', 'parquet']
 
+# %%
 
-class StoreSystem(ABC):
-    @abstractmethod
-    def callback(self, evt) -> None:
-        pass
 
+class StoreSystem(ABC):
     @abstractmethod
     def update(self, data: List[Tuple[int, DataFrame]]) -> None:
         pass
@@ -20,3 +21,34 @@ class StoreSystem(ABC):
     @abstractmethod
     def close(self) -> None:
         pass
+
+
+def open_store(
+    savekind: SaveKind,
+    datapath: Path,
+    **options,
+) -> StoreSystem:
+    """Create the data storage of ``savekind``, importing its backend on first use.
+
+    Args:
+        savekind (SaveKind): Kind of data storage: 'excel', 'netcdf' or 'parquet'.
+        datapath (Path): Directory for the data files.
+        **options: Keyword arguments for the storage backend.
+
+    Returns:
+        StoreSystem: The data storage.
+    """
+    return store_class(savekind)(datapath, **options)
+
+
+def store_class(savekind: SaveKind) -> type:
+    """Import the storage backend of ``savekind`` and return its class."""
+    if savekind == 'excel':
+        from xlsx_thread import XlsxDataset as Store
+    elif savekind == 'netcdf':
+        from nc_thread import NcDataset as Store
+    elif savekind == 'parquet':
+        from parquet_thread import ParquetDataset as Store
+    else:
+        raise ValueError(f"Invalid savekind: {savekind}")
+    return Store
@@ -0,0 +1,107 @@
+# %%
+from __future__ import annotations
+from typing import Dict, Optional
+
+import numpy as np
+
+from decoder import ACCEL_CODE, BARO_CODE, GYRO_CODE, MAG_CODE, MEASUREMENT_DTYPE, crc16_xmodem
+
+# %% Synthetic sensor signals, vectorized ports of the generators in udp-dummy-server
+#
+# ``elapsed`` is an array of seconds since the board started and ``id`` the
+# zero-based board index, as in the Rust server. Every function returns
+# float32 values of shape (n, 3).
+
+TWO_PI = 2.0 * np.pi
+
+
+def _spherical(elapsed: np.ndarray, g: np.ndarray, theta_period: float, phi_period: float, id: int) -> np.ndarray:
+    theta = elapsed * TWO_PI / (theta_period + id * 3.0)
+    phi = elapsed * TWO_PI / (phi_period + id * 4.0)
+    x = np.sin(theta) * np.cos(phi) * g
+    y = np.sin(theta) * np.sin(phi) * g
+    z = np.cos(theta) * g
+    return np.stack((x, y, z), axis=1).astype(np.float32)
+
+
+def accel(elapsed: np.ndarray, id: int = 0) -> np.ndarray:
+    g = np.sin(elapsed * TWO_PI / (30.0 + id * 2.0)) * 0.1 + 0.9
+    return _spherical(elapsed, g, 10.0, 2.0, id)
+
+
+def gyro(elapsed: np.ndarray, id: int = 0) -> np.ndarray:
+    omega = TWO_PI / 5.0 + id * 0.1
+    x = 0.25 * np.cos(elapsed * omega)
+    y = 0.25 * np.sin(elapsed * omega)
+    return np.stack((x, y, np.zeros_like(x)), axis=1).astype(np.float32)
+
+
+def mag(elapsed: np.ndarray, id: int = 0) -> np.ndarray:
+    g = np.sin(elapsed * TWO_PI / (30.0 + id * 2.0)) * 10.0 + 600.0
+    return _spherical(elapsed, g, 10.0, 3.0, id)
+
+
+def baro(elapsed: np.ndarray, id: int = 0) -> np.ndarray:
+    temp = np.sin(elapsed * TWO_PI / (15.0 + id)) * 2.0 + 25.0
+    pres = np.cos(elapsed * TWO_PI / (20.0 + id)) * 20.0 + 1013.25
+    alt = np.cosh(np.cos(elapsed * TWO_PI / (25.0 + id))) * 1000.0 + 100.0
+    return np.stack((temp, pres, alt), axis=1).astype(np.float32)
+
+
+GENERATORS = {'accel': accel, 'gyro': gyro, 'mag': mag, 'baro': baro}
+
+
+def samples(elapsed: np.ndarray, id: int = 0) -> Dict[str, np.ndarray]:
+    """Values of every sensor at the given times, keyed by sensor kind."""
+    return {kind: gen(elapsed, id) for kind, gen in GENERATORS.items()}
+
+
+CODES = {'accel': ACCEL_CODE, 'gyro': GYRO_CODE, 'mag': MAG_CODE, 'baro': BARO_CODE}
+
+
+def records(elapsed: np.ndarray, id: int = 0, tstamp: Optional[np.ndarray] = None) -> np.ndarray:
+    """Wire records of every sensor at the given times, as a board sends them.
+
+    Args:
+        elapsed (np.ndarray): Seconds since the board started.
+        id (int, optional): Zero-based board index. Defaults to 0.
+        tstamp (Optional[np.ndarray], optional): Timestamps to send in microseconds.
+            Defaults to ``elapsed`` in microseconds.
+
+    Returns:
+        np.ndarray: ``MEASUREMENT_DTYPE`` records, one per sensor for each time
+        in turn; ``.tobytes()`` gives the datagram payload.
+    """
+    if tstamp is None:
+        tstamp = (elapsed * 1e6).astype(np.uint64)  # us, as sent by the boards
+    values = samples(elapsed, id)
+    recs = np.zeros((len(elapsed), len(values)), dtype=MEASUREMENT_DTYPE)
+    for col, (kind, vals) in enumerate(values.items()):
+        recs['mtype'][:, col] = CODES[kind]
+        recs['payload'][:, col] = vals
+        recs['tstamp'][:, col] = tstamp
+    recs = recs.reshape(-1)
+    raw = recs.view(np.uint8).reshape(len(recs), MEASUREMENT_DTYPE.itemsize)
+    recs['crc'] = crc16_xmodem(raw[:, :-2])
+    return recs
+
+
+def identity(code: int, id: int = 0, tstamp: int = 0) -> np.ndarray:
+    """The ID record a board sends every 2 s, named ``Kiwi#<n>`` like udp-dummy-server.
+
+    Args:
+        code (int): Measurement type code of ID records, see :data:`decoder.ID_CODE`.
+        id (int, optional): Zero-based board index. Defaults to 0.
+        tstamp (int, optional): Timestamp in microseconds. Defaults to 0.
+
+    Returns:
+        np.ndarray: One ``MEASUREMENT_DTYPE`` record.
+    """
+    recs = np.zeros(1, dtype=MEASUREMENT_DTYPE)
+    raw = recs.view(np.uint8).reshape(1, MEASUREMENT_DTYPE.itemsize)
+    recs['mtype'] = code
+    raw[0, 2:14] = np.frombuffer(f"Kiwi#{(id + 1) % 1001:04}".encode().ljust(12, b'\x00'), dtype=np.uint8)
+    recs['tstamp'] = tstamp
+    recs['crc'] = crc16_xmodem(raw[:, :-2])
+    return recs
+
@@ -0,0 +1,90 @@
+# %%
+import os
+from queue import Full, Queue
+
+import numpy as np
+import pytest
+
+from backpressure import RecordQueue, put_latest
+
+
+def frame(num: int) -> tuple:
+    """A frame as the recorder queues them, tagged with ``num``."""
+    return (num, np.full(16, num, dtype=np.int64))
+
+
+def drain(queue: RecordQueue) -> list:
+    return [queue.get_nowait()[0] for _ in range(queue.qsize())]
+
+
+def test_spill_keeps_fifo_order(tmp_path):
+    queue = RecordQueue(4, 'spill', tmp_path)
+    for num in range(10):
+        queue.put(frame(num))
+    assert queue.qsize() == 10 and queue.spilled == 6
+    assert [queue.get_nowait()[0] for _ in range(3)] == [0, 1, 2]
+    # Still spilling while spilled frames are waiting, although memory has room
+    queue.put(frame(10))
+    assert queue.spilled == 7
+    got = drain(queue)
+    assert got == list(range(3, 11))
+    item = frame(5)
+    queue.put(item)
+    assert np.array_equal(queue.get_nowait()[1], item[1])
+
+
+def test_spill_file_starts_over_once_read_back(tmp_path):
+    queue = RecordQueue(2, 'spill', tmp_path)
+    for num in range(6):
+        queue.put(frame(num))
+    assert drain(queue) == list(range(6))
+    spill = queue._file
+    assert os.fstat(spill.fileno()).st_size == 0  # Truncated
+    for num in range(6, 12):
+        queue.put(frame(num))
+    assert queue._file is spill  # The same file, written from the start again
+    assert drain(queue) == list(range(6, 12))
+    assert queue.spilled == 8
+
+
+def test_drop_counts_offered_frames(tmp_path):
+    queue = RecordQueue(3, 'drop', tmp_path)
+    kept = [queue.offer(frame(num)) for num in range(5)]
+    assert kept == [True, True, True, False, False]
+    assert queue.dropped == 2 and queue.spilled == 0
+    queue.put(frame(99))  # Messages that must not be lost are always kept
+    assert drain(queue) == [0, 1, 2, 99]
+    assert queue.offer(frame(5)) and queue.dropped == 2
+
+
+def test_block_waits_for_room():
+    queue = RecordQueue(2, 'block')
+    queue.put(frame(0))
+    queue.offer(frame(1))
+    with pytest.raises(Full):
+        queue.put(frame(2), timeout=0.01)
+    assert drain(queue) == [0, 1]
+
+
+def test_put_latest_drops_oldest():
+    queue = Queue(maxsize=2)
+    assert not put_latest(queue, 1)
+    assert not put_latest(queue, 2)
+    assert put_latest(queue, 3)
+    assert put_latest(queue, 4)
+    assert [queue.get_nowait(), queue.get_nowait()] == [3, 4]
+
+
+def test_ingest_backlog_spills_into_new_datapath(tmp_path):
+    from udp_thread import Ingest
+    datapath = tmp_path / 'not' / 'yet'
+    ingest = Ingest(datapath, 'parquet', headless=True, store_options=dict(queue_size=2))
+    ingest.start_recorder()
+    ingest.recorder.kill()  # So nothing drains its queue
+    try:
+        for num in range(8):
+            ingest.post(('frame', None, frame(num)), frame=True)
+        assert ingest.backlog.spilled > 0
+    finally:
+        ingest.recorder.join()
+        ingest.recorder = None
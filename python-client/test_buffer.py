@@ -0,0 +1,117 @@
+# %%
+import numpy as np
+
+from decoder import CLOCK_RESET, RESET_SAMPLES, DataBuffer
+
+REORDER = 20_000  # As the ingest buffers, see udp_thread
+
+
+def columns(tstamp) -> tuple:
+    """Timestamps and values that encode them, so every sample can be checked."""
+    tstamp = np.asarray(tstamp, dtype=np.int64)
+    values = np.stack((tstamp * 1e-3, -tstamp * 1e-3, np.zeros(len(tstamp))), axis=1).astype(np.float32)
+    return tstamp, values
+
+
+def test_out_of_order_within_reorder_is_sorted():
+    buf = DataBuffer(maxlen=1024, reorder=REORDER)
+    tstamp = 1000 * np.arange(500, dtype=np.int64)
+    rng = np.random.default_rng(0)
+    # Swap neighbouring datagrams of 10 samples, late by less than the reorder window
+    chunks = [tstamp[i:i+10] for i in range(0, len(tstamp), 10)]
+    for i in range(0, len(chunks) - 1, 2):
+        if rng.random() < 0.5:
+            chunks[i], chunks[i + 1] = chunks[i + 1], chunks[i]
+    for chunk in chunks:
+        buf.extend(*columns(chunk))
+    buf.flush()
+    got, x, y, _ = buf.latest()
+    assert np.array_equal(got, tstamp)
+    assert np.array_equal(x, (tstamp * 1e-3).astype(np.float32))
+    assert buf.dropped == 0
+
+
+def test_late_beyond_reorder_is_dropped():
+    buf = DataBuffer(maxlen=1024, reorder=REORDER)
+    buf.extend(*columns(1000 * np.arange(100)))
+    written = buf.total
+    assert written == 100 - REORDER // 1000  # The newest samples are held back
+    buf.extend(*columns([5000, 30_000]))  # Older than samples already written
+    buf.flush()
+    assert buf.dropped == 2
+    assert np.all(np.diff(buf.latest()[0]) > 0)
+
+
+def test_duplicates_keep_first_arrival():
+    buf = DataBuffer(maxlen=64, reorder=REORDER)
+    tstamp, values = columns([1000, 2000, 2000, 3000])
+    values[2] = 99.0  # Second arrival of 2000
+    buf.extend(tstamp, values)
+    buf.extend(*columns([3000, 4000]))  # Duplicate of a held back sample
+    buf.flush()
+    got, x, _, _ = buf.latest()
+    assert np.array_equal(got, [1000, 2000, 3000, 4000])
+    assert x[1] == np.float32(2.0)
+    assert buf.dropped == 2
+
+
+def test_capacity_is_power_of_two():
+    assert DataBuffer(maxlen=1000).maxlen == 1024
+    assert DataBuffer(maxlen=1024).maxlen == 1024
+
+
+def test_window_across_ring_wrap():
+    buf = DataBuffer(maxlen=64)
+    tstamp = 1000 * np.arange(200, dtype=np.int64)
+    for i in range(0, len(tstamp), 7):  # The write position wraps several times
+        buf.extend(*columns(tstamp[i:i+7]))
+    kept = tstamp[-64:]
+    for t0, t1 in ((kept[0], kept[-1] + 1), (kept[10] - 500, kept[50] + 500), (0, kept[5]), (kept[-1] + 1, 10**9)):
+        got = buf.window(t0, t1)
+        expect = kept[(kept >= t0) & (kept < t1)]
+        assert np.array_equal(got[0], expect)
+        assert np.array_equal(got[1], (expect * 1e-3).astype(np.float32))
+
+
+def test_since_across_wrap_and_overrun():
+    buf = DataBuffer(maxlen=64)
+    tstamp = 1000 * np.arange(300, dtype=np.int64)
+    buf.extend(*columns(tstamp[:50]))
+    cursor, (got, *_) = buf.since(0)
+    assert cursor == 50 and np.array_equal(got, tstamp[:50])
+    buf.extend(*columns(tstamp[50:90]))  # Wraps around the end of the ring
+    cursor, (got, *_) = buf.since(cursor)
+    assert cursor == 90 and np.array_equal(got, tstamp[50:90])
+    # Overrun: more than the capacity was written since the cursor, the oldest are gone
+    buf.extend(*columns(tstamp[90:300]))
+    new, (got, *_) = buf.since(cursor)
+    assert new == 300 and np.array_equal(got, tstamp[300 - 64:])
+    assert new - cursor - len(got) == 300 - 90 - 64  # Counted as overrun by the ingest
+    # A cursor ahead of the buffer returns everything
+    _, (got, *_) = buf.since(10_000)
+    assert np.array_equal(got, tstamp[300 - 64:])
+
+
+def test_span_limits_latest():
+    buf = DataBuffer(maxlen=1024, span=100_000)
+    buf.extend(*columns(1000 * np.arange(500)))
+    got = buf.latest()[0]
+    assert got[0] == 499_000 - 99_000 and got[-1] == 499_000
+
+
+def test_clock_restart_clears_the_ring():
+    buf = DataBuffer(maxlen=1024, reorder=REORDER)
+    buf.extend(*columns(10 * CLOCK_RESET + 1000 * np.arange(300)))
+    before = buf.total
+    # A few stale datagrams are dropped, not taken as a restart
+    buf.extend(*columns(1000 * np.arange(RESET_SAMPLES // 2)))
+    assert buf.total == before and buf.dropped == RESET_SAMPLES // 2
+    # A run of them is: the board restarted its clock
+    restart = 1000 * np.arange(RESET_SAMPLES // 2, 400)
+    for i in range(0, len(restart), 16):
+        buf.extend(*columns(restart[i:i+16]))
+    buf.flush()
+    got = buf.latest()[0]
+    assert got[-1] == restart[-1] and got[0] < CLOCK_RESET
+    assert np.all(np.diff(got) > 0)
+    assert buf.total == len(got)
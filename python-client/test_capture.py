@@ -0,0 +1,73 @@
+# %%
+import numpy as np
+import pytest
+
+import synth
+from capture import CaptureWriter, read_capture, source_addresses
+from decoder import SINGLE_MEASUREMENT_SIZE
+from udp_thread import RecvArena
+
+SOURCES = [('192.168.1.20', 50000), ('10.0.0.7', 4242), ('192.168.1.20', 50001)]
+
+
+def drains(num: int, seed: int = 0):
+    """Batches of datagrams as a drain of the receive arena leaves them, a few incomplete."""
+    rng = np.random.default_rng(seed)
+    recs = synth.records(np.arange(num) / 100.0)
+    arrival = 1_700_000_000_000_000_000
+    pos = 0
+    while pos < len(recs):
+        count = int(rng.integers(1, 40))
+        arena = RecvArena(count)
+        for rec in recs[pos:pos+count]:
+            data = rec.tobytes()
+            if rng.random() < 0.05:
+                data = data[:int(rng.integers(1, SINGLE_MEASUREMENT_SIZE))]
+            arena.put(data, SOURCES[int(rng.integers(len(SOURCES)))])
+        arrival += int(rng.integers(1, 5_000_000))
+        yield arrival, arena
+        pos += count
+
+
+def test_capture_round_trip(tmp_path):
+    path = tmp_path / 'test.kcap'
+    sent = []
+    writer = CaptureWriter(path)
+    for num, (arrival, arena) in enumerate(drains(600)):
+        if num == 20:  # Appending to an existing capture keeps its header
+            writer.close()
+            writer = CaptureWriter(path)
+        writer.write(arrival, arena.buffer, arena.addrs[:arena.count], arena.nbytes)
+        for i in range(arena.count):
+            size = int(arena.nbytes[i])
+            data = bytes(arena.buffer[i*SINGLE_MEASUREMENT_SIZE:i*SINGLE_MEASUREMENT_SIZE+size])
+            sent.append((arrival, arena.addrs[i], data))
+    writer.close()
+
+    recs = read_capture(path)
+    addrs, index = source_addresses(recs)
+    assert sorted(addrs) == sorted(SOURCES)
+    assert len(recs) == len(sent)
+    for rec, src, (arrival, addr, data) in zip(recs, index, sent):
+        assert rec['arrival'] == arrival
+        assert addrs[src] == addr
+        assert bytes(rec['payload'][:rec['size']]) == data
+
+
+def test_capture_rejects_ipv6_sources(tmp_path):
+    path = tmp_path / 'test.kcap'
+    writer = CaptureWriter(path)
+    arena = RecvArena(2)
+    arena.put(synth.records(np.zeros(1))[0].tobytes(), ('10.0.0.7', 4242))
+    arena.put(synth.records(np.zeros(1))[0].tobytes(), ('::1', 4242, 0, 0))
+    with pytest.raises(ValueError, match='IPv4'):
+        writer.write(0, arena.buffer, arena.addrs[:arena.count], arena.nbytes)
+    writer.close()
+    assert len(read_capture(path)) == 0  # Nothing of the batch written
+
+
+def test_read_capture_rejects_other_files(tmp_path):
+    path = tmp_path / 'other.bin'
+    path.write_bytes(b'\x00' * 64)
+    with pytest.raises(ValueError):
+        read_capture(path)
@@ -0,0 +1,135 @@
+# %%
+import numpy as np
+import pytest
+
+from decimate import Decimator, WindowDecimator, minmax
+from decoder import CLOCK_RESET, DataBuffer
+
+REORDER = 20_000  # As the ingest buffers, see udp_thread
+
+
+def frames(start: int, seconds: float, step: int = 1000, chunk: int = 33):
+    """Timestamps and values of a sine, ``chunk`` samples per frame."""
+    tstamp = start + step * np.arange(int(seconds * 1e6) // step, dtype=np.int64)
+    values = np.sin(tstamp * 1e-5)[:, None].repeat(3, axis=1).astype(np.float32)
+    for i in range(0, len(tstamp), chunk):
+        yield tstamp[i:i+chunk], values[i:i+chunk]
+
+
+def test_clock_restart_advances_points():
+    """Plot points keep following the ring after the board restarts its clock."""
+    ring = DataBuffer(maxlen=8192, reorder=REORDER)  # The shared ring of the ingest
+    window = DataBuffer(maxlen=ring.maxlen)  # The local window of a plot process
+    dec = WindowDecimator(1000, 3, 'minmax')
+    cursor = 0
+    restarts = 0
+
+    def draw():
+        nonlocal cursor, restarts
+        cursor, delta, restarted = window.follow(ring, cursor)
+        if restarted:
+            dec.clear()
+            restarts += 1
+        now = int(window.latest(1)[0][-1])
+        tstamp, _ = dec.update(window, delta, 200, now)
+        return now, tstamp
+
+    for tstamp, values in frames(5 * CLOCK_RESET, 3.0):
+        ring.extend(tstamp, values)
+        before, points = draw()
+    assert points.max() > before - 2 * REORDER
+    newest = []
+    for tstamp, values in frames(0, 2.0):
+        ring.extend(tstamp, values)
+        now, points = draw()
+        newest.append(points.max())
+    assert restarts == 1
+    assert now < before
+    # Once the ring took the new clock the points advance with it, frame by frame
+    after = newest[-20:]
+    assert all(b > a for a, b in zip(after, after[1:]))
+    assert after[-1] > now - 2 * REORDER
+    assert points.min() >= now - 1000 * 1000 - 1000 * 1000 // 200  # Window and a bucket
+
+
+def test_follow_copies_every_sample_once():
+    ring = DataBuffer(maxlen=4096, reorder=REORDER)
+    window = DataBuffer(maxlen=ring.maxlen)
+    cursor, seen = 0, []
+    for tstamp, values in frames(0, 1.0):
+        ring.extend(tstamp, values)
+        cursor, delta, restarted = window.follow(ring, cursor)
+        assert not restarted
+        seen.append(delta[0].copy())
+    seen = np.concatenate(seen)
+    assert np.array_equal(seen, ring.latest()[0])
+    assert np.array_equal(window.latest()[0], ring.latest()[0])
+
+
+def signal(num: int, seed: int = 0, step: int = 1000) -> tuple:
+    """Timestamps every ``step`` us and three noisy channels, shape (3, num)."""
+    rng = np.random.default_rng(seed)
+    tstamp = step * np.arange(num, dtype=np.int64)
+    values = (np.sin(tstamp * 1e-5) + rng.normal(0, 0.3, (3, num))).astype(np.float32)
+    return tstamp, values
+
+
+def test_minmax_keeps_bucket_extremes_in_time_order():
+    tstamp, values = signal(1000)
+    bucket = tstamp // 7000
+    t, y = minmax(tstamp, values, bucket)
+    buckets = np.unique(bucket)
+    assert t.shape == y.shape == (3, 2 * len(buckets))
+    for ch in range(3):
+        for b, (t0, t1), (y0, y1) in zip(buckets, t[ch].reshape(-1, 2), y[ch].reshape(-1, 2)):
+            sel = bucket == b
+            assert t0 <= t1
+            assert {y0, y1} == {values[ch, sel].min(), values[ch, sel].max()}
+            assert values[ch, tstamp == t0][0] == y0 and values[ch, tstamp == t1][0] == y1
+
+
+def test_lttb_keeps_endpoints_and_one_point_per_bucket():
+    tstamp, values = signal(1000)
+    dec = Decimator(3, 'lttb')
+    dec.reset(10_000)
+    dec.extend(tstamp, values)
+    t, y = dec.points()
+    buckets = len(np.unique(tstamp // 10_000))
+    assert t.shape == y.shape == (3, buckets)
+    assert np.all(t[:, 0] == tstamp[0]) and np.array_equal(y[:, 0], values[:, 0])
+    assert np.all(t[:, -1] == tstamp[-1]) and np.array_equal(y[:, -1], values[:, -1])
+    # Every other point is a sample of its own bucket
+    assert np.all(np.diff(t // 10_000, axis=1) == 1)
+    for ch in range(3):
+        assert np.array_equal(y[ch], values[ch, np.searchsorted(tstamp, t[ch])])
+
+
+@pytest.mark.parametrize('kind', ['minmax', 'lttb'])
+def test_incremental_matches_one_batch(kind):
+    tstamp, values = signal(3000, seed=1)
+    whole = Decimator(3, kind)
+    whole.reset(10_000)
+    whole.extend(tstamp, values)
+    dec = Decimator(3, kind)
+    dec.reset(10_000)
+    for i in range(0, len(tstamp), 37):
+        dec.extend(tstamp[i:i+37], values[:, i:i+37])
+    for got, expect in zip(dec.points(), whole.points()):
+        assert np.array_equal(got, expect)
+
+
+def test_window_decimator_matches_whole_window():
+    winsize, width = 1000, 200  # Buckets of 5 ms
+    ring = DataBuffer(maxlen=4096)
+    incremental = WindowDecimator(winsize, 3, 'minmax')
+    cursor, checked = 0, False
+    for tstamp, values in frames(0, 5.0):
+        ring.extend(tstamp, values)
+        cursor, delta = ring.since(cursor)
+        now = int(tstamp[-1])
+        got = incremental.update(ring, delta, width, now)
+        if now % 5000 == 0 and now >= winsize * 1000:  # Window start on a bucket boundary
+            expect = WindowDecimator(winsize, 3, 'minmax').update(ring, None, width, now)
+            assert np.array_equal(got[0], expect[0]) and np.array_equal(got[1], expect[1])
+            checked = True
+    assert checked
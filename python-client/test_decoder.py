@@ -0,0 +1,92 @@
+# %%
+import logging
+
+import numpy as np
+import pytest
+
+import decoder
+import synth
+from decoder import (
+    BARO_CODE, MEASUREMENT_DTYPE, SINGLE_MEASUREMENT_SIZE, DataBuffer, crc16_xmodem, decode_batch, decode_packet,
+)
+
+UNKNOWN_CODE = 0x1234
+TEST_ID_CODE = 0x1D1D  # Not the firmware's code, which is unknown, see decoder.ID_CODE
+
+
+def _resign(recs: np.ndarray, index: np.ndarray):
+    """Recompute the CRC of the records at ``index`` after editing them."""
+    raw = recs.view(np.uint8).reshape(len(recs), MEASUREMENT_DTYPE.itemsize)
+    recs['crc'][index] = crc16_xmodem(raw[index, :-2])
+
+
+def stream(num: int = 500, seed: int = 0) -> np.ndarray:
+    """Records of a board with ID records, odd floats, bad CRCs and unknown types mixed in."""
+    rng = np.random.default_rng(seed)
+    elapsed = np.sort(rng.uniform(0.0, 60.0, num))
+    recs = synth.records(elapsed, id=2)
+    # Floats that must survive bit for bit
+    odd = rng.choice(len(recs), 8, replace=False)
+    recs['payload'][odd] = [[np.nan, -0.0, np.inf], [-np.inf, 1e-45, -3.4e38]] * 4
+    _resign(recs, odd)
+    recs = np.concatenate((synth.identity(TEST_ID_CODE, 2, 1000), recs, synth.identity(TEST_ID_CODE, 2, 2_000_000)))
+    inner = np.arange(1, len(recs) - 1)  # Keep the ID records intact
+    # Unknown measurement types, with a valid CRC
+    unknown = rng.choice(inner, 20, replace=False)
+    recs['mtype'][unknown] = UNKNOWN_CODE
+    _resign(recs, unknown)
+    # Corrupted records: a wrong CRC or a flipped payload bit
+    bad = rng.choice(inner, 30, replace=False)
+    recs['crc'][bad[:15]] ^= 0x0101
+    raw = recs.view(np.uint8).reshape(len(recs), MEASUREMENT_DTYPE.itemsize)
+    raw[bad[15:], 5] ^= 0x10
+    return recs
+
+
+def packet_decode(buf: bytes, caplog) -> tuple:
+    """Decode with :func:`decode_packet`, one record at a time as the original receive loop."""
+    buffers = [DataBuffer(maxlen=4096) for _ in range(4)]
+    caplog.clear()
+    with caplog.at_level(logging.WARNING, logger='decoder'):
+        for i in range(0, len(buf), SINGLE_MEASUREMENT_SIZE):
+            decode_packet(buf[i:i+SINGLE_MEASUREMENT_SIZE], *buffers)
+    messages = [rec.getMessage() for rec in caplog.records]
+    bad_crc = sum('invalid CRC' in msg for msg in messages)
+    unknown = sum('unknown type' in msg for msg in messages)
+    return buffers, bad_crc, unknown
+
+
+@pytest.mark.parametrize('id_code', [TEST_ID_CODE, None])
+@pytest.mark.parametrize('seed', range(5))
+def test_decode_batch_matches_decode_packet(seed, id_code, caplog, monkeypatch):
+    monkeypatch.setattr(decoder, 'ID_CODE', id_code)
+    recs = stream(seed=seed)
+    buf = recs.tobytes()
+    buffers, bad_crc, unknown = packet_decode(buf, caplog)
+    batch = decode_batch(buf)
+    assert batch.count == len(recs)
+    assert (batch.bad_crc, batch.unknown) == (bad_crc, unknown)
+    assert batch.bad_crc > 0 and batch.unknown > 0
+    # Without an ID code the ID records are unknown types
+    assert batch.device == ('Kiwi#0003' if id_code is not None else None)
+    for (tstamp, values), buffer in zip(batch.sensors(), buffers):
+        expect_t, *expect_v = buffer.latest()
+        assert len(tstamp) == len(expect_t)
+        assert np.array_equal(tstamp.astype(np.int64), expect_t)
+        # Bit for bit, NaN and -0.0 included
+        got = np.ascontiguousarray(values, dtype=np.float32).view(np.uint32)
+        expect = np.ascontiguousarray(np.array(expect_v).T, dtype=np.float32).view(np.uint32)
+        assert np.array_equal(got, expect)
+
+
+def test_decode_batch_counts_every_record(monkeypatch):
+    monkeypatch.setattr(decoder, 'ID_CODE', TEST_ID_CODE)
+    recs = stream(seed=7)
+    batch = decode_batch(recs.tobytes() + b'\x00' * 5)  # Trailing bytes of an incomplete record
+    samples = sum(len(tstamp) for tstamp, _ in batch.sensors())
+    ids = 2  # The intact ID records, neither samples nor dropped
+    assert batch.count == len(recs)
+    assert samples + ids + batch.bad_crc + batch.unknown == batch.count
+    assert len(batch.baro[0]) == np.count_nonzero(
+        (recs['mtype'] == BARO_CODE)
+        & (crc16_xmodem(recs.view(np.uint8).reshape(len(recs), -1)[:, :-2]) == recs['crc']))
@@ -0,0 +1,74 @@
+# %%
+import math
+
+import numpy as np
+import pytest
+
+import derived
+import synth
+from decoder import COLUMNS
+from derived import all_columns, channel, channels, derive, register
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """Derivations registered by a test are gone after it."""
+    monkeypatch.setattr(derived, 'DERIVATIONS', dict(derived.DERIVATIONS))
+    derived._by_sensor.clear()
+    yield derived.DERIVATIONS
+    derived._by_sensor.clear()
+
+
+def test_builtin_columns():
+    assert all_columns()[0] == COLUMNS[0] + ('r', 'theta', 'phi')
+    assert all_columns()[3] == COLUMNS[3]  # Nothing derived from baro
+    assert channels('gyro') == 6 and channel('mag', 'phi') == 5
+
+
+def test_spherical_matches_per_sample_formula():
+    values = synth.accel(np.linspace(0.0, 30.0, 500))
+    out = derive('accel', values)
+    assert out.shape == (500, 6) and out.dtype == np.float32
+    assert np.array_equal(out[:, :3], values)
+    for (x, y, z), (r, theta, phi) in zip(values.astype(np.float64), out[:, 3:]):
+        expect_r = math.sqrt(x * x + y * y + z * z)
+        assert r == pytest.approx(expect_r, rel=1e-6)
+        assert theta == pytest.approx(math.acos(z / expect_r) - math.pi / 2, abs=1e-4)  # float32 near the poles
+        assert phi == pytest.approx(math.atan2(y, x), abs=1e-5)
+
+
+def test_registered_derivation_is_a_column(registry):
+    @register('tilt', ('tilt',), sensors=('accel',))
+    def tilt(values):
+        return np.degrees(np.arctan2(np.hypot(values[:, 0], values[:, 1]), values[:, 2]))
+
+    assert all_columns()[0] == COLUMNS[0] + ('r', 'theta', 'phi', 'tilt')
+    assert all_columns()[1] == COLUMNS[1] + ('r', 'theta', 'phi')
+    values = synth.accel(np.linspace(0.0, 10.0, 100))
+    out = derive('accel', values)
+    for (x, y, z), got in zip(values.astype(np.float64), out[:, channel('accel', 'tilt')]):
+        assert got == pytest.approx(math.degrees(math.atan2(math.hypot(x, y), z)), abs=1e-4)
+    assert derive('gyro', values).shape == (100, 6)
+
+
+def test_multi_column_derivation_as_2d_array(registry):
+    register('square', ('xx', 'yy'), sensors=('baro',))(lambda values: values[:, :2] ** 2)
+    values = synth.baro(np.linspace(0.0, 10.0, 50))
+    out = derive('baro', values)
+    assert all_columns()[3] == COLUMNS[3] + ('xx', 'yy')
+    assert np.allclose(out[:, 3:], values[:, :2] ** 2)
+
+
+def test_same_name_replaces_derivation(registry):
+    register('tilt', ('tilt',), sensors=('accel',))(lambda values: values[:, 0])
+    register('tilt', ('tilt2',), sensors=('accel', 'mag'))(lambda values: values[:, 1])
+    assert list(registry).count('tilt') == 1
+    assert all_columns()[0] == COLUMNS[0] + ('r', 'theta', 'phi', 'tilt2')
+    assert all_columns()[2] == COLUMNS[2] + ('r', 'theta', 'phi', 'tilt2')
+    values = synth.mag(np.linspace(0.0, 10.0, 20))
+    assert np.array_equal(derive('mag', values)[:, -1], values[:, 1])
+
+
+def test_unknown_sensor_rejected(registry):
+    with pytest.raises(ValueError):
+        register('bad', ('bad',), sensors=('temp',))
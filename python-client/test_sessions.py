@@ -0,0 +1,176 @@
+# %%
+import asyncio
+
+import numpy as np
+import pytest
+
+import decoder
+import synth
+import udp_thread
+from udp_async import AsyncServer
+from udp_thread import IDENTIFY, QUIET, Ingest
+
+TEST_ID_CODE = 0x1D1D  # Not the firmware's code, which is unknown, see decoder.ID_CODE
+TIMEOUT = 120.0
+A = ('10.0.0.7', 50000)  # The address a board first sends from
+B = ('10.0.0.7', 50001)  # Its address after a reboot
+
+
+class Clock:
+    """Stands in for ``perf_counter_ns`` in :mod:`udp_thread`."""
+
+    def __init__(self):
+        self.now = 10**12
+
+    def __call__(self) -> int:
+        return self.now
+
+    def advance(self, ns: float):
+        self.now += int(ns)
+
+
+class RecordingIngest(Ingest):
+    """Headless ingest keeping the recorder messages instead of starting the recorder process."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.messages = []
+
+    def start_recorder(self):
+        pass
+
+    def post(self, msg, frame=False):
+        self.messages.append(msg)
+
+    def kinds(self, key):
+        return [msg[0] for msg in self.messages if msg is not None and msg[1] == key]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(udp_thread, 'perf_counter_ns', clock)
+    monkeypatch.setattr(decoder, 'ID_CODE', TEST_ID_CODE)
+    return clock
+
+
+@pytest.fixture
+def ingest(clock, tmp_path):
+    ingest = RecordingIngest(tmp_path, 'parquet', headless=True, session_timeout=TIMEOUT)
+    yield ingest
+    ingest.close()
+
+
+def datagram(start: float, stop: float, id: int = 0, identify: bool = False) -> bytes:
+    """Records of board ``id`` sampled at 100 Hz from ``start`` to ``stop`` seconds, ID record first."""
+    recs = synth.records(np.arange(start, stop, 0.01), id)
+    if identify:
+        recs = np.concatenate((synth.identity(TEST_ID_CODE, id, int(start * 1e6)), recs))
+    return recs.tobytes()
+
+
+def accel_tstamps(ingest: Ingest, key) -> np.ndarray:
+    buf = ingest.clients[key].accel
+    buf.flush()
+    return buf.latest()[0]
+
+
+def test_new_source_opens_at_once_without_a_gone_board(ingest, clock):
+    assert ingest.receive(A, datagram(0.0, 0.5)) is not None
+    assert ingest.routes[A] == A and A not in ingest.pending
+    assert ingest.kinds(A) == ['open']
+
+
+def test_id_from_new_port_resumes_session(ingest, clock):
+    ingest.receive(A, datagram(0.0, 1.0, identify=True))
+    client = ingest.clients[A]
+    assert client.device == 'Kiwi#0001' and ingest.devices == {'Kiwi#0001': A}
+    clock.advance(QUIET)  # The board reboots onto another port
+    assert ingest.receive(B, datagram(1.0, 1.5)) is None  # Held back until its ID arrives
+    assert B in ingest.pending and len(ingest.clients) == 1
+    clock.advance(IDENTIFY / 2)
+    assert ingest.receive(B, datagram(1.5, 2.0, identify=True)) is client
+    assert ingest.routes == {A: A, B: A} and B not in ingest.pending
+    assert client.source == B and len(ingest.clients) == 1
+    # Same buffers and recording: the held back records too, and no second file
+    assert np.array_equal(accel_tstamps(ingest, A), (np.arange(0.0, 2.0, 0.01) * 1e6).astype(np.int64))
+    assert client.recording and ingest.kinds(A) == ['open']
+    assert client.errors == 0
+
+
+def test_source_without_id_is_held_then_opened(ingest, clock):
+    ingest.receive(A, datagram(0.0, 1.0, identify=True))
+    clock.advance(QUIET)
+    held = datagram(0.0, 0.5, id=1)
+    assert ingest.receive(B, held) is None
+    clock.advance(IDENTIFY / 2)
+    assert ingest.expire() == []
+    assert B not in ingest.clients  # Still waiting for an ID
+    clock.advance(IDENTIFY / 2)
+    assert ingest.expire() == [B]
+    assert B not in ingest.pending and ingest.routes[B] == B
+    assert ingest.clients[B] is not ingest.clients[A]
+    assert len(accel_tstamps(ingest, B)) == 50  # The held back records
+    assert ingest.kinds(B) == ['open']
+
+
+def test_async_server_serves_held_back_source(ingest, clock):
+    async def expire():
+        server = AsyncServer(ingest)
+        ingest.receive(A, datagram(0.0, 1.0, identify=True))
+        server.watch(A)
+        clock.advance(QUIET)
+        ingest.receive(B, datagram(0.0, 0.5, id=1))
+        clock.advance(IDENTIFY)
+        server.expire()
+        watched = set(server.tasks)
+        for task in server.tasks.values():
+            task.cancel()
+        return watched
+
+    assert asyncio.run(expire()) == {A, B}
+
+
+def test_id_of_unknown_board_opens_new_session(ingest, clock):
+    ingest.receive(A, datagram(0.0, 1.0, identify=True))
+    clock.advance(QUIET)
+    assert ingest.receive(B, datagram(0.0, 0.5, id=1, identify=True)) is not None
+    assert ingest.routes[B] == B and ingest.devices == {'Kiwi#0001': A, 'Kiwi#0002': B}
+
+
+def test_session_evicted_after_timeout(ingest, clock):
+    ingest.receive(A, datagram(0.0, 1.0, identify=True))
+    clock.advance(TIMEOUT * 1e9 - 1e9)
+    ingest.expire()
+    assert A in ingest.clients
+    clock.advance(1e9)  # Sessions are checked once a second
+    ingest.expire()
+    assert ingest.clients == {} and ingest.routes == {} and ingest.devices == {}
+    assert ingest.kinds(A) == ['open', 'frame', 'close']  # The last samples recorded
+    # Back after the timeout the board is a new client
+    ingest.receive(B, datagram(5.0, 5.5, identify=True))
+    assert ingest.routes == {B: B}
+
+
+def test_closed_source_ignored_then_forgotten(ingest, clock):
+    ingest.closed[A] = clock()  # Its window was closed
+    assert ingest.receive(A, datagram(0.0, 0.5)) is None
+    assert A not in ingest.clients
+    clock.advance(TIMEOUT * 1e9 / 2)
+    ingest.receive(A, datagram(0.5, 1.0))  # Still sending, so still ignored
+    clock.advance(TIMEOUT * 1e9 / 2)
+    ingest.expire()
+    assert A in ingest.closed
+    clock.advance(TIMEOUT * 1e9 / 2)
+    ingest.expire()
+    assert A not in ingest.closed
+    assert ingest.receive(A, datagram(1.0, 1.5)) is not None
+
+
+def test_no_sessions_without_id_code(ingest, clock, monkeypatch):
+    monkeypatch.setattr(decoder, 'ID_CODE', None)
+    ingest.receive(A, datagram(0.0, 1.0, identify=True))
+    assert ingest.clients[A].device is None
+    clock.advance(QUIET)
+    assert ingest.receive(B, datagram(1.0, 1.5, identify=True)) is not None
+    assert ingest.routes == {A: A, B: B} and ingest.pending == {}
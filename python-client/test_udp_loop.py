@@ -0,0 +1,49 @@
+# %%
+import socket
+from threading import Event, Thread
+from time import perf_counter
+
+import numpy as np
+
+import synth
+import udp_thread
+from udp_socket import bind_udp
+
+
+class CountingIngest(udp_thread.Ingest):
+    """Headless ingest counting the services of every client, without the recorder process."""
+
+    serviced = 0
+
+    def start_recorder(self):
+        pass
+
+    def post(self, msg, frame=False):
+        pass
+
+    def service_all(self) -> bool:
+        CountingIngest.serviced += 1
+        return super().service_all()
+
+
+def test_clients_served_under_steady_traffic(monkeypatch, tmp_path):
+    monkeypatch.setattr(udp_thread, 'Ingest', CountingIngest)
+    sock = bind_udp('127.0.0.1', 0)
+    port = sock.getsockname()[1]
+    stop = Event()
+    loop = Thread(target=udp_thread.udp_loop, args=('127.0.0.1', port, tmp_path, 'parquet'),
+                  kwargs=dict(sock=sock, stop=stop, headless=True))
+    loop.start()
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    recs = synth.records(np.arange(16) / 1000.0)
+    try:
+        # Never quiet long enough for select() to time out
+        start = perf_counter()
+        while perf_counter() - start < 1.0:
+            sender.sendto(recs.tobytes(), ('127.0.0.1', port))
+        serviced = CountingIngest.serviced
+    finally:
+        stop.set()
+        loop.join()
+        sender.close()
+    assert serviced >= 5  # About every 0.1 s
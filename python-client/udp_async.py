@@ -0,0 +1,186 @@
+# %%
+from __future__ import annotations
+import asyncio
+from pathlib import Path
+import socket
+from time import time_ns
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence
+
+from capture import CaptureWriter
+from metrics import log_json, serve_prometheus
+from storesystem import SaveKind
+from udp_socket import bind_udp
+from udp_thread import SESSION_TIMEOUT, Ingest, RecvArena
+
+# A service is started on the server's event loop with the ingest state
+Service = Callable[[Ingest], Awaitable[None]]
+
+# %% asyncio UDP server
+
+
+class IngestProtocol(asyncio.DatagramProtocol):
+    """Collects datagrams into a :class:`RecvArena` and decodes them in batches.
+
+    Datagrams received in one event loop iteration are decoded together once
+    the loop gets to the scheduled flush, or as soon as the arena is full.
+    """
+
+    def __init__(self, server: AsyncServer, arena: RecvArena):
+        self.server = server
+        self.arena = arena
+        self._scheduled = False
+
+    def datagram_received(self, data: bytes, addr: Any):
+        if self.arena.put(data, addr):
+            self.flush()
+        elif not self._scheduled:
+            self._scheduled = True
+            asyncio.get_running_loop().call_soon(self.flush)
+
+    def error_received(self, exc: Exception):
+        print(f"[UDP] Connection lost: {exc}")
+
+    def flush(self):
+        self._scheduled = False
+        arena = self.arena
+        if arena.count == 0:
+            return
+        if self.server.writer is not None:
+            self.server.writer.write(
+                time_ns(), arena.buffer, arena.addrs[:arena.count], arena.nbytes)
+        ingest = self.server.ingest
+        for loc, temp in arena.batches():
+            if ingest.receive(loc, temp) is not None:
+                self.server.watch(ingest.routes[loc])
+        arena.count = 0
+        self.server.expire()
+
+
+class AsyncServer:
+    """Runs the ingest path on an asyncio event loop.
+
+    Every client gets its own task that feeds the recorder, reports rates,
+    answers frame requests and detects disconnection on a timer, whether or
+    not its board is sending.
+    """
+
+    def __init__(self, ingest: Ingest, poll: float = 0.01, writer: Optional[CaptureWriter] = None):
+        self.ingest = ingest
+        self.poll = poll
+        self.writer = writer
+        self.tasks: Dict[Any, asyncio.Task] = {}
+        self.done = asyncio.Event()
+
+    def watch(self, key: Any):
+        """Start the service task of a client if it is not running yet."""
+        task = self.tasks.get(key)
+        if task is None or task.done():  # Done once a client closed, the key may come back
+            self.tasks[key] = asyncio.get_running_loop().create_task(self._serve(key))
+
+    def expire(self):
+        """Close expired sessions and serve the clients of held back sources, see :meth:`Ingest.expire`."""
+        for key in self.ingest.expire():
+            self.watch(key)
+
+    async def _serve(self, key: Any):
+        client = self.ingest.clients.get(key)
+        while client is not None and self.ingest.clients.get(key) is client:
+            self.ingest.control()
+            self.ingest.pump()
+            self.expire()
+            if self.ingest.service(key):
+                self.done.set()
+            await asyncio.sleep(self.poll)
+
+
+async def serve(
+    host: str,
+    port: int,
+    ingest: Ingest,
+    rcvbuf: int = 4 * 1024 * 1024,
+    arena_slots: int = 1024,
+    poll: float = 0.01,
+    capture: Optional[Path] = None,
+    services: Sequence[Service] = (),
+    sock: Optional[socket.socket] = None,
+):
+    """Serve UDP clients until every client has disconnected.
+
+    Args:
+        host (str): Address to bind to.
+        port (int): Port to listen for UDP packets.
+        ingest (Ingest): Client bookkeeping shared with the services.
+        rcvbuf (int, optional): Requested kernel receive buffer (SO_RCVBUF) in bytes. Defaults to 4 MiB.
+        arena_slots (int, optional): Maximum number of datagrams decoded per batch. Defaults to 1024.
+        poll (float, optional): Seconds between client service runs. Defaults to 0.01.
+        capture (Optional[Path], optional): Append every received datagram to this capture file. Defaults to None.
+        services (Sequence[Service], optional): Extra coroutines, e.g. storage or diagnostics endpoints,
+            run on the same event loop. Defaults to ().
+        sock (Optional[socket.socket], optional): Socket already bound with :func:`udp_socket.bind_udp`.
+            Defaults to None, binding ``host``:``port`` here.
+    """
+    loop = asyncio.get_running_loop()
+    if sock is None:
+        sock = bind_udp(host, port, rcvbuf)
+    writer = CaptureWriter(capture) if capture is not None else None
+    server = AsyncServer(ingest, poll, writer)
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: IngestProtocol(server, RecvArena(arena_slots)), sock=sock)
+    print(f"[UDP] Listening for UDP packets on {host}:{port} with asyncio "
+          f"(receive buffer: {sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)} bytes)")
+    extra = [loop.create_task(service(ingest)) for service in services]
+    try:
+        await server.done.wait()
+    finally:
+        transport.close()
+        for task in [*server.tasks.values(), *extra]:
+            task.cancel()
+        await asyncio.gather(*extra, return_exceptions=True)  # Let the services clean up
+        if writer is not None:
+            writer.close()
+            print(f"[UDP] Captured {writer.count} datagrams to {capture}")
+
+
+def udp_async_loop(
+    host: str,
+    port: int,
+    datapath: Path = Path.cwd() / 'data',
+    savekind: SaveKind = 'excel',
+    winsize: int = 2000,
+    rcvbuf: int = 4 * 1024 * 1024,
+    store_options: Optional[dict] = None,
+    capture: Optional[Path] = None,
+    services: Sequence[Service] = (),
+    headless: bool = False,
+    dashboard: bool = False,
+    plot_options: Optional[dict] = None,
+    sock: Optional[socket.socket] = None,
+    metrics_port: Optional[int] = None,
+    metrics_log: Optional[Path] = None,
+    metrics_interval: float = 10.0,
+    session_timeout: float = SESSION_TIMEOUT,
+):
+    """asyncio counterpart of :func:`udp_thread.udp_loop`, see :func:`serve`.
+
+    The metrics endpoint and log are services on the event loop, see
+    :func:`metrics.serve_prometheus` and :func:`metrics.log_json`.
+    """
+    ingest = Ingest(
+        datapath, savekind, winsize, store_options,
+        headless=headless, dashboard=dashboard, plot_options=plot_options,
+        session_timeout=session_timeout)
+    services = list(services)
+    if metrics_port is not None:
+        services.append(lambda ingest: serve_prometheus(ingest.metrics, metrics_port))
+    if metrics_log is not None:
+        services.append(lambda ingest: log_json(ingest.metrics, metrics_log, metrics_interval))
+    ingest.preload()
+    try:
+        asyncio.run(serve(
+            host, port, ingest,
+            rcvbuf=rcvbuf, capture=capture, services=services, sock=sock
+        ))
+    except KeyboardInterrupt:
+        print("[UDP] Interrupted by user")
+    finally:
+        ingest.close()
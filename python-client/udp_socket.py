@@ -0,0 +1,43 @@
+# %%
+from __future__ import annotations
+import socket
+
+# %% Socket setup
+#
+# Kept free of heavy imports so that app.py can bind the port before it loads
+# numpy and the rest of the ingest path.
+
+
+def bind_udp(
+    host: str,
+    port: int,
+    rcvbuf: int = 4 * 1024 * 1024,
+    reuseport: bool = False,
+    name: str = '',
+) -> socket.socket:
+    """Create a UDP socket bound to ``host``:``port``.
+
+    The kernel queues datagrams for a bound socket, up to ``rcvbuf`` bytes,
+    so nothing sent after this returns is lost while the caller still loads
+    the rest of the application.
+
+    Args:
+        host (str): Address to bind to.
+        port (int): Port to listen for UDP packets.
+        rcvbuf (int, optional): Requested kernel receive buffer (SO_RCVBUF) in bytes. Defaults to 4 MiB.
+        reuseport (bool, optional): Share the port with other processes (SO_REUSEPORT). Defaults to False.
+        name (str, optional): Worker name used in messages. Defaults to ''.
+
+    Returns:
+        socket.socket: The bound socket.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    except OSError as e:
+        print(f"[UDP{name}] Could not set receive buffer to {rcvbuf} bytes: {e}")
+    if reuseport:
+        # The kernel spreads sources over all sockets bound to the port
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))  # Bind to address and port
+    return sock
@@ -1,35 +1,84 @@
 from __future__ import annotations
 from datetime import datetime
 from pathlib import Path
+import select
 import socket
-import struct
-from time import perf_counter_ns
+from time import perf_counter_ns, sleep, time_ns
 from multiprocessing import Queue, Process, Event
+from queue import Empty, Full
 from threading import Thread
-from typing import Any, Optional, Tuple
-from dataclasses import dataclass
-from plot import SaveKind, draw_loop
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+from dataclasses import dataclass, field
+from importlib import import_module
 
-from pandas import DataFrame
+import numpy as np
 
-from decoder import DataBuffer, SINGLE_MEASUREMENT_SIZE, decode_packet
+from backpressure import DISPLAY_DEPTH, RECORD_DEPTH, RecordQueue, put_latest
+from capture import CaptureWriter, read_capture, source_addresses
+from decoder import SINGLE_MEASUREMENT_SIZE, DataBuffer, decode_batch
+from derived import SENSORS, all_columns, channels, derive
+from metrics import Histogram, Metrics, MetricsExport, source_label
+from shmring import SharedDataBuffer
+from storesystem import SaveKind
+from udp_socket import bind_udp
 
 # %%
+MAX_RATE = 1000  # Samples per second of one sensor the buffers are sized for
+REORDER = 20_000  # Microseconds a late datagram may trail and still be sorted into place
+QUIET = 1_000_000_000  # Nanoseconds without data after which a board counts as gone, e.g. rebooting
+IDENTIFY = 3_000_000_000  # Nanoseconds a new source waits for its ID while a board is gone
+SERVICE = 100_000_000  # Nanoseconds between services of every client by the select loop
+SESSION_TIMEOUT = 120.0  # Seconds without data before a session is closed
+ERRORS_SHOWN = 10  # Unexpected errors printed per client, the rest are only counted
 
 
 @dataclass
 class Client:
+    # Sensor buffers in shared memory, mapped read-only by the plot process.
+    # Headless clients keep private buffers instead.
     accel: DataBuffer
     gyro: DataBuffer
     mag: DataBuffer
     baro: DataBuffer
-    request: Queue  # Plot thread requests data: Queue[int]
-    # UDP thread sends data: Queue[Tuple[DataFrame, DataFrame, DataFrame, DataFrame]]
-    response: Queue
-    info: Queue  # UDP thread sends info: Queue[Tuple[float, str, float, str]]
-    shutdown: Any  # Plot thread signals window closed: Event
+    # Plot process queues, None for headless and dashboard clients
+    request: Optional[Queue]  # Plot thread requests a frame: Queue[int]
+    # UDP thread announces a frame, samples written per sensor: Queue[Tuple[int, int, int, int]]
+    response: Optional[Queue]
+    info: Optional[Queue]  # UDP thread sends info: Queue[Tuple[float, str, float, str]]
+    shutdown: Any  # Plot thread or dashboard signals window closed: Event
     datarate: DataRate
-    last: int = perf_counter_ns()
+    last: int = perf_counter_ns()  # Last hand-off to the recorder
+    # Recording: on or off, and the buffer totals already handed to the recorder
+    recording: bool = False
+    cursors: List[int] = field(default_factory=lambda: [0, 0, 0, 0])
+    # Records received, and those rejected for a bad CRC or an unknown type
+    records: int = 0
+    bad_crc: int = 0
+    unknown: int = 0
+    # Display messages dropped for a lagging plot process, and samples
+    # overwritten in the ring before they were recorded
+    display_dropped: int = 0
+    overrun: int = 0
+    errors: int = 0  # Unexpected exceptions while decoding or serving, see :meth:`Ingest.error`
+    # Stage timings, see :mod:`metrics`
+    decode_time: Optional[Histogram] = None
+    insert_time: Optional[Histogram] = None
+    # Board ID once received, the address the board sends from now and the
+    # time of its last datagram
+    device: Optional[str] = None
+    source: Any = None
+    seen: int = 0
+
+    def buffers(self) -> Tuple[DataBuffer, ...]:
+        return (self.accel, self.gyro, self.mag, self.baro)
+
+    def counts(self) -> Tuple[int, int, int, int]:
+        """Records received, bad CRC, unknown type and late or duplicate samples."""
+        return (self.records, self.bad_crc, self.unknown, sum(buf.dropped for buf in self.buffers()))
+
+    def close(self):
+        for buf in self.buffers():
+            buf.close()
 
 
 class DataRate:
@@ -39,11 +88,20 @@ class DataRate:
         self.last = None  # Last timestamp for calculating data rate
         self.update_rate = update_rate
         self.start = perf_counter_ns()
+        self.rates = (0.0, 0.0)  # Last reported (bits/s, packets/s)
 
-    def update(self, num_samples: int = 1) -> Optional[Tuple[float, str, float, str]]:
-        now = perf_counter_ns()
+    def update(self, num_samples: int = 1, num_packets: int = 1) -> Optional[Tuple[float, str, float, str]]:
+        self.add(num_samples, num_packets)
+        return self.report()
+
+    def add(self, num_samples: int = 1, num_packets: int = 1):
+        """Count received bytes and packets without reporting."""
         self.bytecount += num_samples
-        self.count += 1
+        self.count += num_packets
+
+    def report(self) -> Optional[Tuple[float, str, float, str]]:
+        """Rates since the last report, once every ``update_rate`` seconds."""
+        now = perf_counter_ns()
         if self.last is None:
             self.last = now
             return
@@ -51,23 +109,798 @@ class DataRate:
         if elapsed > self.update_rate:  # Update every second
             datarate = self.bytecount * 8 / elapsed
             packrate = self.count / elapsed
+            self.rates = (datarate, packrate)
             packunit = 'packets/s'
             self.last = now
             self.bytecount = 0
             self.count = 0
             dataunit = 'bps'
-            if datarate > 1024:
-                datarate /= 1024
-                dataunit = 'Kbps'
-            elif datarate > 1024*1024:
+            if datarate > 1024*1024:
                 datarate /= 1024*1024
                 dataunit = 'Mbps'
+            elif datarate > 1024:
+                datarate /= 1024
+                dataunit = 'Kbps'
             if packrate > 1000:
                 packrate /= 1000
                 packunit = 'Kpackets/s'
             return (datarate, dataunit, packrate, packunit)
 
         return None
+# %% Receive arena
+
+
+class RecvArena:
+    """Preallocated receive buffer holding one measurement per slot.
+
+    Every pending datagram is received straight into its slot with
+    ``recvfrom_into``, so draining the socket allocates no payload objects.
+    The source address of each slot is recorded alongside.
+    """
+
+    def __init__(self, slots: int = 1024):
+        self.buffer = bytearray(slots * SINGLE_MEASUREMENT_SIZE)
+        view = memoryview(self.buffer)
+        self._slots = [
+            view[i*SINGLE_MEASUREMENT_SIZE:(i+1)*SINGLE_MEASUREMENT_SIZE]
+            for i in range(slots)
+        ]
+        self.addrs: List[Any] = [None] * slots
+        self.nbytes = np.zeros(slots, dtype=np.intp)
+        self.count = 0  # Slots filled by the last drain
+        self.short = 0  # Incomplete datagrams seen by the last drain
+
+    def drain(self, sock: socket.socket) -> int:
+        """Receive every pending datagram from a non-blocking socket.
+
+        Returns:
+            int: Number of slots filled, at most the arena size.
+        """
+        count = 0
+        for slot in self._slots:
+            try:
+                nbytes, addr = sock.recvfrom_into(slot, SINGLE_MEASUREMENT_SIZE)
+            except BlockingIOError:
+                break
+            self.nbytes[count] = nbytes
+            self.addrs[count] = addr
+            count += 1
+        self.count = count
+        return count
+
+    def put(self, data: bytes, addr: Any) -> bool:
+        """Append one datagram received elsewhere, e.g. by an asyncio transport.
+
+        Returns:
+            bool: True when the arena is full.
+        """
+        count = self.count
+        nbytes = min(len(data), SINGLE_MEASUREMENT_SIZE)
+        self._slots[count][:nbytes] = data[:nbytes]
+        self.nbytes[count] = nbytes
+        self.addrs[count] = addr
+        self.count = count + 1
+        return self.count == len(self._slots)
+
+    def load(self, payload: np.ndarray, addrs: List[Any], nbytes: np.ndarray) -> int:
+        """Fill the arena from recorded datagrams instead of a socket.
+
+        Args:
+            payload (np.ndarray): Payloads, shape (n, SINGLE_MEASUREMENT_SIZE) with n <= slots.
+            addrs (List[Any]): Source address of each datagram.
+            nbytes (np.ndarray): Size of each datagram.
+
+        Returns:
+            int: Number of slots filled.
+        """
+        count = len(addrs)
+        np.frombuffer(self.buffer, dtype=np.uint8)[:count*SINGLE_MEASUREMENT_SIZE] = payload.reshape(-1)
+        self.addrs[:count] = addrs
+        self.nbytes[:count] = nbytes
+        self.count = count
+        return count
+
+    def batches(self) -> Iterator[Tuple[Any, memoryview]]:
+        """Yield ``(source, records)`` for each source in the last drain.
+
+        Records of a source are contiguous bytes ready for
+        :func:`decoder.decode_batch`. Incomplete datagrams are skipped and
+        counted in :attr:`short`.
+        """
+        count = self.count
+        valid = self.nbytes[:count] == SINGLE_MEASUREMENT_SIZE
+        self.short = count - int(np.count_nonzero(valid))
+        index: dict = {}
+        ids = np.fromiter(
+            (index.setdefault(addr, len(index)) for addr in self.addrs[:count]),
+            dtype=np.intp, count=count)
+        if len(index) == 1 and self.short == 0:
+            # Common case: a single board, records already contiguous
+            yield self.addrs[0], memoryview(self.buffer)[:count*SINGLE_MEASUREMENT_SIZE]
+            return
+        records = np.frombuffer(self.buffer, dtype=np.uint8).reshape(
+            -1, SINGLE_MEASUREMENT_SIZE)[:count]
+        for loc, idx in index.items():
+            sel = valid & (ids == idx)
+            if sel.any():
+                yield loc, memoryview(records[sel].reshape(-1))
+
+# %% Client bookkeeping
+
+
+def buffer_bytes(winsize: int) -> int:
+    """Memory of the buffers of one client for a window of ``winsize`` milliseconds, see :meth:`Ingest.buffers`.
+
+    The buffers are sized for ``MAX_RATE`` samples per second and rounded up to
+    a power of two samples. Every plot process keeps a copy as large, see
+    :func:`plot.draw_loop`.
+    """
+    return sum(DataBuffer.nbytes(winsize * MAX_RATE // 1000, channels(sensor)) for sensor in SENSORS)
+
+
+class Ingest:
+    """Decodes records into per-client buffers and manages the plot processes.
+
+    The records can come from the UDP socket (:func:`udp_loop`) or from a
+    capture file (:func:`replay_loop`).
+
+    Recordings are written by a separate process, see :mod:`recorder`. The
+    samples a recording client received since the last hand-off are posted to
+    it every ``frametime`` nanoseconds, or earlier when a buffer is half full,
+    so every sample is recorded once whatever the frame rate of the plots.
+    The Save buttons of the plot processes start and stop recording through
+    :attr:`commands`, see :meth:`control`.
+
+    In ``headless`` mode no plot process is started and matplotlib is never
+    imported. Every client records from the moment it connects.
+
+    In ``dashboard`` mode all clients share a single plot process, see
+    :mod:`dashboard`, which reads their shared buffers directly. Closing it
+    disconnects every client.
+
+    When ``events`` is given, connections, disconnections and rate reports are
+    also posted there as ``(kind, name, loc, ...)`` tuples for a supervisor,
+    see :mod:`workers`. Rate reports carry ``bits/s, packets/s`` and the
+    :meth:`Client.counts` of the client.
+
+    Clients are sessions of boards rather than of source addresses. A session
+    is keyed by the address its board first sent from, and the ID records the
+    boards send every 2 s map the board to it. A board that comes back from
+    another address, e.g. after a reboot onto a new ephemeral port, resumes
+    its session: same buffers, plot process and recording file. To that end
+    the records of a new source are held back for up to ``IDENTIFY`` while a
+    board with a known ID is gone, until the ID of the new source arrives.
+    Sessions without data for ``session_timeout`` seconds are closed. Workers
+    do not share sessions, a board resumes its session only if its new address
+    reaches the same worker. Boards are identified only once the type code of
+    the ID records is set, see :data:`decoder.ID_CODE`; until then every
+    source address is a session of its own.
+
+    Stage timings, record counts and queue depths are kept in :attr:`metrics`,
+    together with the snapshots the plot processes post on :attr:`reports`.
+    With ``events`` the whole registry is also posted as ``('metrics', name,
+    None, entries)`` once a second.
+    """
+
+    def __init__(
+        self,
+        datapath: Path = Path.cwd() / 'data',
+        savekind: SaveKind = 'excel',
+        winsize: int = 2000,
+        store_options: Optional[dict] = None,
+        events: Optional[Queue] = None,
+        name: str = '',
+        exit_when_empty: bool = True,
+        headless: bool = False,
+        frametime: int = int(1e9 / 2),
+        dashboard: bool = False,
+        plot_options: Optional[dict] = None,
+        plot_target: Optional[Callable] = None,
+        session_timeout: float = SESSION_TIMEOUT,
+    ):
+        self.datapath = datapath
+        self.savekind = savekind
+        self.winsize = winsize
+        self.store_options = store_options
+        self.plot_options = plot_options  # Keyword arguments for plot.draw_loop
+        self.plot_target = plot_target  # Run in the plot process instead of plot.draw_loop
+        self.events = events
+        self.name = name  # Worker name reported with events
+        self.exit_when_empty = exit_when_empty
+        self.headless = headless
+        self.frametime = frametime  # Nanoseconds between hand-offs to the recorder
+        self.dashboard = dashboard
+        # Shared plot process in dashboard mode, started with the first client
+        self.board_proc: Optional[Process] = None
+        self.board_control: Optional[Queue] = None  # Board messages to the dashboard
+        self.board_rates: Optional[Queue] = None  # Rate messages to the dashboard, latest only
+        self.board_shutdown: Any = None  # Dashboard signals window closed: Event
+        # Recorder process, started with the first recording, and its frame queue
+        self.recorder: Optional[Process] = None
+        self.frames: Optional[Queue] = None
+        # Messages the frame queue had no room for yet, see :meth:`post`
+        self.backlog: Optional[RecordQueue] = None
+        self.unsent: Any = None  # Taken from the backlog, the frame queue was full again
+        self.commands = Queue()  # Save buttons of the plot processes: (client key, recording)
+        # Dictionary of clients, keyed by the address their board first sent from
+        self.clients: dict[Any, Client] = {}
+        # Dictionary of plot processes, and those of closed clients still exiting
+        self.threads: dict[Any, Process] = {}
+        self.exiting: List[Process] = []
+        # Client key of every source address and of every board ID
+        self.routes: dict[Any, Any] = {}
+        self.devices: dict[str, Any] = {}
+        # New sources waiting for their ID: time of the first datagram and the records held back
+        self.pending: dict[Any, Tuple[int, List[bytes]]] = {}
+        # Sources of closed windows and the time of their last datagram, ignored until silent
+        self.closed: dict[Any, int] = {}
+        self.session_timeout = session_timeout  # Seconds, 0 keeps sessions forever
+        self.expired = 0  # Last time the sessions were checked for expiry
+        self.metrics = Metrics()
+        self.reports = Queue()  # Metrics snapshots of the plot processes: (origin, entries)
+        self.posted = 0  # Last time the metrics were posted to events
+
+    def buffers(self, kind: type = SharedDataBuffer) -> List[DataBuffer]:
+        """Time-ordered accel, gyro, mag and baro buffers holding ``winsize`` milliseconds.
+
+        Each has the raw channels of its sensor followed by the derived ones, see
+        :mod:`derived`, and :func:`buffer_bytes` for the memory they take.
+        """
+        return [
+            kind(maxlen=self.winsize * MAX_RATE // 1000, channels=channels(sensor),
+                 span=self.winsize * 1000, reorder=REORDER)
+            for sensor in SENSORS
+        ]
+
+    def preload(self) -> Thread:
+        """Start the recorder in headless mode and import the plotting modules in the background.
+
+        The first client then connects without waiting for matplotlib or the
+        storage library, while the caller keeps draining the socket.
+        """
+        if self.headless:
+            self.start_recorder()  # Forked before the import thread starts
+        def load():
+            try:
+                # So a plot process forked for the first client finds every import done
+                if self.dashboard:
+                    import_module('dashboard')
+                elif not self.headless and self.plot_target is None:
+                    import_module('plot')
+            except ImportError:
+                pass  # Raised again when a client needs the module
+        thread = Thread(target=load, name=f'preload{self.name}', daemon=True)
+        thread.start()
+        return thread
+
+    def connect(self, loc: Any) -> Client:
+        """Create the buffers and plot process of a new client."""
+        winsize = self.winsize
+        if self.headless:
+            return self._connect_headless(loc)
+        if self.dashboard:
+            return self._connect_dashboard(loc)
+        # Create queues and event to communicate with plot thread for client
+        request = Queue(maxsize=1)
+        # A stalled plot window only gets the latest messages, see :func:`put_latest`
+        response = Queue(maxsize=DISPLAY_DEPTH)
+        info = Queue(maxsize=DISPLAY_DEPTH)
+        shutdown = Event()
+        client = Client(
+            *self.buffers(SharedDataBuffer),
+            request,
+            response,
+            info,
+            shutdown,
+            DataRate(update_rate=1.0)
+        )
+        # Start plot thread for client
+        target = self.plot_target
+        if target is None:
+            from plot import draw_loop as target  # Only plotting pulls in matplotlib
+        specs = tuple(buf.spec() for buf in client.buffers())
+        proc = Process(None, target, args=(loc, specs, request, response, info, shutdown, winsize),
+                       kwargs=dict(commands=self.commands, metrics=self.reports, **(self.plot_options or {})))
+        proc.start()
+        self.threads[loc] = proc
+        self.clients[loc] = client
+        print(f"[UDP{self.name}] New client connected: {loc[0]}:{loc[1]}")
+        if self.events is not None:
+            self.events.put_nowait(('connect', self.name, loc))
+        return client
+
+    def _connect_headless(self, loc: Any) -> Client:
+        """Create the buffers of a new client and start recording."""
+        client = Client(
+            *self.buffers(DataBuffer),
+            None,
+            None,
+            None,
+            None,
+            DataRate(update_rate=1.0),
+        )
+        self.clients[loc] = client
+        print(f"[UDP{self.name}] New client connected: {loc[0]}:{loc[1]}")
+        self.start_recording(loc, client)
+        if self.events is not None:
+            self.events.put_nowait(('connect', self.name, loc))
+        return client
+
+    def _connect_dashboard(self, loc: Any) -> Client:
+        """Create the shared buffers of a new client and show it on the dashboard."""
+        winsize = self.winsize
+        if self.board_proc is None:
+            from dashboard import dashboard_loop  # Only plotting pulls in matplotlib
+            options = self.plot_options or {}
+            self.board_control = Queue()
+            self.board_rates = Queue(maxsize=DISPLAY_DEPTH * 16)
+            self.board_shutdown = Event()
+            self.board_proc = Process(None, dashboard_loop, args=(
+                self.board_control, self.board_shutdown, winsize),
+                kwargs=dict(
+                    commands=self.commands, metrics=self.reports, rates=self.board_rates,
+                    frametime=options.get('frametime', int(1e9 / 30)),
+                    decimate=options.get('decimate', 'minmax')))
+            self.board_proc.start()
+        client = Client(
+            *self.buffers(SharedDataBuffer),
+            None,
+            None,
+            None,
+            self.board_shutdown,
+            DataRate(update_rate=1.0)
+        )
+        self.clients[loc] = client
+        self.board_control.put_nowait(
+            ('connect', loc, tuple(buf.spec() for buf in client.buffers())))
+        print(f"[UDP{self.name}] New client connected: {loc[0]}:{loc[1]}")
+        if self.events is not None:
+            self.events.put_nowait(('connect', self.name, loc))
+        return client
+
+    def start_recorder(self):
+        """Start the recorder process, see :mod:`recorder`, unless it is running."""
+        if self.recorder is not None:
+            return
+        from recorder import recorder_loop
+        options = self.store_options or {}
+        # A recorder that falls behind never holds up the ingest: its frames
+        # wait in the backlog, which spills or drops them beyond queue_size
+        size = options.get('queue_size', RECORD_DEPTH)
+        # Created here, the backlog may spill before the recorder opens its first file
+        self.datapath.mkdir(parents=True, exist_ok=True)
+        self.frames = Queue(maxsize=size)
+        self.backlog = RecordQueue(size, 'drop' if options.get('overflow') == 'drop' else 'spill', self.datapath)
+        self.recorder = Process(
+            None, recorder_loop, f'recorder{self.name}',
+            args=(self.frames, self.datapath, self.savekind),
+            kwargs=dict(store_options=self.store_options, metrics=self.reports))
+        self.recorder.start()
+
+    def start_recording(self, key: Any, client: Client):
+        """Record client ``key`` from its next sample on."""
+        self.start_recorder()
+        client.recording = True
+        client.cursors = [buf.total for buf in client.buffers()]
+        client.last = perf_counter_ns()
+        # The column names go along, a spawned recorder may not have the derivations registered here
+        self.post(('open', key, f"data_{key[0]}_{key[1]}", all_columns()))
+        print(f"[UDP{self.name}] Recording client {key[0]}:{key[1]}")
+
+    def stop_recording(self, key: Any, client: Client, final: bool = False):
+        """Hand the last samples of client ``key`` to the recorder and close its recording.
+
+        Args:
+            key (Any): Client key.
+            client (Client): The client.
+            final (bool, optional): The client is closing, also record the samples
+                held back for reordering. Defaults to False.
+        """
+        if final:
+            for buf in client.buffers():
+                buf.flush()
+        self.record(key, client)
+        self.post(('close', key))
+        client.recording = False
+        print(f"[UDP{self.name}] Stopped recording client {key[0]}:{key[1]}")
+
+    def record(self, key: Any, client: Client):
+        """Post the samples client ``key`` received since the last call to the recorder."""
+        frame = []
+        for i, buf in enumerate(client.buffers()):
+            cursor = client.cursors[i]
+            client.cursors[i], arrays = buf.since(cursor)
+            client.overrun += max(client.cursors[i] - cursor - len(arrays[0]), 0)
+            # Copy, the ring keeps being written until the frame is sent
+            frame.append(tuple(np.array(arr) for arr in arrays))
+        client.last = perf_counter_ns()
+        if any(len(arrays[0]) for arrays in frame):
+            self.post(('frame', key, tuple(frame)), frame=True)
+
+    def post(self, msg: Any, frame: bool = False):
+        """Hand ``msg`` to the recorder without waiting, see :mod:`recorder`.
+
+        Messages wait in :attr:`backlog` while the bounded frame queue is full,
+        spilled to disk beyond ``queue_size``. With overflow 'drop' a ``frame``
+        is dropped instead, the messages opening and closing recordings never are.
+        """
+        if frame:
+            self.backlog.offer(msg)
+        else:
+            self.backlog.put(msg)
+        self.pump()
+
+    def pump(self, wait: bool = False):
+        """Move the messages of :attr:`backlog` onto the frame queue while it has room.
+
+        Args:
+            wait (bool, optional): Wait for the recorder until the backlog is empty,
+                e.g. when closing. Defaults to False.
+        """
+        if self.backlog is None:
+            return
+        while True:
+            if self.unsent is None:
+                try:
+                    self.unsent = self.backlog.get_nowait()
+                except Empty:
+                    return
+            try:
+                self.frames.put(self.unsent, timeout=1.0) if wait else self.frames.put_nowait(self.unsent)
+            except Full:
+                if wait and self.recorder is not None and self.recorder.is_alive():
+                    continue
+                return
+            self.unsent = None
+
+    def control(self):
+        """Start or stop recording clients as the Save buttons ask on :attr:`commands`."""
+        while True:
+            try:
+                key, on = self.commands.get_nowait()
+            except Empty:
+                return
+            client = self.clients.get(key)
+            if client is None or client.recording == on:
+                continue  # Closed meanwhile, or clicked twice
+            if on:
+                self.start_recording(key, client)
+            else:
+                self.stop_recording(key, client)
+
+    def feed(self, loc: Any, temp) -> bool:
+        """Process the records received from one source, then serve its client and the Save buttons, and close expired sessions.
+
+        Args:
+            loc (Any): Source address (ip, port).
+            temp (bytes-like): Contiguous SINGLE_MEASUREMENT_SIZE records.
+
+        Returns:
+            bool: True once every client has disconnected.
+        """
+        client = self.receive(loc, temp)
+        self.control()
+        self.pump()
+        self.expire()
+        if client is None:
+            return False
+        return self.service(self.routes[loc])
+
+    def receive(self, loc: Any, temp) -> Optional[Client]:
+        """Decode the records received from one source into its buffers.
+
+        Returns:
+            Optional[Client]: The client, or None if the source is held back or has disconnected.
+        """
+        key = self.routes.get(loc)
+        if key is None:  # New source
+            temp = self.attach(loc, temp)
+            if temp is None:
+                return None
+            key = self.routes[loc]
+        client = self.clients[key]  # Retrieve the client communication objects
+        try:
+            client.datarate.add(
+                len(temp), len(temp) // SINGLE_MEASUREMENT_SIZE)  # Update data rate
+            # Decode the packets and store data in buffers
+            start = perf_counter_ns()
+            batch = decode_batch(temp)
+            decoded = perf_counter_ns()
+            client.records += batch.count
+            client.bad_crc += batch.bad_crc
+            client.unknown += batch.unknown
+            # Derived channels are computed once per sample, here
+            for buf, sensor, (tstamp, values) in zip(client.buffers(), SENSORS, batch.sensors()):
+                buf.extend(tstamp, derive(sensor, values))
+            client.decode_time.observe(decoded - start)
+            client.insert_time.observe(perf_counter_ns() - decoded)
+            client.seen = perf_counter_ns()
+            if batch.device is not None and client.device is None:
+                self.identify(key, client, batch.device)
+        except Exception as e:  # e.g. a failing derivation, see :mod:`derived`
+            self.error(key, client, 'decoding', e)
+        return client
+
+    def error(self, key: Any, client: Client, stage: str, exc: Exception):
+        """Count an unexpected exception of client ``key`` and print the first ``ERRORS_SHOWN``."""
+        client.errors += 1
+        if client.errors <= ERRORS_SHOWN:
+            more = " (further errors are only counted)" if client.errors == ERRORS_SHOWN else ""
+            print(f"[UDP{self.name}] Error {stage} client {key[0]}:{key[1]}: {exc!r}{more}")
+
+    def attach(self, loc: Any, temp) -> Optional[bytes]:
+        """Route a new source to a client: the session of its board if that board is gone, else a new one.
+
+        Returns:
+            Optional[bytes]: The records to decode, with those held back so far,
+            or None while the source is held back or its window was closed.
+        """
+        now = perf_counter_ns()
+        if loc in self.closed:
+            self.closed[loc] = now
+            return None
+        held = self.pending.get(loc)
+        if held is None:
+            if not any(client.device is not None and now - client.seen >= QUIET
+                       for client in self.clients.values()):
+                self.open(loc)  # No board to resume, the common case
+                return temp
+            held = self.pending[loc] = (now, [])
+        held[1].append(bytes(temp))
+        device = decode_batch(temp).device
+        key = self.devices.get(device)
+        if key is not None and now - self.clients[key].seen >= QUIET:
+            client = self.clients[key]
+            client.source = loc
+            self.routes[loc] = key
+            print(f"[UDP{self.name}] Board {device} reconnected from {loc[0]}:{loc[1]}")
+        elif device is not None or now - held[0] >= IDENTIFY:
+            self.open(loc)
+        else:
+            return None
+        del self.pending[loc]
+        return b''.join(held[1])
+
+    def open(self, loc: Any) -> Client:
+        """Connect a new client for source ``loc``, see :meth:`connect`."""
+        client = self.connect(loc)
+        client.decode_time = self.metrics.histogram('decode', source_label(loc))
+        client.insert_time = self.metrics.histogram('insert', source_label(loc))
+        client.source = loc
+        client.seen = perf_counter_ns()
+        self.routes[loc] = loc
+        return client
+
+    def identify(self, key: Any, client: Client, device: str):
+        """Map board ``device`` to the client ``key``, on the first ID record of the client."""
+        client.device = device
+        other = self.devices.get(device)
+        if other is None:
+            self.devices[device] = key
+            print(f"[UDP{self.name}] Client {key[0]}:{key[1]} is board {device}")
+        else:
+            print(f"[UDP{self.name}] Board {device} sends from {other[0]}:{other[1]} "
+                  f"and {key[0]}:{key[1]}, keeping both clients")
+
+    def expire(self) -> List[Any]:
+        """Close the sessions without data for ``session_timeout`` seconds.
+
+        Also connects the held back sources that went silent before their ID
+        arrived, forgets the closed sources silent as long and reaps the plot
+        processes that exited. Checks at most once a second.
+
+        Returns:
+            List[Any]: Keys of the clients connected for held back sources.
+        """
+        now = perf_counter_ns()
+        if now - self.expired < 1e9:
+            return []
+        self.expired = now
+        for proc in self.exiting:
+            proc.join(timeout=0)
+        self.exiting = [proc for proc in self.exiting if proc.exitcode is None]
+        opened = []
+        for loc, (first, records) in list(self.pending.items()):
+            if now - first >= IDENTIFY:
+                del self.pending[loc]
+                self.open(loc)
+                self.receive(loc, b''.join(records))
+                opened.append(loc)
+        if not self.session_timeout:
+            return opened
+        timeout = self.session_timeout * 1e9
+        for loc, last in list(self.closed.items()):
+            if now - last >= timeout:
+                del self.closed[loc]
+        for key, client in list(self.clients.items()):
+            if now - client.seen >= timeout:
+                print(f"[UDP{self.name}] Client {key[0]}:{key[1]} silent for {self.session_timeout:g} s, closing")
+                self.evict(key)
+        return opened
+
+    def evict(self, key: Any):
+        """Close the client ``key``: its recording, plot process or dashboard board, and its buffers."""
+        client = self.clients.pop(key)
+        if client.recording:
+            self.stop_recording(key, client, final=True)
+        if self.dashboard:
+            self.board_control.put_nowait(('disconnect', key))
+        elif not self.headless:
+            client.shutdown.set()  # Closes the plot window
+            self.exiting.append(self.threads.pop(key))  # Reaped by :meth:`expire`
+        client.close()
+        self.forget(key, client)
+        if self.events is not None:
+            self.events.put_nowait(('disconnect', self.name, key))
+
+    def forget(self, key: Any, client: Client) -> List[Any]:
+        """Drop the routes, board ID and metrics of a closed client.
+
+        Returns:
+            List[Any]: The source addresses the client was reached from.
+        """
+        sources = [loc for loc, other in self.routes.items() if other == key]
+        for loc in sources:
+            del self.routes[loc]
+        if client.device is not None and self.devices.get(client.device) == key:
+            del self.devices[client.device]
+        self.metrics.forget(source_label(key))
+        return sources
+
+    def service(self, loc: Any) -> bool:
+        """Feed the recorder, report rates, answer frame requests and detect disconnection of a client.
+
+        Returns:
+            bool: True once every client has disconnected.
+        """
+        client = self.clients.get(loc)
+        if client is None:
+            return False
+        if client.recording:
+            now = perf_counter_ns()
+            # Hand over early rather than let the ring overwrite unrecorded samples
+            pending = max(buf.total - cursor for buf, cursor in zip(client.buffers(), client.cursors))
+            if now - client.last >= self.frametime or pending >= client.accel.maxlen // 2:
+                self.record(loc, client)
+        if self.headless:
+            return self._service_headless(loc, client)
+        if self.dashboard:
+            return self._service_dashboard(loc, client)
+        try:
+            info = client.datarate.report()
+            if info is not None:  # Send data rate info to plot thread
+                client.display_dropped += put_latest(client.info, info)
+                self.post_rate(loc, client)
+            # Handle client disconnection
+            if client.shutdown.is_set():
+                if client.recording:
+                    self.stop_recording(loc, client, final=True)
+                self.clients.pop(loc).close()
+                self.exiting.append(self.threads.pop(loc))  # Reaped by :meth:`expire`
+                now = perf_counter_ns()
+                self.closed.update((source, now) for source in self.forget(loc, client))
+                print(f"[UDP{self.name}] Client {loc[0]}:{loc[1]} disconnected")
+                if self.events is not None:
+                    self.events.put_nowait(('disconnect', self.name, loc))
+                if len(self.clients) == 0 and self.exit_when_empty:
+                    print("[UDP] All clients disconnected, exiting")
+                    return True
+            # Handle data request from plot thread
+            elif client.request.get_nowait() is not None:
+                # Data is already in shared memory, only announce the frame
+                client.display_dropped += put_latest(
+                    client.response, tuple(buf.total for buf in client.buffers()))
+        except Empty:
+            pass  # No frame requested
+        except Exception as e:
+            self.error(loc, client, 'serving', e)
+        return False
+
+    def post_rate(self, loc: Any, client: Client):
+        """Post the last rates and the counts of a client to ``events``, and update the metrics."""
+        if self.events is not None:
+            self.events.put_nowait(
+                ('rate', self.name, loc, *client.datarate.rates, client.counts()))
+        self.publish(loc, client)
+
+    def publish(self, loc: Any, client: Client):
+        """Update the counts and queue depths of a client and merge the plot snapshots."""
+        metrics, source = self.metrics, source_label(loc)
+        records, bad_crc, unknown, late = client.counts()
+        metrics.counter('records_total', records, source=source)
+        for reason, count in (('bad_crc', bad_crc), ('unknown', unknown), ('late_or_duplicate', late)):
+            metrics.counter('dropped_records_total', count, source=source, reason=reason)
+        metrics.counter('dropped_records_total', client.overrun, source=source, reason='overrun')
+        metrics.counter('dropped_messages_total', client.display_dropped, source=source)
+        metrics.counter('errors_total', client.errors, source=source)
+        queues = (('request', client.request), ('response', client.response), ('info', client.info))
+        for name, queue in queues:
+            if queue is not None:
+                try:
+                    metrics.gauge('queue_depth', queue.qsize(), source=source, queue=name)
+                except NotImplementedError:
+                    pass  # No qsize() for multiprocessing queues on macOS
+        if self.backlog is not None:
+            metrics.gauge('queue_depth', self.backlog.qsize(), queue='recorder')
+            metrics.counter('spilled_frames_total', self.backlog.spilled, queue='recorder')
+            metrics.counter('dropped_frames_total', self.backlog.dropped, queue='recorder')
+        live = {source_label(loc) for loc in self.clients} | {'dashboard', 'recorder'}
+        while True:
+            try:
+                origin, entries = self.reports.get_nowait()
+            except Empty:
+                break
+            if origin in live:  # Not the last words of a closed plot window
+                metrics.merge(origin, entries)
+        now = perf_counter_ns()
+        if self.events is not None and now - self.posted >= 1e9:
+            self.posted = now
+            self.events.put_nowait(('metrics', self.name, None, metrics.snapshot()))
+
+    def _service_headless(self, loc: Any, client: Client) -> bool:
+        """Print and report the rates of a headless client."""
+        info = client.datarate.report()
+        if info is not None:
+            datarate, dataunit, packrate, packunit = info
+            stamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            print(f"[{stamp}] Source: {loc[0]}:{loc[1]}, "
+                  f"UDP Rate: {datarate:.2f} {dataunit} ({packrate:.2f} {packunit})")
+            self.post_rate(loc, client)
+        return False
+
+    def _service_dashboard(self, loc: Any, client: Client) -> bool:
+        """Report rates to the dashboard and detect that it has been closed."""
+        info = client.datarate.report()
+        if info is not None:
+            client.display_dropped += put_latest(self.board_rates, ('rate', loc, info))
+            self.post_rate(loc, client)
+        if not client.shutdown.is_set():
+            return False
+        # The dashboard window was closed, all of its clients go with it
+        now = perf_counter_ns()
+        for other in list(self.clients):
+            closed = self.clients.pop(other)
+            if closed.recording:
+                self.stop_recording(other, closed, final=True)
+            closed.close()
+            self.closed.update((source, now) for source in self.forget(other, closed))
+            print(f"[UDP{self.name}] Client {other[0]}:{other[1]} disconnected")
+            if self.events is not None:
+                self.events.put_nowait(('disconnect', self.name, other))
+        self.board_proc.join()
+        self.board_proc = None
+        if self.exit_when_empty:
+            print("[UDP] All clients disconnected, exiting")
+            return True
+        return False
+
+    def service_all(self) -> bool:
+        """Serve every client, see :meth:`service`, and the Save buttons, and close expired sessions."""
+        self.control()
+        self.pump()
+        self.expire()
+        return any([self.service(loc) for loc in list(self.clients)])
+
+    def close(self):
+        """Release the shared buffers of every connected client.
+
+        Recording clients record their last samples, then the recorder closes
+        every file and exits.
+        """
+        for key, client in self.clients.items():
+            if client.recording:
+                self.stop_recording(key, client, final=True)
+            client.close()
+        self.clients.clear()
+        for proc in self.exiting:
+            proc.join()
+        self.exiting.clear()
+        if self.recorder is not None:
+            self.post(None)
+            self.pump(wait=True)
+            self.recorder.join()
+            self.recorder = None
+
 # %% UDP server loop
 
 
@@ -77,7 +910,24 @@ def udp_loop(
     datapath: Path = Path.cwd() / 'data',
     savekind: SaveKind = 'excel',
     winsize: int = 2000,
-    frametime: int = int(1e9 / 2)
+    frametime: int = int(1e9 / 2),
+    rcvbuf: int = 4 * 1024 * 1024,
+    arena_slots: int = 1024,
+    store_options: Optional[dict] = None,
+    capture: Optional[Path] = None,
+    reuseport: bool = False,
+    stop: Optional[Any] = None,
+    events: Optional[Queue] = None,
+    name: str = '',
+    headless: bool = False,
+    dashboard: bool = False,
+    plot_options: Optional[dict] = None,
+    sock: Optional[socket.socket] = None,
+    plot_target: Optional[Callable] = None,
+    metrics_port: Optional[int] = None,
+    metrics_log: Optional[Path] = None,
+    metrics_interval: float = 10.0,
+    session_timeout: float = SESSION_TIMEOUT,
 ):
     """UDP client loop.
 
@@ -85,100 +935,152 @@ def udp_loop(
         host (str): Address to bind to.
         port (int): Port to listen for UDP packets.
         datapath (Path, optional): Path to store data files. Defaults to Path.cwd() / 'data'.
-        savekind (SaveKind, optional): Kind of data storage: 'excel' or 'netcdf'. Defaults to 'excel'.
+        savekind (SaveKind, optional): Kind of data storage: 'excel', 'netcdf' or 'parquet'. Defaults to 'excel'.
         winsize (int, optional): Window size in milliseconds for displaying data. Defaults to 2000.
+        frametime (int, optional): Nanoseconds between hand-offs to the recorder. Defaults to 0.5 s.
+        rcvbuf (int, optional): Requested kernel receive buffer (SO_RCVBUF) in bytes. Defaults to 4 MiB.
+        arena_slots (int, optional): Maximum number of datagrams drained per wakeup. Defaults to 1024.
+        store_options (Optional[dict], optional): Keyword arguments for the data storage. Defaults to None.
+        capture (Optional[Path], optional): Append every received datagram to this capture file. Defaults to None.
+        reuseport (bool, optional): Share the port with other processes (SO_REUSEPORT). Defaults to False.
+        stop (Optional[Event], optional): Run until this event is set instead of until every client disconnected. Defaults to None.
+        events (Optional[Queue], optional): Queue for client events, see :class:`Ingest`. Defaults to None.
+        name (str, optional): Worker name used in messages and events. Defaults to ''.
+        headless (bool, optional): Record every client without plotting, see :class:`Ingest`. Defaults to False.
+        dashboard (bool, optional): Plot every client in a single window, see :class:`Ingest`. Defaults to False.
+        plot_options (Optional[dict], optional): Keyword arguments for :func:`plot.draw_loop`. Defaults to None.
+        sock (Optional[socket.socket], optional): Socket already bound with :func:`bind_udp`.
+            Defaults to None, binding ``host``:``port`` here.
+        plot_target (Optional[Callable], optional): Run in each plot process instead of
+            :func:`plot.draw_loop`, e.g. a load test consumer. Defaults to None.
+        metrics_port (Optional[int], optional): Serve the metrics in the Prometheus text format
+            on this HTTP port, see :mod:`metrics`. Defaults to None.
+        metrics_log (Optional[Path], optional): Append the metrics to this JSON lines file. Defaults to None.
+        metrics_interval (float, optional): Seconds between lines of ``metrics_log``. Defaults to 10.0.
+        session_timeout (float, optional): Seconds without data before a board's session is closed,
+            0 keeps sessions forever, see :class:`Ingest`. Defaults to 120.
     """
-    # Dictionary of clients
-    clients: dict[Any, Client] = {}
-    # Dictionary of plot processes
-    threads: dict[Any, Process] = {}
-    # Set of disconnected clients
-    closed: set = set()
-    # Create UDP socket
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.bind((host, port))  # Bind to address and port
-    print(f"[UDP] Listening for UDP packets on {host}:{port}")
-
-    while True:  # Main event loop
-        # Try to receive UDP packet
+    ingest = Ingest(
+        datapath, savekind, winsize, store_options,
+        events=events, name=name, exit_when_empty=stop is None,
+        headless=headless, frametime=frametime, dashboard=dashboard,
+        plot_options=plot_options, plot_target=plot_target, session_timeout=session_timeout)
+    writer = CaptureWriter(capture) if capture is not None else None
+    if sock is None:
+        sock = bind_udp(host, port, rcvbuf, reuseport, name)
+    sock.setblocking(False)  # Drained in bulk after select() wakes up
+    arena = RecvArena(arena_slots)
+    print(f"[UDP{name}] Listening for UDP packets on {host}:{port} "
+          f"(receive buffer: {sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)} bytes)")
+    if writer is not None:
+        print(f"[UDP] Capturing datagrams to {capture}")
+    export = None
+    if metrics_port is not None or metrics_log is not None:
+        export = MetricsExport(ingest.metrics, metrics_port, metrics_log, metrics_interval)
+    receive_time = ingest.metrics.histogram('receive')
+    short = 0  # Incomplete datagrams dropped
+    ingest.preload()
+    serviced = perf_counter_ns()
+
+    while stop is None or not stop.is_set():  # Main event loop
         try:
-            temp, loc = sock.recvfrom(SINGLE_MEASUREMENT_SIZE)
-            # New client connected
-            if loc not in clients and loc not in closed:
-                # Create queues and event to communicate with plot thread for client
-                request = Queue(maxsize=1)
-                response = Queue()
-                info = Queue()
-                shutdown = Event()
-                client = Client(
-                    DataBuffer(maxlen=winsize),
-                    DataBuffer(maxlen=winsize),
-                    DataBuffer(maxlen=winsize),
-                    DataBuffer(maxlen=winsize),
-                    request,
-                    response,
-                    info,
-                    shutdown,
-                    DataRate(update_rate=1.0)
-                )
-                # Start plot thread for client
-                proc = Process(None, draw_loop, args=(
-                    loc, request, response, info, shutdown, datapath, savekind, winsize))
-                proc.start()
-                threads[loc] = proc
-                clients[loc] = client
-                print(f"[UDP] New client connected: {loc[0]}:{loc[1]}")
+            # Serve quiet clients too, also while others keep the socket busy
+            if perf_counter_ns() - serviced >= SERVICE:
+                serviced = perf_counter_ns()
+                if ingest.service_all():
+                    break
+            # Wait for packets, then drain everything pending into the arena
+            ready, _, _ = select.select([sock], [], [], SERVICE / 1e9)
+            if not ready:
+                continue
+            start = perf_counter_ns()
+            arena.drain(sock)
+            receive_time.observe(perf_counter_ns() - start)
         except KeyboardInterrupt:
             print("[UDP] Interrupted by user")
-            sock.close()
             break
         except Exception as e:
             print(f"[UDP] Connection lost: {e}")
             continue
-        # Process received packet
-        try:
-            client = clients[loc]  # Retrieve the client communication objects
-            info = client.datarate.update(len(temp))  # Update data rate
-            if info is not None:  # Send data rate info to plot thread
-                client.info.put_nowait(info)
-            # Decode the packet and store data in buffers
-            decode_packet(
-                temp,
-                client.accel, client.gyro,
-                client.mag, client.baro
-            )
-            # Handle client disconnection
-            if client.shutdown.is_set():
-                clients.pop(loc)
-                threads.pop(loc).join()
-                closed.add(loc)
-                print(f"[UDP] Client {loc[0]}:{loc[1]} disconnected")
-                if len(clients) == 0:
-                    print("[UDP] All clients disconnected, exiting")
-                    sock.close()
-                    break
-            # Handle data request from plot thread
-            # elif (perf_counter_ns() - client.last) > frametime:
-            #     client.last = perf_counter_ns()
-            elif client.request.get_nowait() is not None:
-                # Prepare dataframes and send to plot thread
-                accel = client.accel.to_dataframe(
-                    ['tstamp', 'x', 'y', 'z']
-                )
-                gyro = client.gyro.to_dataframe(['tstamp', 'x', 'y', 'z'])
-                mag = client.mag.to_dataframe(['tstamp', 'x', 'y', 'z'])
-                baro = client.baro.to_dataframe(
-                    ('tstamp', 'temperature', 'pressure', 'altitude')
-                )
-                client.response.put_nowait((accel, gyro, mag, baro))
-        except struct.error as e:
-            # type: ignore
-            print(
-                f"[UDP] Error unpacking data: {e}, received data ({len(temp)}): {temp}")
+        if arena.count == 0:
             continue
-        except Exception as e:
-            pass
+        if writer is not None:
+            writer.write(time_ns(), arena.buffer,
+                         arena.addrs[:arena.count], arena.nbytes)
+        try:
+            if any(ingest.feed(loc, temp) for loc, temp in arena.batches()):
+                break
         except KeyboardInterrupt:
             print("[UDP] Interrupted by user")
-            sock.close()
             break
+        if arena.short:
+            short += arena.short
+            ingest.metrics.counter('dropped_records_total', short, reason='short')
+    sock.close()
+    ingest.close()
+    if export is not None:
+        export.close()
+    if writer is not None:
+        writer.close()
+        print(f"[UDP] Captured {writer.count} datagrams to {capture}")
+
+# %% Capture replay
+
+
+def replay_loop(
+    path: Path,
+    speed: float = 1.0,
+    datapath: Path = Path.cwd() / 'data',
+    savekind: SaveKind = 'excel',
+    winsize: int = 2000,
+    arena_slots: int = 1024,
+    store_options: Optional[dict] = None,
+    headless: bool = False,
+    dashboard: bool = False,
+    plot_options: Optional[dict] = None,
+):
+    """Feed a capture file through the same ingest path as :func:`udp_loop`.
+
+    Args:
+        path (Path): Capture file written with ``--capture``.
+        speed (float, optional): Replay speed relative to the recording, 0 replays as fast as possible. Defaults to 1.0.
+        datapath (Path, optional): Path to store data files. Defaults to Path.cwd() / 'data'.
+        savekind (SaveKind, optional): Kind of data storage: 'excel', 'netcdf' or 'parquet'. Defaults to 'excel'.
+        winsize (int, optional): Window size in milliseconds for displaying data. Defaults to 2000.
+        arena_slots (int, optional): Maximum number of records fed per batch. Defaults to 1024.
+        store_options (Optional[dict], optional): Keyword arguments for the data storage. Defaults to None.
+        headless (bool, optional): Record every client without plotting, see :class:`Ingest`. Defaults to False.
+        dashboard (bool, optional): Plot every client in a single window, see :class:`Ingest`. Defaults to False.
+        plot_options (Optional[dict], optional): Keyword arguments for :func:`plot.draw_loop`. Defaults to None.
+    """
+    recs = read_capture(path)
+    addrs, index = source_addresses(recs)
+    arrival = recs['arrival']
+    ingest = Ingest(
+        datapath, savekind, winsize, store_options,
+        headless=headless, dashboard=dashboard, plot_options=plot_options)
+    arena = RecvArena(arena_slots)
+    print(f"[Replay] Replaying {len(recs)} datagrams from {len(addrs)} sources in {path} "
+          f"at {'maximum' if speed <= 0 else f'{speed:g}x'} speed")
+    pos = 0
+    start = perf_counter_ns()
+    try:
+        while pos < len(recs):
+            stop = min(pos + arena_slots, len(recs))
+            if speed > 0:
+                # Feed everything that has arrived by now on the replay clock
+                now = arrival[0] + (perf_counter_ns() - start) * speed
+                stop = min(stop, int(np.searchsorted(arrival, now, side='right')))
+                if stop <= pos:
+                    sleep(min((arrival[pos] - now) / speed / 1e9, 0.1))
+                    continue
+            chunk = recs[pos:stop]
+            arena.load(chunk['payload'], [addrs[i] for i in index[pos:stop]], chunk['size'])
+            pos = stop
+            if any(ingest.feed(loc, temp) for loc, temp in arena.batches()):
+                break
+    except KeyboardInterrupt:
+        print("[Replay] Interrupted by user")
+    elapsed = (perf_counter_ns() - start) / 1e9
+    print(f"[Replay] Fed {pos} datagrams in {elapsed:.2f} s ({pos / max(elapsed, 1e-9):.0f} datagrams/s)")
+    ingest.close()
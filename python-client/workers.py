@@ -0,0 +1,191 @@
+# %%
+from __future__ import annotations
+from multiprocessing import Event, Pipe, Process, Queue
+from multiprocessing.connection import Connection
+from pathlib import Path
+from queue import Empty
+import select
+import socket
+import sys
+from time import monotonic, perf_counter_ns
+from typing import Any, Dict, List, Optional, Tuple
+
+from metrics import Metrics, MetricsExport
+from storesystem import SaveKind
+from udp_socket import bind_udp
+from udp_thread import SESSION_TIMEOUT, Ingest, RecvArena, udp_loop
+
+# %% Multi-process ingest
+#
+# On Linux every worker binds its own socket to the port with SO_REUSEPORT
+# and the kernel pins each source address to one of them. Other systems
+# either lack the option or, like macOS and the BSDs, deliver every datagram
+# to one of the sockets only; there the supervisor receives all datagrams
+# itself and forwards every source to the worker chosen by hashing its
+# address. Either way each board is handled by a single worker, which owns
+# its buffers and plot process. Workers post client events to the
+# supervisor, which merges the rates and exports the metrics of all workers
+# with a ``worker`` label.
+
+REUSEPORT = sys.platform.startswith('linux') and hasattr(socket, 'SO_REUSEPORT')
+
+
+def pipe_worker(
+    conn: Connection,
+    stop: Any,
+    events: Queue,
+    name: str,
+    datapath: Path,
+    savekind: SaveKind,
+    winsize: int,
+    store_options: Optional[dict],
+    headless: bool = False,
+    dashboard: bool = False,
+    plot_options: Optional[dict] = None,
+    session_timeout: float = SESSION_TIMEOUT,
+):
+    """Ingest worker fed by the supervisor through ``conn``."""
+    ingest = Ingest(
+        datapath, savekind, winsize, store_options,
+        events=events, name=name, exit_when_empty=False,
+        headless=headless, dashboard=dashboard, plot_options=plot_options,
+        session_timeout=session_timeout)
+    ingest.preload()
+    try:
+        while not stop.is_set():
+            if conn.poll(0.1):
+                loc, temp = conn.recv()
+                ingest.feed(loc, temp)
+            else:
+                ingest.service_all()
+    except (KeyboardInterrupt, EOFError):
+        pass
+    ingest.close()
+
+
+def supervise(
+    workers: int,
+    host: str,
+    port: int,
+    datapath: Path = Path.cwd() / 'data',
+    savekind: SaveKind = 'excel',
+    winsize: int = 2000,
+    rcvbuf: int = 4 * 1024 * 1024,
+    store_options: Optional[dict] = None,
+    report: float = 2.0,
+    headless: bool = False,
+    dashboard: bool = False,
+    plot_options: Optional[dict] = None,
+    metrics_port: Optional[int] = None,
+    metrics_log: Optional[Path] = None,
+    metrics_interval: float = 10.0,
+    session_timeout: float = SESSION_TIMEOUT,
+):
+    """Run ``workers`` ingest processes and merge their statistics.
+
+    Args:
+        workers (int): Number of ingest processes.
+        host (str): Address to bind to.
+        port (int): Port to listen for UDP packets.
+        datapath (Path, optional): Path to store data files. Defaults to Path.cwd() / 'data'.
+        savekind (SaveKind, optional): Kind of data storage. Defaults to 'excel'.
+        winsize (int, optional): Window size in milliseconds for displaying data. Defaults to 2000.
+        rcvbuf (int, optional): Requested kernel receive buffer (SO_RCVBUF) in bytes. Defaults to 4 MiB.
+        store_options (Optional[dict], optional): Keyword arguments for the data storage. Defaults to None.
+        report (float, optional): Seconds between merged rate reports. Defaults to 2.0.
+        headless (bool, optional): Record every client without plotting, see :class:`udp_thread.Ingest`. Defaults to False.
+        dashboard (bool, optional): One dashboard window per worker instead of one window per client. Defaults to False.
+        plot_options (Optional[dict], optional): Keyword arguments for :func:`plot.draw_loop`. Defaults to None.
+        metrics_port (Optional[int], optional): Serve the metrics of every worker on this HTTP port,
+            see :mod:`metrics`. Defaults to None.
+        metrics_log (Optional[Path], optional): Append the metrics to this JSON lines file. Defaults to None.
+        metrics_interval (float, optional): Seconds between lines of ``metrics_log``. Defaults to 10.0.
+        session_timeout (float, optional): Seconds without data before a board's session is closed,
+            0 keeps sessions forever, see :class:`udp_thread.Ingest`. Defaults to 120.
+    """
+    metrics = Metrics()
+    export = None
+    if metrics_port is not None or metrics_log is not None:
+        export = MetricsExport(metrics, metrics_port, metrics_log, metrics_interval)
+    events = Queue()
+    stop = Event()
+    procs: List[Process] = []
+    pipes: List[Connection] = []
+    sock: Optional[socket.socket] = None
+    if REUSEPORT:
+        for i in range(workers):
+            procs.append(Process(target=udp_loop, args=(host, port), kwargs=dict(
+                datapath=datapath, savekind=savekind, winsize=winsize, rcvbuf=rcvbuf,
+                store_options=store_options, reuseport=True, stop=stop,
+                events=events, name=f':w{i}', headless=headless,
+                dashboard=dashboard, plot_options=plot_options, session_timeout=session_timeout)))
+        print(f"[Supervisor] Starting {workers} workers sharing {host}:{port} (SO_REUSEPORT)")
+    else:
+        for i in range(workers):
+            recv, send = Pipe(duplex=False)
+            pipes.append(send)
+            procs.append(Process(target=pipe_worker, args=(
+                recv, stop, events, f':w{i}', datapath, savekind, winsize, store_options, headless, dashboard, plot_options,
+                session_timeout)))
+        sock = bind_udp(host, port, rcvbuf)
+        sock.setblocking(False)
+        receive_time = metrics.histogram('receive')
+        print(f"[Supervisor] Listening on {host}:{port}, forwarding sources to {workers} workers")
+    for proc in procs:
+        proc.start()
+
+    arena = RecvArena()
+    owner: Dict[Any, int] = {}  # Worker index of each source, pipe mode only
+    connected: Dict[Any, str] = {}  # Worker name of each connected client
+    rates: Dict[Any, Tuple[float, float]] = {}  # Last (bits/s, packets/s) per client
+    seen = False
+    last = monotonic()
+    try:
+        while any(proc.is_alive() for proc in procs):
+            if sock is not None:
+                ready, _, _ = select.select([sock], [], [], 0.1)
+                start = perf_counter_ns()
+                if ready and arena.drain(sock):
+                    receive_time.observe(perf_counter_ns() - start)
+                    for loc, temp in arena.batches():
+                        idx = owner.setdefault(loc, hash(loc) % workers)
+                        pipes[idx].send((loc, bytes(temp)))
+            else:
+                stop.wait(0.1)
+            # Merge worker events
+            while True:
+                try:
+                    kind, name, loc, *rest = events.get_nowait()
+                except Empty:
+                    break
+                if kind == 'connect':
+                    connected[loc] = name
+                    seen = True
+                elif kind == 'disconnect':
+                    connected.pop(loc, None)
+                    rates.pop(loc, None)
+                elif kind == 'rate':
+                    rates[loc] = (rest[0], rest[1])
+                elif kind == 'metrics':
+                    metrics.merge(name, rest[0], worker=name[1:])
+            if seen and not connected:
+                print("[Supervisor] All clients disconnected, exiting")
+                break
+            if monotonic() - last >= report and connected:
+                last = monotonic()
+                per_worker: Dict[str, int] = {}
+                for name in connected.values():
+                    per_worker[name] = per_worker.get(name, 0) + 1
+                bps = sum(rate[0] for rate in rates.values())
+                pps = sum(rate[1] for rate in rates.values())
+                print(f"[Supervisor] {len(connected)} clients, {pps:.0f} packets/s, {bps / 1024:.2f} Kbps "
+                      f"({', '.join(f'{name[1:]}: {count}' for name, count in sorted(per_worker.items()))})")
+    except KeyboardInterrupt:
+        print("[Supervisor] Interrupted by user")
+    stop.set()
+    for proc in procs:
+        proc.join()
+    if sock is not None:
+        sock.close()
+    if export is not None:
+        export.close()
@@ -4,52 +4,56 @@ from datetime import datetime
 from pathlib import Path
 from queue import Queue, ShutDown
 from threading import Thread
-from typing import Iterable, List, Optional, Tuple
-from matplotlib.axes import Axes
-from matplotlib.widgets import Button
-from pandas import DataFrame, ExcelWriter
+from time import perf_counter_ns
+from typing import TYPE_CHECKING, List, Optional, Tuple
+from openpyxl import Workbook
+from openpyxl.worksheet._write_only import WriteOnlyWorksheet
+from pandas import DataFrame
 
+from backpressure import RECORD_DEPTH, Overflow, RecordQueue
 from storesystem import StoreSystem
 
+if TYPE_CHECKING:
+    from metrics import Histogram
+
+MAX_ROWS = 1_048_576  # Excel's row limit per sheet
+
 
 class XlsxDataset(StoreSystem):
-    def __init__(self, dir: Path, axis: Axes):
-        self.button = Button(axis, 'Save')
-        self.button.on_clicked(self.callback)
+    def __init__(
+        self, dir: Path,
+        prefix: str = 'data', write_time: Optional[Histogram] = None,
+        queue_size: int = RECORD_DEPTH, overflow: Overflow = 'spill'
+    ):
+        """Excel storage of one recording, from now until :meth:`close`.
+
+        Args:
+            dir (Path): Directory for the data files.
+            prefix (str, optional): File name prefix, followed by the start time. Defaults to 'data'.
+            write_time (Optional[Histogram], optional): Times every write of the storage thread. Defaults to None.
+            queue_size (int, optional): Frames waiting for the storage thread in memory. Defaults to RECORD_DEPTH.
+            overflow (Overflow, optional): When more are waiting, 'block' the caller, 'spill'
+                them to a temporary file or 'drop' them, see :class:`backpressure.RecordQueue`.
+                Defaults to 'spill'.
+        """
         self._dir = dir
         if not self._dir.exists():
             self._dir.mkdir(parents=True, exist_ok=True)
-        self.queue: Optional[Queue] = None
-        self.ncthread: Optional[XlsxThread] = None
-
-    def get_artist(self):
-        return self.button
-
-    def callback(self, evt):
-        # print(f"Button clicked, {self.queue is None}, {self.ncthread is None}")
-        if self.queue is None:
-            self.button.label.set_text('Close')
-            self.queue = Queue()
-            self.ncthread = XlsxThread(
-                self.queue, self._dir / f"data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx")
-            self.ncthread.start()
-        else:
-            self.button.label.set_text('Save')
-            self.queue.shutdown(immediate=True)
-            self.queue = None
-            if self.ncthread is not None:
-                self.ncthread.join()
-                self.ncthread = None
+        self.queue: Optional[Queue] = RecordQueue(queue_size, overflow, self._dir)
+        self.ncthread: Optional[XlsxThread] = XlsxThread(
+            self.queue, self._dir / f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+            write_time)
+        self.ncthread.start()
 
     def update(self, data: List[Tuple[int, DataFrame]]):
         if self.queue is not None:
-            self.queue.put(data)
+            self.queue.offer(data)
         else:
             pass
 
     def close(self):
         if self.queue is not None:
-            self.queue.shutdown(immediate=True)
+            self.queue.shutdown()  # Write what is still queued
             self.queue = None
         if self.ncthread is not None:
             self.ncthread.join()
@@ -60,30 +64,65 @@ class XlsxDataset(StoreSystem):
 
 
 class XlsxThread(Thread):
-    def __init__(self, queue: Queue, name: Path):
+    def __init__(self, queue: Queue, name: Path, write_time: Optional[Histogram] = None):
         super().__init__()
         self.queue = queue
         self.fname = name
-        self.writer: Optional[ExcelWriter] = None
+        self.write_time = write_time
+        self.workbook: Optional[Workbook] = None
 
     def run(self):
         # Implement the thread's activity here
         kinds = ['accel', 'gyro', 'mag', 'baro']
-        if self.writer is None:
-            self.writer = ExcelWriter(self.fname, engine='openpyxl')
+        if self.workbook is None:
+            # Write-only workbooks stream rows to temporary files
+            self.workbook = Workbook(write_only=True)
         print(f"Excel file {self.fname} opened")
+        sheets = [XlsxSheetWriter(self.workbook, kind) for kind in kinds]
         while True:
             try:
                 data = self.queue.get()
             except ShutDown:
                 break
-            for (kind, df) in zip(kinds, data):
-                df: DataFrame = df
-                update_dataset(self.writer, df, kind)
-        self.writer.close()
+            start = perf_counter_ns()
+            for (sheet, df) in zip(sheets, data):
+                sheet.update(df)
+            if self.write_time is not None:
+                self.write_time.observe(perf_counter_ns() - start)
+        self.workbook.save(self.fname)
+        self.workbook.close()
         print(f"Excel file {self.fname} closed")
 
 
-def update_dataset(writer: ExcelWriter, df: DataFrame, id: str):
-    """Update the netCDF4 Dataset with new data from the DataFrame."""
-    df.to_excel(writer, sheet_name=id, index=False)
+class XlsxSheetWriter:
+    """Appends the new rows of one sensor to its sheet(s).
+
+    The recorder hands over every sample once, see :mod:`recorder`. When a
+    sheet reaches Excel's row limit writing continues on a new sheet named
+    ``<id>_2``, ``<id>_3``, ...
+    """
+
+    def __init__(self, workbook: Workbook, id: str):
+        self.workbook = workbook
+        self.id = id
+        self.sheet: Optional[WriteOnlyWorksheet] = None
+        self.nsheets = 0
+        self.rows = 0  # Rows in the current sheet, including the header
+
+    def _new_sheet(self, columns):
+        self.nsheets += 1
+        title = self.id if self.nsheets == 1 else f"{self.id}_{self.nsheets}"
+        self.sheet = self.workbook.create_sheet(title)
+        self.sheet.append(list(columns))
+        self.rows = 1
+
+    def update(self, df: DataFrame):
+        if len(df) == 0:
+            return
+        if self.sheet is None:
+            self._new_sheet(df.columns)
+        for row in zip(*(df[col].tolist() for col in df.columns)):
+            if self.rows >= MAX_ROWS:
+                self._new_sheet(df.columns)
+            self.sheet.append(row)  # type: ignore
+            self.rows += 1